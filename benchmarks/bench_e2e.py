@@ -0,0 +1,214 @@
+#!/usr/bin/env python
+
+# End-to-end throughput regression harness: writes a small synthetic run (synthetic_run.py) in each raw data
+# tier, reconstructs it with reconstruction.py fully offline (no cloud, no logbook) with several --jobs
+# settings, and records for each (tier, jobs):
+#  - wall time and events/s of the whole job (including the start-up and the merging of the chunks)
+#  - peak RSS of each worker (from the instrumentation summary)
+#  - size of the output file
+#  - some physics outputs (number of superclusters, their total integral, energy and number of hits)
+#
+#    python benchmarks/bench_e2e.py --tiers root,midas --jobs 1,4,-1 --events 20 -o e2e.json
+#    python benchmarks/bench_e2e.py ... --baseline benchmarks/e2e_baseline.json --fail-on-regression
+#    python benchmarks/bench_e2e.py --tiers root --jobs 1,2,4,8 --executors process,thread
+#
+# With --executors process,thread each --jobs setting is run also with --executor thread (one process, a pool of
+# threads): its results are stored with the key t<jobs> next to the process ones, to compare the scaling and the
+# peak RSS of the two modes.
+#
+# The check fails if the throughput drops by more than --tolerance wrt the baseline, or if the physics outputs
+# differ from the baseline, or between the --jobs settings of the same tier, by more than --physics-tolerance.
+# The reconstruction runs in a work directory with links to the repository, so that the synthetic pedestal
+# map and runlog do not end up in the repository.
+
+import os,sys,time,json,shutil,platform,subprocess
+from optparse import OptionParser
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0,os.path.join(REPO,'benchmarks'))
+sys.path.insert(0,REPO)
+
+PHYSICS = ['events','nSc','sc_integral','sc_energy','sc_nhits']
+
+def prepareWorkdir(workdir):
+    # links to everything in the repository, but a private pedestals/ directory
+    os.makedirs(os.path.join(workdir,'pedestals'),exist_ok=True)
+    for entry in os.listdir(REPO):
+        dst = os.path.join(workdir,entry)
+        if entry == 'pedestals' or os.path.lexists(dst): continue
+        os.symlink(os.path.join(REPO,entry),dst)
+    for entry in os.listdir(os.path.join(REPO,'pedestals')):
+        dst = os.path.join(workdir,'pedestals',entry)
+        if not os.path.lexists(dst):
+            os.symlink(os.path.join(REPO,'pedestals',entry),dst)
+
+def writeConfig(fname,base,**overrides):
+    params = eval(open(os.path.join(REPO,base)).read())
+    params.update(overrides)
+    with open(fname,'w') as fout:
+        fout.write('{\n'+''.join(['{k!r:30s}: {v!r},\n'.format(k=k,v=v) for k,v in params.items()])+'}\n')
+
+def physicsOutputs(fname):
+    import ROOT
+    tf = ROOT.TFile.Open(fname)
+    tree = tf.Get('Events')
+    ret = {k: 0. for k in PHYSICS}
+    for ev in tree:
+        ret['events'] += 1
+        ret['nSc'] += ev.nSc
+        ret['sc_integral'] += sum(ev.sc_integral)
+        ret['sc_energy'] += sum(ev.sc_energy)
+        ret['sc_nhits'] += sum(ev.sc_nhits)
+    tf.Close()
+    return ret
+
+def runReco(workdir,config,run,jobs,rawdir,outdir,logfile,executor='process'):
+    os.makedirs(outdir,exist_ok=True)
+    cmd = [sys.executable,'reconstruction.py',config,'-r',str(run),'-j',str(jobs),'-t',rawdir,'--cache-dir',rawdir,
+           '-d',outdir,'--pdir',os.path.join(outdir,'plots'),'--git','synthetic','--checkpoint-every','0','--executor',executor]
+    t0 = time.perf_counter()
+    with open(logfile,'w') as log:
+        ret = subprocess.call(cmd,cwd=workdir,stdout=log,stderr=subprocess.STDOUT)
+    return ret,time.perf_counter()-t0
+
+def resultKey(jobs,executor):
+    # the process results keep the plain --jobs key of the older results (baselines)
+    return str(jobs) if executor == 'process' else 't{j}'.format(j=jobs)
+
+def measure(options,workdir,tier,jobs,executor='process'):
+    tag = '{tier}_j{j}'.format(tier=tier,j=resultKey(jobs,executor)).replace('-','m')
+    outdir = os.path.join(workdir,'out_'+tag)
+    shutil.rmtree(outdir,ignore_errors=True)
+    config = 'configFile_bench_{tier}.txt'.format(tier=tier)
+    ret,wall = runReco(workdir,config,options.run,jobs,os.path.join(workdir,'raw'),outdir,outdir+'.log',executor)
+    if ret != 0:
+        print("ERROR: reconstruction of {t} failed (exit code {r}), see {log}".format(t=tag,r=ret,log=outdir+'.log'))
+        return {'status': 'failed', 'exit_code': ret, 'wall_time': wall}
+    base = 'reco_run{r:05d}_{tip}'.format(r=options.run,tip=options.tip)
+    outfile = os.path.join(outdir,base+'.root')
+    result = {'status': 'ok', 'wall_time': wall, 'events_per_s': options.events/wall,
+              'output_size': os.path.getsize(outfile), 'physics': physicsOutputs(outfile)}
+    instrfile = os.path.join(outdir,base+'_instrumentation.json')
+    if os.path.isfile(instrfile):
+        with open(instrfile) as fin:
+            summary = json.load(fin)
+        result['rss_peak_workers'] = [w['rss_peak'] for w in summary['workers']]
+        result['reco_wall_time_max'] = summary['wall_time_max']
+    return result
+
+def relDiff(a,b):
+    return abs(a-b)/max(abs(a),abs(b)) if max(abs(a),abs(b))>0 else 0.
+
+def check(results,baseline,tolerance,physTolerance):
+    # returns the list of the failures: throughput drops and physics drifts
+    failures = []
+    for tier,byjobs in results.items():
+        ref = None
+        for jobs,res in byjobs.items():
+            if res['status'] != 'ok':
+                failures.append('{t} -j {j}: reconstruction failed'.format(t=tier,j=jobs))
+                continue
+            # the physics does not depend on the scheduling
+            if ref is None:
+                ref = (jobs,res['physics'])
+            for k in PHYSICS:
+                if relDiff(res['physics'][k],ref[1][k]) > physTolerance:
+                    failures.append('{t} -j {j}: {k} = {v} differs from -j {jr} ({vr})'.format(t=tier,j=jobs,k=k,v=res['physics'][k],jr=ref[0],vr=ref[1][k]))
+            base = baseline.get(tier,{}).get(jobs) if baseline else None
+            if not base or base['status'] != 'ok': continue
+            ratio = res['events_per_s']/base['events_per_s']
+            res['throughput_ratio'] = ratio
+            if ratio < 1-tolerance:
+                failures.append('{t} -j {j}: throughput {v:.3f} ev/s, baseline {b:.3f} ev/s'.format(t=tier,j=jobs,v=res['events_per_s'],b=base['events_per_s']))
+            for k in PHYSICS:
+                if relDiff(res['physics'][k],base['physics'][k]) > physTolerance:
+                    failures.append('{t} -j {j}: {k} = {v} drifted from the baseline ({b})'.format(t=tier,j=jobs,k=k,v=res['physics'][k],b=base['physics'][k]))
+    return failures
+
+if __name__ == '__main__':
+    parser = OptionParser(usage='%prog [opts]')
+    parser.add_option(      '--tiers', dest='tiers', default='root,h5,midas', type='string', help='comma-separated raw data tiers to test')
+    parser.add_option('-j', '--jobs', dest='jobs', default='1,4,-1', type='string', help='comma-separated --jobs settings')
+    parser.add_option(      '--executors', dest='executors', default='process', type='string', help='comma-separated --executor modes of the reconstruction (process, thread)')
+    parser.add_option('-n', '--events', dest='events', default=20, type='int', help='number of events of the synthetic run')
+    parser.add_option('-c', '--config', dest='config', default='configFile_LNGS.txt', type='string', help='configuration file the test configurations are derived from')
+    parser.add_option('-g', '--geometry', dest='geometry', default='lime', type='string', help='detector geometry')
+    parser.add_option(      '--run', dest='run', default=90001, type='int', help='run number of the synthetic run')
+    parser.add_option(      '--pedrun', dest='pedrun', default=90000, type='int', help='run number of the synthetic pedestal map')
+    parser.add_option(      '--seed', dest='seed', default=0, type='int', help='seed of the frame generator')
+    parser.add_option(      '--pmt', dest='pmt', action='store_true', default=False, help='reconstruct also the PMT waveforms of the MIDAS run')
+    parser.add_option('-w', '--workdir', dest='workdir', default=None, type='string', help='work directory (default: /tmp/<user>/bench_e2e, removed at the end unless --keep). A kept work directory is reused, and the synthetic files are written only once')
+    parser.add_option(      '--keep', dest='keep', action='store_true', default=False, help='keep the work directory at the end')
+    parser.add_option('-o', '--output', dest='output', default='bench_e2e.json', type='string', help='output JSON file')
+    parser.add_option('-b', '--baseline', dest='baseline', default=None, type='string', help='JSON file of a previous run to compare with')
+    parser.add_option(      '--tolerance', dest='tolerance', default=0.2, type='float', help='relative throughput drop wrt the baseline that fails the check')
+    parser.add_option(      '--physics-tolerance', dest='physTolerance', default=1e-6, type='float', help='relative difference of the physics outputs that fails the check')
+    parser.add_option(      '--fail-on-regression', dest='failOnRegression', action='store_true', default=False, help='exit code 1 if the check fails')
+    (options, args) = parser.parse_args()
+
+    from synthetic import SyntheticCamera
+    from synthetic_run import writeRun, writePedestalMap, writeRunlog, rawFileName
+
+    workdir = os.path.abspath(options.workdir if options.workdir else '/tmp/{u}/bench_e2e'.format(u=os.environ.get('USER','autoreco')))
+    output = os.path.abspath(options.output)
+    tiers = options.tiers.split(',')
+    jobs = [int(j) for j in options.jobs.split(',')]
+    executors = options.executors.split(',')
+    prepareWorkdir(workdir)
+    rawdir = os.path.join(workdir,'raw')
+    os.makedirs(rawdir,exist_ok=True)
+
+    # the synthetic run, identical in all the tiers
+    meta = {'events': options.events, 'seed': options.seed, 'geometry': options.geometry, 'run': options.run}
+    stamp = os.path.join(rawdir,'synthetic.json')
+    if not os.path.isfile(stamp) or json.load(open(stamp)) != meta:
+        for f in os.listdir(rawdir): os.remove(os.path.join(rawdir,f))
+    for tier in tiers:
+        if not os.path.isfile(os.path.join(rawdir,rawFileName(tier,options.run))):
+            print("Writing the synthetic run in the {t} format...".format(t=tier))
+            camera = SyntheticCamera(options.geometry,seed=options.seed,configdir=os.path.join(REPO,'modules_config'))
+            writeRun(tier,rawdir,options.run,camera,options.events)
+    with open(stamp,'w') as fout: json.dump(meta,fout)
+    camera = SyntheticCamera(options.geometry,seed=options.seed,configdir=os.path.join(REPO,'modules_config'))
+    writePedestalMap(os.path.join(workdir,'pedestals','pedmap_run{r}_rebin1.root'.format(r=options.pedrun)),camera)
+    tag = eval(open(os.path.join(REPO,options.config)).read())['tag']
+    writeRunlog(os.path.join(workdir,'pedestals','runlog_{tag}_auto.csv'.format(tag=tag)),tag,options.run,options.pedrun,options.events)
+
+    # one configuration per tier: offline, fixed pedestal run, no debug output
+    for tier in tiers:
+        midas = tier == 'midas'
+        writeConfig(os.path.join(workdir,'configFile_bench_{tier}.txt'.format(tier=tier)),options.config,
+                    rawdata_tier=tier,geometry=options.geometry,pedrun=options.pedrun,offline=True,debug_mode=0,
+                    justPedestal=False,donotremove=True,camera_mode=1,environment_variables=midas,
+                    pmt_mode=int(midas and options.pmt),include_gem=int(midas and options.pmt))
+    options.tip = eval(open(os.path.join(REPO,options.config)).read())['tip']
+
+    results = {}
+    for tier in tiers:
+        results[tier] = {}
+        for executor,j in [(e,j) for e in executors for j in jobs]:
+            print("Reconstructing the {t} run with -j {j} --executor {e}...".format(t=tier,j=j,e=executor))
+            res = measure(options,workdir,tier,j,executor)
+            results[tier][resultKey(j,executor)] = res
+            if res['status'] == 'ok':
+                print("   {ev:.3f} events/s, peak RSS {m:.0f} MB, output {s:.1f} MB, {n:.0f} superclusters".format(
+                    ev=res['events_per_s'],m=max(res.get('rss_peak_workers',[0]))/1e6,s=res['output_size']/1e6,n=res['physics']['nSc']))
+
+    baseline = None
+    if options.baseline:
+        with open(options.baseline) as fin:
+            baseline = json.load(fin)['results']
+    failures = check(results,baseline,options.tolerance,options.physTolerance)
+    for f in failures:
+        print("FAILED: ",f)
+    if not failures:
+        print("All the checks passed")
+    with open(output,'w') as fout:
+        json.dump({'meta': dict(meta,tiers=tiers,jobs=jobs,executors=executors,config=options.config,host=platform.node(),
+                                ncpu=os.cpu_count(),python=platform.python_version()),
+                   'results': results,'failures': failures},fout,indent=1)
+    print("Results written to ",output)
+    if not options.keep and not options.workdir:
+        shutil.rmtree(workdir,ignore_errors=True)
+    if failures and options.failOnRegression:
+        sys.exit(1)
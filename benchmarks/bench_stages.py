@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+
+# Micro-benchmarks of the camera reconstruction stages on synthetic frames (see synthetic.py).
+# Each stage is timed in isolation, on the inputs prepared by running the previous stages once:
+#
+#    python benchmarks/bench_stages.py --geometry lime --frames 5 --repeat 3 -o bench.json
+#    python benchmarks/bench_stages.py ... --baseline benchmarks/baseline_lime.json --tolerance 0.2
+#
+# The result is a JSON file with the min/median/mean time of each stage (per call, in seconds). With
+# --baseline every stage is compared with the stored result, and stages slower than the baseline by more
+# than --tolerance are reported as regressions (exit code 1 with --fail-on-regression).
+
+import os,sys,time,json,platform,subprocess
+from optparse import OptionParser
+import numpy as np
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0,REPO)
+
+STAGES = ['pedsub','zsfullres','arrrebin','median_filter','nred_cython','ddbscan_fit',
+          'cluster_build','calc_profiles','calibrated_energy','fill_cluster_variables']
+
+class StageTimer:
+    def __init__(self,repeat):
+        self.repeat = repeat
+        self.times = {s: [] for s in STAGES}
+
+    def time(self,stage,func,*args,**kwargs):
+        # the stage is run 'repeat' times, the result of the last call is returned
+        for i in range(self.repeat):
+            t0 = time.perf_counter()
+            ret = func(*args,**kwargs)
+            self.times[stage].append(time.perf_counter()-t0)
+        return ret
+
+    def summary(self):
+        ret = {}
+        for stage,times in self.times.items():
+            if not times: continue
+            ret[stage] = {'calls': len(times), 'min': min(times), 'median': float(np.median(times)), 'mean': float(np.mean(times))}
+        return ret
+
+def buildClusters(X,labels,rebin,img_fr,img_fr_zs,geometry,fullinfo):
+    # as in SnakesFactory.getClusters
+    from clusterTools import Cluster
+    clusters = []
+    for k in set(labels[:,0]):
+        if k == -1: continue
+        xy = np.unique(X[labels[:,0]==k],axis=0)
+        if len(xy)>1:
+            cl = Cluster(xy,rebin,img_fr,img_fr_zs,geometry,debug=False,fullinfo=fullinfo,clID=k)
+            cl.iteration = 0
+            cl.pearson = 999
+            clusters.append(cl)
+    return clusters
+
+def calcProfiles(clusters):
+    for k,cl in enumerate(clusters):
+        cl.calcProfiles(name='bench_cluster{k}'.format(k=k),plot=False)
+
+def calibrate(calibrator,clusters):
+    for cl in clusters:
+        cl.calibratedEnergy,slices,cl.centers = calibrator.calibratedEnergy(cl.hits_fr)
+        cl.nslices = len(slices)
+        cl.energyprofile = slices
+        cl.pathlength = calibrator.clusterLength()
+
+def runBenchmark(options):
+    import ROOT
+    ROOT.gROOT.SetBatch(True)
+    from scipy.ndimage import median_filter
+    from synthetic import SyntheticCamera
+    from cameraChannel import cameraTools
+    from recoConfig import RecoConfig, loadParams
+    from cluster.ddbscan_ import DDBSCAN
+    from energyCalibrator import EnergyCalibrator
+    from output import OutputTree
+    from treeVars import AutoFillTreeProducer
+    from cython_cygno import nred_cython
+
+    params = loadParams(options.config)
+    config = RecoConfig(options.geometry)
+    rebin,nsigma = params['rebin'],params['nsigma']
+    camera = SyntheticCamera(options.geometry,seed=options.seed)
+    cg = camera.cg
+    ctools = cameraTools(cg)
+    calibrator = EnergyCalibrator(config.energyCalibrator,False)
+    tree = OutputTree(None,ROOT.TTree('Events','benchmark'))
+    autotree = AutoFillTreeProducer(tree,config.eventContent)
+    autotree.createClusterVariables('sc')
+    timer = StageTimer(options.repeat)
+    nclusters = 0
+
+    for img_fr,truth in camera.frames(options.frames,tracks=options.tracks,curly=options.curly,spots=options.spots,afterglow=options.afterglow):
+        img_cimax = np.where(img_fr < params['cimax'], img_fr, 0)
+        img_sub = timer.time('pedsub',ctools.pedsub,img_cimax,camera.pedmap)
+        img_zs = timer.time('zsfullres',ctools.zsfullres,img_sub,camera.noisemap,nsigma=nsigma)
+        img_zs_acc = ctools.acceptance(img_zs.copy(),cg.ymin,cg.ymax,cg.xmin,cg.xmax)
+        img_rb = timer.time('arrrebin',ctools.arrrebin,img_zs_acc,rebin)
+        filtimage = timer.time('median_filter',median_filter,img_zs,size=2)
+        edges = ctools.arrrebin(filtimage,rebin)
+        rescalex,rescaley = int(cg.npixx/rebin),int(cg.npixy/rebin)
+        # nred_cython works in place: each call gets a fresh copy (the copy is not timed)
+        for i in range(options.repeat):
+            edcopy = edges.copy()
+            t0 = time.perf_counter()
+            edcopyTight = nred_cython(edcopy,rescalex,rescaley,params['min_neighbors_average'])
+            timer.times['nred_cython'].append(time.perf_counter()-t0)
+        points = np.array(np.nonzero(np.round(edcopyTight))).astype(int).T
+        if len(points)==0: continue
+        sample_weight = np.take(img_rb,img_rb.shape[0]*points[:,0]+points[:,1]).astype(int)
+        sample_weight[sample_weight==0] = 1
+        ddb = timer.time('ddbscan_fit',lambda: DDBSCAN(config.clustering).fit(points,sample_weight=sample_weight))
+        img_fr_v = ctools.vignette_corr(img_sub,np.ones_like(img_sub))
+        img_fr_zs_v = ctools.vignette_corr(img_zs,np.ones_like(img_zs))
+        clusters = timer.time('cluster_build',buildClusters,points,ddb.labels_,rebin,img_fr_v,img_fr_zs_v,options.geometry,config.eventContent['scfullinfo'])
+        if not clusters: continue
+        nclusters += len(clusters)
+        timer.time('calc_profiles',calcProfiles,clusters)
+        timer.time('calibrated_energy',calibrate,calibrator,clusters)
+        timer.time('fill_cluster_variables',autotree.fillClusterVariables,clusters,'sc')
+
+    return {'meta': {'geometry': options.geometry, 'config': options.config, 'frames': options.frames, 'repeat': options.repeat,
+                     'seed': options.seed, 'tracks': options.tracks, 'curly': options.curly, 'spots': options.spots,
+                     'afterglow': options.afterglow, 'clusters': nclusters, 'host': platform.node(),
+                     'python': platform.python_version(), 'numpy': np.__version__, 'git': gitHash()},
+            'stages': timer.summary()}
+
+def gitHash():
+    try:
+        return subprocess.check_output(['git','rev-parse','--short','HEAD'],cwd=REPO).decode().strip()
+    except (OSError,subprocess.CalledProcessError):
+        return None
+
+def compare(result,baseline,tolerance):
+    # prints the comparison table and returns the list of the stages slower than the baseline by more than tolerance
+    regressions = []
+    print("{s:>24s} {t:>12s} {b:>12s} {r:>8s}".format(s='stage',t='median (ms)',b='baseline',r='ratio'))
+    for stage,st in result['stages'].items():
+        base = baseline['stages'].get(stage)
+        if base is None or base['median'] <= 0:
+            print("{s:>24s} {t:12.3f} {b:>12s}".format(s=stage,t=st['median']*1e3,b='-'))
+            continue
+        ratio = st['median']/base['median']
+        flag = ''
+        if ratio > 1+tolerance:
+            flag = '  <== REGRESSION'
+            regressions.append(stage)
+        elif ratio < 1-tolerance:
+            flag = '  (faster)'
+        print("{s:>24s} {t:12.3f} {b:12.3f} {r:8.2f}{f}".format(s=stage,t=st['median']*1e3,b=base['median']*1e3,r=ratio,f=flag))
+    result['comparison'] = {'baseline': baseline['meta'], 'tolerance': tolerance, 'regressions': regressions}
+    return regressions
+
+if __name__ == '__main__':
+    parser = OptionParser(usage='%prog [opts]')
+    parser.add_option('-g', '--geometry', dest='geometry', default='lime', type='string', help='detector geometry (modules_config/geometry_<geometry>.txt)')
+    parser.add_option('-c', '--config', dest='config', default='configFile_LNGS.txt', type='string', help='configuration file with the reconstruction parameters (rebin, nsigma, ...)')
+    parser.add_option('-n', '--frames', dest='frames', default=5, type='int', help='number of synthetic frames')
+    parser.add_option('-r', '--repeat', dest='repeat', default=3, type='int', help='number of timed calls of each stage per frame')
+    parser.add_option(      '--seed', dest='seed', default=0, type='int', help='seed of the frame generator')
+    parser.add_option(      '--tracks', dest='tracks', default=3, type='int', help='straight tracks per frame')
+    parser.add_option(      '--curly', dest='curly', default=1, type='int', help='curly tracks per frame')
+    parser.add_option(      '--spots', dest='spots', default=5, type='int', help='spots per frame')
+    parser.add_option(      '--afterglow', dest='afterglow', default=0, type='int', help='afterglow patches per frame')
+    parser.add_option('-o', '--output', dest='output', default='bench_stages.json', type='string', help='output JSON file')
+    parser.add_option('-b', '--baseline', dest='baseline', default=None, type='string', help='JSON file of a previous run to compare with')
+    parser.add_option(      '--tolerance', dest='tolerance', default=0.2, type='float', help='relative slowdown wrt the baseline reported as regression')
+    parser.add_option(      '--fail-on-regression', dest='failOnRegression', action='store_true', default=False, help='exit code 1 if any stage regressed')
+    (options, args) = parser.parse_args()
+
+    # the paths of the configuration files are relative to the repository
+    output = os.path.abspath(options.output)
+    baseline = os.path.abspath(options.baseline) if options.baseline else None
+    os.chdir(REPO)
+    sys.path.insert(0,os.path.join(REPO,'benchmarks'))
+
+    result = runBenchmark(options)
+    regressions = []
+    if baseline:
+        with open(baseline) as fin:
+            regressions = compare(result,json.load(fin),options.tolerance)
+    else:
+        for stage,st in result['stages'].items():
+            print("{s:>24s}: median {t:10.3f} ms  min {m:10.3f} ms  ({n} calls)".format(s=stage,t=st['median']*1e3,m=st['min']*1e3,n=st['calls']))
+    with open(output,'w') as fout:
+        json.dump(result,fout,indent=1)
+    print("Results written to ",output)
+    if regressions and options.failOnRegression:
+        sys.exit(1)
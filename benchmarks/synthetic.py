@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+
+# Synthetic camera frames for the benchmarks: the geometry is taken from modules_config/geometry_<det>.txt,
+# the raw frame is pedestal + gaussian noise (per-pixel maps, returned as well, as from a pedestal run) plus
+#  - straight tracks (e.g. muons/electrons): a segment with a constant light density
+#  - curly tracks (e.g. low energy electrons): a random walk with slowly changing direction
+#  - spots (e.g. 55Fe X-rays): 2D gaussian blobs
+#  - afterglow: a large diffuse patch of light, as after a saturating event
+# The generator is seeded, so the same arguments give the same frames on every machine.
+
+import os,sys
+import numpy as np
+from scipy.ndimage import gaussian_filter
+
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from cameraChannel import cameraGeometry
+from recoConfig import loadParams
+
+class SyntheticCamera:
+    def __init__(self,geometry='lime',seed=0,pedestal=99.,noise=2.,configdir='modules_config'):
+        self.geometry = geometry
+        self.params = loadParams(os.path.join(configdir,'geometry_{det}.txt'.format(det=geometry)))
+        self.cg = cameraGeometry(self.params)
+        self.rng = np.random.default_rng(seed)
+        ny,nx = self.cg.npixy,self.cg.npixx
+        self.pedmap = pedestal + self.rng.normal(0,0.5,(ny,nx))
+        self.noisemap = np.abs(self.rng.normal(noise,0.3,(ny,nx))) + 0.5
+
+    def randomPoint(self,margin=0):
+        # a point inside the xy acceptance of the geometry
+        x = self.rng.uniform(self.cg.xmin+margin,self.cg.xmax-margin)
+        y = self.rng.uniform(self.cg.ymin+margin,self.cg.ymax-margin)
+        return x,y
+
+    def deposit(self,signal,x,y,w):
+        # light deposited at the (float) positions x,y with weights w, later smeared by the diffusion
+        ny,nx = signal.shape
+        ix = np.rint(x).astype(int); iy = np.rint(y).astype(int)
+        inside = (ix>=0) & (ix<nx) & (iy>=0) & (iy<ny)
+        np.add.at(signal,(iy[inside],ix[inside]),w[inside] if np.ndim(w) else w)
+
+    def straightTrack(self,signal,length,density):
+        x0,y0 = self.randomPoint(margin=50)
+        phi = self.rng.uniform(0,2*np.pi)
+        s = np.arange(0,length,0.5)
+        x = x0 + s*np.cos(phi); y = y0 + s*np.sin(phi)
+        self.deposit(signal,x,y,density*0.5)
+        return {'type': 'straight', 'x': x0, 'y': y0, 'phi': phi, 'length': length}
+
+    def curlyTrack(self,signal,length,density,curl=0.15):
+        x0,y0 = self.randomPoint(margin=100)
+        nsteps = int(length/0.5)
+        phi = self.rng.uniform(0,2*np.pi) + np.cumsum(self.rng.normal(0,curl,nsteps))
+        x = x0 + np.cumsum(0.5*np.cos(phi)); y = y0 + np.cumsum(0.5*np.sin(phi))
+        # the energy loss increases towards the end of the track
+        w = density*0.5*np.linspace(0.5,2.,nsteps)
+        self.deposit(signal,x,y,w)
+        return {'type': 'curly', 'x': x0, 'y': y0, 'length': length}
+
+    def spot(self,signal,integral,sigma):
+        x0,y0 = self.randomPoint(margin=20)
+        n = 500
+        x = self.rng.normal(x0,sigma,n); y = self.rng.normal(y0,sigma,n)
+        self.deposit(signal,x,y,integral/n)
+        return {'type': 'spot', 'x': x0, 'y': y0, 'integral': integral}
+
+    def afterglow(self,img,radius,amplitude):
+        x0,y0 = self.randomPoint()
+        ny,nx = img.shape
+        yy,xx = np.ogrid[:ny,:nx]
+        img += amplitude*np.exp(-((xx-x0)**2+(yy-y0)**2)/(2.*radius**2))
+        return {'type': 'afterglow', 'x': x0, 'y': y0, 'radius': radius}
+
+    def frame(self,tracks=3,curly=1,spots=5,afterglow=0,density=30.,diffusion=2.):
+        # returns the raw uint16 frame and the list of the injected objects
+        truth = []
+        signal = np.zeros(self.pedmap.shape)
+        for i in range(tracks):
+            truth.append(self.straightTrack(signal,self.rng.uniform(100,800),density))
+        for i in range(curly):
+            truth.append(self.curlyTrack(signal,self.rng.uniform(300,1500),density))
+        for i in range(spots):
+            truth.append(self.spot(signal,self.rng.uniform(2000,8000),self.rng.uniform(2,5)))
+        signal = gaussian_filter(signal,diffusion)
+        for i in range(afterglow):
+            truth.append(self.afterglow(signal,self.rng.uniform(50,200),self.rng.uniform(3,10)))
+        img = self.rng.normal(self.pedmap,self.noisemap) + self.rng.poisson(signal)
+        return np.clip(np.rint(img),0,65535).astype(np.uint16),truth
+
+    def frames(self,n,**kwargs):
+        for i in range(n):
+            yield self.frame(**kwargs)
@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+
+# Writer of small synthetic runs (frames from synthetic.py) in the raw data formats read by reconstruction.py:
+#  - root  : histograms_Run<run>.root with one TH2I pic_run<run>_ev<event> per frame
+#  - h5    : histograms_Run<run>.h5 with one dataset pic_run<run>_ev<event> per frame (same orientation as the TH2)
+#  - midas : run<run>.mid.gz, BOR event with the ODB dump (JSON), one event per frame with the banks
+#               CAM0 (uint16 frame), INPT (slow control), DGH0 (digitizer header) and DIG0 (PMT waveforms),
+#            and the EOR event
+# plus the full resolution pedestal map (pedestals/pedmap_run<pedrun>_rebin1.root) of the synthetic camera and
+# a runlog_<tag>_auto.csv, so that the run can be reconstructed with 'offline' : True and no access to the cloud.
+#
+#    python benchmarks/synthetic_run.py --tier midas --events 20 --run 90001 --pedrun 90000 -o /tmp/synth
+
+import os,sys,gzip,json,struct
+from optparse import OptionParser
+import numpy as np
+
+sys.path.insert(0,os.path.dirname(os.path.abspath(__file__)))
+from synthetic import SyntheticCamera
+
+# MIDAS event and bank constants (see midas.h)
+EVENTID_BOR      = 0x8000
+EVENTID_EOR      = 0x8001
+MIDAS_MAGIC      = 0x494d
+BANK_FORMAT_32BIT = 0x11 # BANK_FORMAT_VERSION | BANK_FORMAT_32BIT
+TID_WORD  = 4
+TID_INT   = 7
+TID_FLOAT = 9
+
+# slow control channels of the INPT bank: the ones used in modules_config/env_variables.txt, plus some others
+INPT_NAMES = ['P0IIn0','P0IIn1','P0IIn2','P0IIn3','P0IIn4','P0IIn5','P1UIn1','P1UIn5','P3IIn6']
+INPT_VALUES = {'P0IIn0': 22.5, 'P0IIn3': 960., 'P0IIn5': 975., 'P1UIn1': 21.0, 'P1UIn5': 45., 'P3IIn6': 1.6}
+
+# digitizers: board model -> (channels, samples)
+DIGITIZERS = {1742: (8,1024), 1720: (8,4000)}
+
+def rawFileName(tier,run):
+    if tier == 'midas':
+        return 'run{r:05d}.mid.gz'.format(r=run)
+    return 'histograms_Run{r:05d}.{ext}'.format(r=run,ext=tier)
+
+def frameName(run,event):
+    return 'pic_run{r:05d}_ev{e}'.format(r=run,e=event)
+
+def histContent(frame):
+    # the raw ROOT/h5 frames are vertically flipped wrt the MIDAS ones (see utilities.rootflip)
+    return frame[::-1]
+
+def writePedestalMap(fname,camera):
+    import ROOT
+    ny,nx = camera.pedmap.shape
+    tf = ROOT.TFile.Open(fname,'recreate')
+    pedmap = ROOT.TH2D('pedmap','pedmap',nx,0,nx,ny,0,ny)
+    pedmap.Sumw2()
+    content = np.zeros((ny+2,nx+2)); errors = np.zeros((ny+2,nx+2))
+    content[1:-1,1:-1] = camera.pedmap; errors[1:-1,1:-1] = camera.noisemap
+    pedmap.SetContent(content.ravel())
+    pedmap.SetError(errors.ravel())
+    pedmap.Write()
+    tf.Close()
+
+def writeRunlog(fname,tag,run,pedrun,nevents,npedevents=100):
+    # the columns of the logbook used by utilities.setPedestalRun and analysis.getNEvents
+    with open(fname,'w') as fout:
+        fout.write('run_number,run_description,number_of_events,pedestal_run,HV_STATE\n')
+        fout.write('{r},synthetic pedestal run,{n},1,0\n'.format(r=pedrun,n=npedevents))
+        fout.write('{r},synthetic run ({tag}),{n},0,1\n'.format(r=run,tag=tag,n=nevents))
+
+def writeRootRun(fname,run,frames):
+    import ROOT
+    tf = ROOT.TFile.Open(fname,'recreate')
+    for event,frame in enumerate(frames):
+        ny,nx = frame.shape
+        h = ROOT.TH2I(frameName(run,event),frameName(run,event),nx,0,nx,ny,0,ny)
+        content = np.zeros((ny+2,nx+2))
+        content[1:-1,1:-1] = histContent(frame)
+        h.SetContent(content.ravel())
+        h.Write()
+        h.Delete()
+    tf.Close()
+
+def writeH5Run(fname,run,frames):
+    import h5py
+    with h5py.File(fname,'w') as hf:
+        for event,frame in enumerate(frames):
+            # [x,y] as the values of the TH2
+            hf.create_dataset(frameName(run,event),data=histContent(frame).T,compression='lzf')
+
+def pmtWaveforms(rng,truth,model):
+    # one trigger per event: a baseline with noise and, in each channel, one negative pulse per injected track/spot
+    nch,nsamples = DIGITIZERS[model]
+    wfs = rng.normal(3000,3,(nch,nsamples))
+    t = np.arange(nsamples)
+    for obj in truth:
+        if obj['type'] == 'afterglow': continue
+        t0 = rng.uniform(0.2,0.6)*nsamples
+        width = nsamples/rng.uniform(100,200)
+        amplitude = rng.uniform(50,400)
+        for ch in range(nch):
+            wfs[ch] -= amplitude*rng.uniform(0.5,1.5)*np.exp(-0.5*((t-t0)/width)**2)
+    return np.clip(np.rint(wfs),0,4095).astype(np.uint16)
+
+def digitizerBanks(rng,truth,event):
+    # DGH0 (int32): number of boards, then for each board its model, number of triggers, channels, samples,
+    # vertical resolution, sampling rate, the channel offsets, the trigger time tags, and (1742 only) the
+    # start index cells. DIG0 (uint16): the waveforms board by board, trigger by trigger, channel by channel
+    header = [len(DIGITIZERS)]
+    data = []
+    for model,(nch,nsamples) in DIGITIZERS.items():
+        header += [model,1,nch,nsamples,4096 if model == 1742 else 4095,750 if model == 1742 else 250]
+        header += [0]*nch
+        header += [int(event*1000+rng.integers(0,1000))]
+        if model == 1742:
+            header += [int(rng.integers(0,1024))]
+        data.append(pmtWaveforms(rng,truth,model).ravel())
+    return np.array(header,dtype=np.int32),np.concatenate(data)
+
+def odbDump(run,pmt=True):
+    # the ODB keys read by the reconstruction (utilities.get_odb_pmt_info, EnvVariablesConverter)
+    formula = {'Formula': ['x','x']}
+    odb = {'Configurations': {'DRS4Correction': False, 'DigitizerOffset': [0]*8, 'Exposure': 300},
+           'Equipment': {'Environment': {'Settings': {'Names Input': INPT_NAMES},
+                                         'Variables': {'Input': [INPT_VALUES.get(n,0.) for n in INPT_NAMES]}}},
+           'History': {'Display': {'Environment': {'Temperature': formula, 'Pressure': formula},
+                                   'GasSystem': {'humidity': formula, 'Mixture Density': formula}}},
+           'Runinfo': {'Run number': run}}
+    return json.dumps(odb).encode()+b'\x00'
+
+def midasBank(name,tid,arr):
+    payload = np.ascontiguousarray(arr).tobytes()
+    pad = (-len(payload)) % 8
+    return struct.pack('<4sII',name.encode(),tid,len(payload))+payload+b'\x00'*pad
+
+def midasEvent(eventid,serial,timestamp,data,trigger_mask=0):
+    return struct.pack('<HHIII',eventid,trigger_mask,serial,timestamp,len(data))+data
+
+def writeMidasRun(fname,run,frames,truths,seed=0):
+    rng = np.random.default_rng(seed)
+    with gzip.open(fname,'wb',compresslevel=1) as fout:
+        fout.write(midasEvent(EVENTID_BOR,run,0,odbDump(run),MIDAS_MAGIC))
+        for event,(frame,truth) in enumerate(zip(frames,truths)):
+            dgh,dig = digitizerBanks(rng,truth,event)
+            inpt = np.array([INPT_VALUES.get(n,0.)+rng.normal(0,0.1) for n in INPT_NAMES],dtype=np.float32)
+            banks = midasBank('CAM0',TID_WORD,frame.astype(np.uint16))
+            banks += midasBank('INPT',TID_FLOAT,inpt)
+            banks += midasBank('DGH0',TID_INT,dgh)
+            banks += midasBank('DIG0',TID_WORD,dig)
+            fout.write(midasEvent(1,event,event,struct.pack('<II',len(banks),BANK_FORMAT_32BIT)+banks))
+        fout.write(midasEvent(EVENTID_EOR,run,len(frames),odbDump(run),MIDAS_MAGIC))
+
+def writeRun(tier,outdir,run,camera,events,**kwargs):
+    # writes the synthetic run in the given tier, returns the file name and the list of the injected objects
+    frames,truths = [],[]
+    for frame,truth in camera.frames(events,**kwargs):
+        frames.append(frame); truths.append(truth)
+    fname = os.path.join(outdir,rawFileName(tier,run))
+    if tier == 'root':
+        writeRootRun(fname,run,frames)
+    elif tier == 'h5':
+        writeH5Run(fname,run,frames)
+    elif tier == 'midas':
+        writeMidasRun(fname,run,frames,truths)
+    else:
+        raise ValueError("Unknown rawdata_tier {t}".format(t=tier))
+    return fname,truths
+
+if __name__ == '__main__':
+    parser = OptionParser(usage='%prog [opts]')
+    parser.add_option('-t', '--tier', dest='tiers', default='root,h5,midas', type='string', help='comma-separated raw data tiers to write (root, h5, midas)')
+    parser.add_option('-n', '--events', dest='events', default=20, type='int', help='number of events of the run')
+    parser.add_option('-r', '--run', dest='run', default=90001, type='int', help='run number')
+    parser.add_option(      '--pedrun', dest='pedrun', default=90000, type='int', help='run number of the pedestal map')
+    parser.add_option(      '--tag', dest='tag', default='LNGS', type='string', help='tag of the runlog csv')
+    parser.add_option('-g', '--geometry', dest='geometry', default='lime', type='string', help='detector geometry')
+    parser.add_option(      '--seed', dest='seed', default=0, type='int', help='seed of the frame generator')
+    parser.add_option(      '--tracks', dest='tracks', default=3, type='int', help='straight tracks per frame')
+    parser.add_option(      '--curly', dest='curly', default=1, type='int', help='curly tracks per frame')
+    parser.add_option(      '--spots', dest='spots', default=5, type='int', help='spots per frame')
+    parser.add_option(      '--afterglow', dest='afterglow', default=0, type='int', help='afterglow patches per frame')
+    parser.add_option('-o', '--outdir', dest='outdir', default='.', type='string', help='output directory (the pedestal map and the runlog go in <outdir>/pedestals)')
+    (options, args) = parser.parse_args()
+
+    os.makedirs(os.path.join(options.outdir,'pedestals'),exist_ok=True)
+    configdir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),'modules_config')
+    for tier in options.tiers.split(','):
+        # same seed for every tier: the same frames in each format
+        camera = SyntheticCamera(options.geometry,seed=options.seed,configdir=configdir)
+        fname,truths = writeRun(tier,options.outdir,options.run,camera,options.events,tracks=options.tracks,
+                                curly=options.curly,spots=options.spots,afterglow=options.afterglow)
+        print("Written ",fname)
+    writePedestalMap(os.path.join(options.outdir,'pedestals','pedmap_run{r}_rebin1.root'.format(r=options.pedrun)),camera)
+    writeRunlog(os.path.join(options.outdir,'pedestals','runlog_{tag}_auto.csv'.format(tag=options.tag)),options.tag,options.run,options.pedrun,options.events)
@@ -1,7 +1,6 @@
 #!/usr/bin/env python
-import ROOT
-ROOT.gROOT.SetBatch(True)
-import uproot
+# ROOT and uproot are imported only where used (the restricted image and the vignetting map): the geometry and the
+# array processing need only numpy
 import numpy as np
 import math
 import debug_code.tools_lib as tl
@@ -40,8 +39,9 @@ class cameraTools:
         # the matrix is the max size possible, still ok if rebinned (because it is redone from the TH2D when it is readout)
         self.vignetteMap = { self.geometry.name : np.zeros((int(self.geometry.npixx),int(self.geometry.npixy))) }
 
-    def pedsub(self,img,pedarr):
-        return img - pedarr
+    def pedsub(self,img,pedarr,out=None):
+        # out: optional preallocated result (e.g. a work image reused across the events)
+        return np.subtract(img,pedarr,out=out)
 
     def satur_corr(self,img):
         e = 1.60217662e-7 # electric charge in C
@@ -90,6 +90,8 @@ class cameraTools:
         nx = th2.GetNbinsX(); ny = th2.GetNbinsY();
         nxp = xmax-xmin
         nyp = ymax-ymin
+        import ROOT
+        ROOT.gROOT.SetBatch(True)
         th2_rs = ROOT.TH2D(th2.GetName()+'_rs',th2.GetName()+'_rs',nxp,xmin,xmax,nyp,ymin,ymax)
         th2_rs.SetDirectory(None)
         for ix,x in enumerate(range(xmin,xmax)):
@@ -107,6 +109,7 @@ class cameraTools:
             return self.vignetteMap[det]
         elif det == 'lime' or 'Mango_full':
             if not self.vignetteMap[det].any():
+                import uproot
                 tf = uproot.open(self.geometry.vignette)
                 namehmap = 'normmap_'+self.geometry.name
                 if det == 'Mango_full' or 'gin':
@@ -19,6 +19,7 @@ from sklearn.utils import check_array, check_consistent_length
 from sklearn.neighbors import NearestNeighbors
 
 from cluster.ddbscan_inner import ddbscaninner
+import instrumentation as instr
 import time
 
 def ddbscan(X, eps=0.5, min_samples=40, dir_radius=1, dir_min_accuracy=0.8, dir_minsamples=20, isolation_radius=100, time_threshold=np.inf, max_attempts=np.inf, dir_thickness=4, metric='minkowski', metric_params=None,  algorithm='auto', leaf_size=30, p=2, sample_weight=None, n_jobs=None, expand_noncore = False):
@@ -133,6 +134,7 @@ def ddbscan(X, eps=0.5, min_samples=40, dir_radius=1, dir_min_accuracy=0.8, dir_
     # Calculate neighborhood for all samples. This leaves the original point
     # in, which needs to be considered later (i.e. point i is in the
     # neighborhood of point i. While True, its useless information)
+    t_seeding = time.perf_counter(); m_seeding = instr.rss()
     if metric == 'precomputed' and sparse.issparse(X):
         neighborhoods = np.empty(X.shape[0], dtype=object)
         neighborhoods2 = np.empty(X.shape[0], dtype=object)
@@ -188,8 +190,11 @@ def ddbscan(X, eps=0.5, min_samples=40, dir_radius=1, dir_min_accuracy=0.8, dir_
 
     # A list of all core samples found.
     core_samples = np.asarray(n_neighbors >= min_samples, dtype=np.uint8)
+    instr.add('dbscan_seeding', time.perf_counter()-t_seeding, instr.rss()-m_seeding)
+    instr.count('core_points', int(core_samples.sum()))
     start = time.time()
-    labels = ddbscaninner(X, core_samples, neighborhoods, neighborhoods2, labels, dir_radius, dir_min_accuracy, dir_minsamples, dir_thickness, time_threshold, max_attempts, isolation_radius, expand_noncore)
+    with instr.stage('ransac'):
+        labels = ddbscaninner(X, core_samples, neighborhoods, neighborhoods2, labels, dir_radius, dir_min_accuracy, dir_minsamples, dir_thickness, time_threshold, max_attempts, isolation_radius, expand_noncore)
     final = time.time()
     #print("The ddbscaninner needed %d seconds." %(final-start))
     return np.where(core_samples)[0], labels
@@ -304,9 +309,11 @@ class DDBSCAN(BaseEstimator, ClusterMixin):
     and Data Mining, Portland, OR, AAAI Press, pp. 226-231. 1996
     """
 
-    def __init__(self, configFile):
-        filePar = open(configFile,'r')
-        params = eval(filePar.read())
+    def __init__(self, params):
+        # params: the clustering parameter set (dict), or the path of the file containing it
+        if isinstance(params, str):
+            filePar = open(params,'r')
+            params = eval(filePar.read())
         self.eps           = params['dbscan_eps']
         self.min_samples   = params['dbscan_minsamples']
         self.dir_radius    = params['dir_radius']
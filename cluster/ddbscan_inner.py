@@ -6,6 +6,7 @@ from sklearn.linear_model import RANSACRegressor
 from sklearn.metrics import mean_squared_error
 from operator import itemgetter
 import time,math
+import instrumentation as instr
 
 import warnings
 warnings.simplefilter('ignore', np.RankWarning)
@@ -33,6 +34,7 @@ class PolynomialRegression(object):
         return mean_squared_error(y, self.predict(X))
 
 def ransac_polyfit(x,y,order,t,n=0.7,k=100,f=0.8):
+    instr.count('ransac_attempts')
 
     #print("\t\t*** doing polyfit with order ",order)
     besterr = np.inf
@@ -1,42 +1,63 @@
 #!/usr/bin/env python
 import numpy as np
-from skimage.segmentation import  inverse_gaussian_gradient,morphological_geodesic_active_contour
+from scipy import ndimage as ndi
+from morphsnakes import inverse_gaussian_gradient,morphological_geodesic_active_contour
 from clusterTools import Cluster
 from scipy.stats import pearsonr
 from energyCalibrator import EnergyCalibrator
 from cameraChannel import cameraGeometry
+from recoConfig import RecoConfig
 import time
 
 class SuperClusterAlgorithm:
-    def __init__(self,options,shape,neighbor_window=6):
+    # The clustered points are the seeds: a window around them (neighbor_window) gives back the unclustered
+    # pixels with low light, and the geodesic active contour (GAC) finds the contours of the superclusters.
+    # The GAC runs only on the bounding boxes (ROIs) of the groups of seeds, enlarged by roi_margin, and stops
+    # when the level set does not change anymore for gac_step iterations (at most gac_iterations).
+    def __init__(self,options,shape,neighbor_window=6,config=None,roi_margin=10,gac_iterations=400,gac_step=20,calibrate=None):
         self.options = options
-        self.shape = shape
+        # (rows,columns) of the rebinned image (an int for a square image)
+        self.shape = tuple(shape) if np.ndim(shape) else (shape,shape)
         self.neighbor_window = neighbor_window
+        self.roi_margin = roi_margin
+        self.gac_iterations = gac_iterations
+        self.gac_step = gac_step
         self.debug = options.debug_mode
-        self.calibrate = self.options.calibrate_clusters
+        self.calibrate = self.options.calibrate_clusters if calibrate is None else calibrate
         
+        if config is None:
+            config = RecoConfig(options.geometry)
+        self.config = config
+
         # geometry
-        geometryPSet   = open('modules_config/geometry_{det}.txt'.format(det=options.geometry),'r')
-        geometryParams = eval(geometryPSet.read())
-        self.cg = cameraGeometry(geometryParams)
+        self.cg = cameraGeometry(config.geometry)
 
         # supercluster energy calibration for the saturation effect
-        filePar = open('modules_config/energyCalibrator.txt','r')
-        params = eval(filePar.read())
-        self.calibrator = EnergyCalibrator(params,self.debug)
+        self.calibrator = EnergyCalibrator(config.energyCalibrator,self.debug)
         
-    def clusters_neighborood(self,basic_clusters,raw_data):
-        neighboroods = np.zeros([self.shape,self.shape],dtype=float)
+    def seeds_mask(self,basic_clusters):
+        # the clustered points, dilated by the neighbor window
+        mask = np.zeros(self.shape,dtype=bool)
         if len(basic_clusters)>0:
-           Xtot_clusters = np.vstack(basic_clusters)
-           for pointInCluster in Xtot_clusters:
-               ix,iy = pointInCluster[0],pointInCluster[1]
-               for ixn in range(-self.neighbor_window,self.neighbor_window+1):
-                   for iyn in range(-self.neighbor_window,self.neighbor_window+1):
-                       x = max(0,min(ix+ixn,self.shape-1))
-                       y = max(0,min(iy+iyn,self.shape-1))
-                       neighboroods[x,y] = raw_data[x,y]
-        return neighboroods
+            Xtot_clusters = np.vstack(basic_clusters)
+            mask[Xtot_clusters[:,0],Xtot_clusters[:,1]] = True
+            window = np.ones((2*self.neighbor_window+1,)*2,dtype=bool)
+            mask = ndi.binary_dilation(mask,structure=window)
+        return mask
+
+    def clusters_neighborood(self,basic_clusters,raw_data):
+        # the image only in the window around the clustered points
+        return np.where(self.seeds_mask(basic_clusters),raw_data,0).astype(float)
+
+    def rois(self,mask):
+        # bounding boxes of the groups of seeds (+ windows) closer than the margin, which would be enclosed by the
+        # same contour in the whole image, and the same boxes enlarged by the margin
+        labels,nlabels = ndi.label(ndi.binary_dilation(mask,structure=np.ones((self.roi_margin+1,)*2,dtype=bool)))
+        ret = []
+        for box in ndi.find_objects(labels):
+            roi = tuple(slice(max(0,sl.start-self.roi_margin),min(n,sl.stop+self.roi_margin)) for sl,n in zip(box,self.shape))
+            ret.append((box,roi))
+        return ret
 
     def store_evolution_in(self,lst):
         """Returns a callback function to store the evolution of the level sets in
@@ -46,25 +67,39 @@ class SuperClusterAlgorithm:
             lst.append(np.copy(x))
         return _store
 
-    def supercluster(self,clustered_data):
-        #print ("clu data = ",clustered_data)
+    def active_contour(self,clustered_data,init_ls):
+        # GAC until the level set is stable for gac_step iterations (at most gac_iterations)
         gimage = inverse_gaussian_gradient(clustered_data)
-        # Initial level set
-        # this makes alternate squares active at the first iteration of 10 macro-pixels
-        #init_ls = checkerboard_level_set(clustered_data.shape, 10)
-        init_ls = np.zeros(clustered_data.shape, dtype=np.int8)
-        init_ls[10:-10, 10:-10] = 1
-        # List with intermediate results for plotting the evolution
-        #evolution = []
-        #callback = self.store_evolution_in(evolution)
-        ls = morphological_geodesic_active_contour(gimage, 400, init_ls,
+        niter = [-1] # the callback is called also before the first iteration
+        def count(ls):
+            niter[0] += 1
+        ls = morphological_geodesic_active_contour(gimage, self.gac_iterations, init_ls,
                                                    smoothing=1, balloon=-1,
-                                                   threshold=0.69)
-                                                   #iter_callback=callback)
-        return ls
+                                                   threshold=0.69, iter_callback=count,
+                                                   stop_after=self.gac_step)
+        niter = niter[0]
+        return ls,niter
+
+    def supercluster(self,clustered_data,mask=None):
+        # level set of the whole image, computed in the ROIs around the seeds. Without the mask of the seeds
+        # the GAC runs on the whole image, starting from it apart a border of 10 macro-pixels
+        levels = np.zeros(clustered_data.shape, dtype=np.int8)
+        if mask is None:
+            init_ls = np.zeros(clustered_data.shape, dtype=np.int8)
+            init_ls[10:-10, 10:-10] = 1
+            levels,niter = self.active_contour(clustered_data,init_ls)
+            return levels
+        for box,roi in self.rois(mask):
+            # initial level set: the bounding box of the seeds, which contains all the non-zero pixels of the ROI
+            init_ls = np.zeros(clustered_data[roi].shape, dtype=np.int8)
+            init_ls[tuple(slice(b.start-r.start,b.stop-r.start) for b,r in zip(box,roi))] = 1
+            ls,niter = self.active_contour(clustered_data[roi],init_ls)
+            levels[roi] |= ls
+            if self.debug:
+                print("supercluster ROI {r} converged after {n} iterations".format(r=[(sl.start,sl.stop) for sl in roi],n=niter))
+        return levels
 
     def supercluster_points(self,levels):
-        from scipy import ndimage as ndi
         # fill the contours of the superclusters
         fill_contours = ndi.binary_fill_holes(levels)
         # remove the smallest superclusters
@@ -75,18 +110,16 @@ class SuperClusterAlgorithm:
         contours_cleaned = mask_sizes[label_objects]
         labeled_pixels, nb_labels = ndi.label(contours_cleaned)
 
-        superclusters = [None]*nb_labels
-        for ix in range(self.shape):
-            for iy in range(self.shape):
-                lbl = labeled_pixels[ix,iy]
-                if lbl>0: # super-clustered pixel
-                    if superclusters[lbl-1]: superclusters[lbl-1].append((ix,iy))
-                    else: superclusters[lbl-1] = [(ix,iy)]
-
-        # transform to numpy array
-        for isc in range(len(superclusters)):
-            superclusters[isc] = np.array(superclusters[isc])
-        return np.array(superclusters,dtype=object)
+        # the pixels of each supercluster, in the (row-major) order of the image
+        ix,iy = np.nonzero(labeled_pixels)
+        lbl = labeled_pixels[ix,iy]
+        order = np.argsort(lbl,kind='stable')
+        points = np.stack([ix,iy],axis=1)[order]
+        bounds = np.searchsorted(lbl[order],np.arange(1,nb_labels+2))
+        superclusters = np.empty(nb_labels,dtype=object)
+        for isc in range(nb_labels):
+            superclusters[isc] = points[bounds[isc]:bounds[isc+1]]
+        return superclusters
 
     def findSuperClusters(self,basic_clusters,raw_data,raw_data_fullreso,raw_data_fullreso_zs,iteration):
         superClusters = []; superClusterContours = np.array([])
@@ -94,19 +127,20 @@ class SuperClusterAlgorithm:
         if len(basic_clusters):
             # use the clustered points to get "seeds" for superclustering
             # i.e. open a window to get back unclustered points with low light
-            seedsAndNeighbors = self.clusters_neighborood(basic_clusters,raw_data)
+            mask = self.seeds_mask(basic_clusters)
+            seedsAndNeighbors = np.where(mask,raw_data,0).astype(float)
 
-            # run the superclustering algorithm (GAC with 300 iterations)
-            superClusterContours = self.supercluster(seedsAndNeighbors)
+            # run the superclustering algorithm (GAC in the ROIs around the seeds, up to convergence)
+            superClusterContours = self.supercluster(seedsAndNeighbors,mask)
           
             # get the superclusters with the list of points of each one
             superClusterWithPixels = self.supercluster_points(superClusterContours)
           
             # get a cluster object
-            rebin = int(self.cg.npixx/self.shape)
+            rebin = int(self.cg.npixx/self.shape[1])
             for i,scpixels in enumerate(superClusterWithPixels):
                 #print ("===> SC ",i)
-                sclu = Cluster(scpixels,rebin,raw_data_fullreso,raw_data_fullreso_zs,self.options.geometry,debug=False)
+                sclu = Cluster(scpixels,rebin,raw_data_fullreso,raw_data_fullreso_zs,self.options.geometry,debug=False,fullinfo=getattr(self.options,'scfullinfo',False),clID=i)
                 #T2 = time.perf_counter()
                 
                 sclu.iteration=iteration
@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+
+# Tile-parallel DDBSCAN of the (rebinned) points of one frame, for the large/busy frames where a single fit
+# makes the latency of the event.
+# The points are split in a grid of tiles (equal number of points per row/column of tiles, so that the busy
+# regions get smaller tiles); each tile is clustered on its own points plus the ones within 'margin' of its
+# borders, in a thread or process pool. Every point is owned by one tile, which gives its label; the clusters
+# of different tiles are merged with a union-find on the boundary points, i.e. the points that are core points
+# both of their owner tile and of the tile seeing them in its margin (a border point can be reached by two
+# different clusters, a core point belongs to only one).
+# The margin must be at least twice the largest neighbourhood radius of the algorithm (dbscan_eps, dir_radius):
+# the per-axis distance is never larger than the cityblock/euclidean one, so the neighbourhoods of the owned
+# points, and of the points of the neighbour tiles within one radius of the seam, are complete. The
+# directional (RANSAC) part and the isolation of the polynomial clusters are not local, so the result can
+# differ from the monolithic fit: the validation mode runs both and compares them.
+#
+#    ddb = TiledDDBSCAN(config.clustering,grid=(2,2),workers=4).fit(X,sample_weight=sample_weight)
+#    ddb.labels_   # as DDBSCAN.labels_: [:,0] cluster label (-1 noise), [:,1] 1 for polynomial clusters
+
+import time
+import multiprocessing
+from concurrent import futures
+import numpy as np
+
+from cluster.ddbscan_ import DDBSCAN
+import instrumentation as instr
+
+# pools kept across the events: (executor,workers) -> pool
+_pools = {}
+
+def getPool(executor,workers):
+    # no process pool inside the workers of the multi-process reconstruction (-j N): each of them would start its
+    # own pool of processes. The workers (ProcessPoolExecutor, not daemonic) are recognized by their parent process
+    if executor == 'process' and (multiprocessing.parent_process() is not None or multiprocessing.current_process().daemon):
+        executor = 'thread'
+    key = (executor,workers)
+    if key not in _pools:
+        if executor == 'process':
+            _pools[key] = futures.ProcessPoolExecutor(workers)
+        elif executor == 'thread':
+            _pools[key] = futures.ThreadPoolExecutor(workers)
+        else:
+            raise ValueError("Unknown tile executor {e} (thread, process)".format(e=executor))
+    return _pools[key]
+
+def fitTile(params,X,sample_weight):
+    # labels and core flags of the points of one tile (run in the pool)
+    core = np.zeros(len(X),dtype=bool)
+    if len(X) == 0:
+        return np.zeros((0,2),dtype=np.intp),core
+    ddb = DDBSCAN(params).fit(X,sample_weight=sample_weight)
+    core[ddb.core_sample_indices_] = True
+    return ddb.labels_,core
+
+class UnionFind:
+    def __init__(self,n):
+        self.parent = np.arange(n)
+
+    def find(self,i):
+        root = i
+        while self.parent[root] != root:
+            root = self.parent[root]
+        while self.parent[i] != root:
+            self.parent[i],i = root,self.parent[i]
+        return root
+
+    def union(self,i,j):
+        ri,rj = self.find(i),self.find(j)
+        if ri != rj:
+            self.parent[max(ri,rj)] = min(ri,rj)
+
+def tileEdges(coord,n):
+    # n tiles along one axis with the same number of points each
+    edges = np.quantile(coord,np.linspace(0,1,n+1)) if len(coord) else np.zeros(n+1)
+    edges[0],edges[-1] = -np.inf,np.inf
+    return edges
+
+def compareLabels(labels,reference):
+    # agreement of two clusterings of the same points
+    from sklearn.metrics import adjusted_rand_score
+    ncl = lambda l: len(set(l)) - (1 if -1 in l else 0)
+    return {'ari': float(adjusted_rand_score(reference,labels)),
+            'noise_agreement': float(np.mean((labels==-1) == (reference==-1))) if len(labels) else 1.,
+            'nclusters': ncl(labels), 'nclusters_ref': ncl(reference)}
+
+class TiledDDBSCAN:
+    def __init__(self,params,grid=(2,2),margin=0,workers=4,executor='thread',validate=False):
+        # params: the clustering parameter set, as for DDBSCAN; margin: 0 is twice the largest neighbourhood radius
+        self.params = params
+        self.grid = tuple(grid) if np.ndim(grid) else (grid,grid)
+        minmargin = 2*max(params['dbscan_eps'],params['dir_radius'])
+        if margin and margin < minmargin:
+            print("WARNING: tile margin {m} smaller than twice the clustering radius: using {r}".format(m=margin,r=minmargin))
+        self.margin = max(margin,minmargin)
+        self.workers = workers
+        self.executor = executor
+        self.validate = validate
+        self.validation = None
+
+    def tiles(self,X):
+        # (owned,window) boolean masks of the points of each tile
+        rows,cols = tileEdges(X[:,0],self.grid[0]),tileEdges(X[:,1],self.grid[1])
+        ret = []
+        for i in range(self.grid[0]):
+            inrow = (X[:,0] >= rows[i]) & (X[:,0] < rows[i+1])
+            nearrow = (X[:,0] >= rows[i]-self.margin) & (X[:,0] < rows[i+1]+self.margin)
+            for j in range(self.grid[1]):
+                owned = inrow & (X[:,1] >= cols[j]) & (X[:,1] < cols[j+1])
+                window = nearrow & (X[:,1] >= cols[j]-self.margin) & (X[:,1] < cols[j+1]+self.margin)
+                ret.append((owned,window))
+        return ret
+
+    def merge(self,tiles,results,npoints):
+        # union-find of the (tile,label) clusters through the boundary points
+        # node ids of the clusters of each tile, and the node of each point in its owner tile (-1 for noise)
+        offsets = np.cumsum([0]+[(labels[:,0].max()+1 if len(labels) else 0) for labels,core in results])
+        uf = UnionFind(offsets[-1])
+        own = np.full(npoints,-1,dtype=np.intp)
+        owncore = np.zeros(npoints,dtype=bool)
+        poly = np.zeros(npoints,dtype=np.intp)
+        for t,((owned,window),(labels,core)) in enumerate(zip(tiles,results)):
+            idx = np.flatnonzero(window)
+            clustered = labels[:,0] >= 0
+            nodes = labels[:,0] + offsets[t]
+            mine = owned[idx]
+            own[idx[mine & clustered]] = nodes[mine & clustered]
+            owncore[idx[mine]] = core[mine] & clustered[mine]
+            poly[idx[mine]] = labels[mine,1]
+        for t,((owned,window),(labels,core)) in enumerate(zip(tiles,results)):
+            idx = np.flatnonzero(window)
+            boundary = (~owned[idx]) & core & (labels[:,0] >= 0) & owncore[idx]
+            for node,other in zip(labels[boundary,0]+offsets[t],own[idx[boundary]]):
+                uf.union(node,other)
+        # consecutive labels of the merged clusters, in order of first appearance
+        merged = np.full((npoints,2),-1,dtype=np.intp)
+        merged[:,1] = 0
+        roots = {}
+        for i in np.flatnonzero(own >= 0):
+            root = uf.find(own[i])
+            merged[i,0] = roots.setdefault(root,len(roots))
+        # a merged cluster is polynomial if any of its pieces is
+        for k in np.unique(merged[poly==1,0]):
+            if k >= 0: merged[merged[:,0]==k,1] = 1
+        instr.count('tile_seam_merges',int(len(set(own[own>=0])) - len(roots)))
+        return merged
+
+    def fit(self,X,y=None,sample_weight=None):
+        X = np.asarray(X)
+        sw = None if sample_weight is None else np.asarray(sample_weight)
+        tiles = self.tiles(X)
+        pool = getPool(self.executor,self.workers)
+        t0 = time.perf_counter()
+        jobs = [pool.submit(fitTile,self.params,X[window],None if sw is None else sw[window]) for owned,window in tiles]
+        results = [job.result() for job in jobs]
+        self.labels_ = self.merge(tiles,results,len(X))
+        t_tiled = time.perf_counter()-t0
+        instr.add('dbscan_tiles',t_tiled)
+        instr.count('dbscan_tiles',len(tiles))
+        if self.validate:
+            t0 = time.perf_counter()
+            reference = DDBSCAN(self.params).fit(X,sample_weight=sw).labels_
+            self.validation = compareLabels(self.labels_[:,0],reference[:,0])
+            self.validation.update(time_tiled=t_tiled,time_monolithic=time.perf_counter()-t0)
+            instr.count('tile_validation_mismatch',int(self.validation['ari'] < 1))
+            print("tiled clustering validation: ARI = {ari:.4f}, noise agreement = {noise_agreement:.4f}, clusters {nclusters} (monolithic {nclusters_ref}), time {time_tiled:.3f} s (monolithic {time_monolithic:.3f} s)".format(**self.validation))
+        return self
+
+    def fit_predict(self,X,y=None,sample_weight=None):
+        return self.fit(X,sample_weight=sample_weight).labels_
@@ -3,15 +3,54 @@
 import numpy as np
 import math,itertools
 import ROOT
+ROOT.gROOT.SetBatch(True)
 from array import array
 from cameraChannel import cameraGeometry
 
 import utilities
 utilities = utilities.utils()
 
+# Fixed-field records of a cluster: its pixel statistics (computed at construction) and its shape variables (filled
+# by calcProfiles/clusterShapes). The records of all the clusters of an event are turned into one structured array
+# by clusterRecords(), i.e. one array per branch (see treeVars.fillClusterVariables)
+STAT_FIELDS = ['size','nhits','integral','corrintegral','rms','xmin','xmax','ymin','ymax']
+SHAPE_FIELDS = ['theta','longrms','latrms','xmean','ymean','xmin','ymin','xmax','ymax',
+                'lgaussamp','lgaussmean','lgausssigma','lchi2','lstatus',
+                'tgaussamp','tgaussmean','tgausssigma','tchi2','tstatus',
+                'long_width','lat_width','long_fullrms','lat_fullrms',
+                'long_p0amplitude','long_p0prominence','long_p0mean','long_p0fwhm',
+                'lat_p0amplitude','lat_p0prominence','lat_p0mean','lat_p0fwhm']
+STAT_DTYPE = np.dtype([(f,np.float64) for f in STAT_FIELDS])
+SHAPE_DTYPE = np.dtype([(f,np.float64) for f in SHAPE_FIELDS])
+
+def clusterRecords(clusters,which='shapes'):
+    # structured array with the 'shapes' (or 'stats') records of the clusters
+    recs = np.zeros(len(clusters),dtype=SHAPE_DTYPE if which=='shapes' else STAT_DTYPE)
+    for i,cl in enumerate(clusters):
+        recs[i] = getattr(cl,which)
+    return recs
+
+def corrIntegral(z):
+    # density-corrected integral of the pixel counts z (LEMON-specific calibration)
+    e = 1.60217662e-7
+    d2 = 0.015625
+    omega = 0.00018 
+    alpha = 0.08
+    sigma0 = 2.5
+    a0 = 0.1855
+    a = a0*e/(d2*alpha*omega)
+    b = (1.- 2*a0*sigma0)
+    c = a0*sigma0*sigma0*(d2*alpha*omega)/e
+    return np.sum(a*z*z + b*z + c)
+
 #In this class initiator and later there is a formal mistake: hits is a matrix with 3 columns: [row,column,intensity]. This means they should be referred to as [y,x,z]
 #However it is used [x,y,z]. The calculation of eigenvalues and profiles should be invariant (maybe it will be checked in the future), but when saving the x and y are swapped in order to have the correct information
 class Cluster:
+    __slots__ = ('hits','rebin','debug','x','y','hits_fr','hits_fr_zs','stats','mean_point','EVs','theta','widths','profiles','shapes',
+                 'nclu','IDall','nallintpixels','xallpixelcoord','yallpixelcoord','zallpixel',
+                 'iteration','pearson','xmin','xmax','ymin','ymax',
+                 'calibratedEnergy','nslices','energyprofile','centers','pathlength')
+
     def __init__(self,hits,rebin,img_fr,img_fr_zs,geometry,debug=False,fullinfo=False,clID=0):
         self.hits = hits
         self.rebin = rebin
@@ -21,6 +60,7 @@ class Cluster:
             self.hits_fr,self.hits_fr_zs = self.fullResHits(img_fr,img_fr_zs)
         else:
             print("WARNING! Cluster created without underlying image... Are you using it standalone?")
+        self.stats = self.calcStats()
 
         if fullinfo:			#saving the pixel for the scfullinfo 
 
@@ -29,8 +69,7 @@ class Cluster:
 
             if self.integral()>0 and self.sizeActive()>0  and self.size()<1000000:		#tries to avoid to save cluster with zero integral or too big (like with afterglow of pixels)
                   self.nallintpixels = self.size()
-                  for k in range(self.nallintpixels):
-                      self.IDall.append(clID)
+                  self.IDall = [clID]*self.nallintpixels
                   self.xallpixelcoord= self.hits_fr[:,1]
                   self.yallpixelcoord= self.hits_fr[:,0]
                   self.zallpixel= self.hits_fr[:,2]
@@ -44,27 +83,33 @@ class Cluster:
         self.EVs,self.theta = self.eigenvectors()
         self.widths = {}
         self.profiles = {}
-        self.shapes = {}
-        
+        self.shapes = np.zeros(1,dtype=SHAPE_DTYPE)[0]
+
+    def calcStats(self):
+        # the pixel statistics, computed once (x = column, y = row of the full resolution hits)
+        stats = np.zeros(1,dtype=STAT_DTYPE)[0]
+        if not hasattr(self,'hits_fr') or len(self.hits_fr)==0:
+            return stats
+        z = self.hits_fr[:,2]
+        stats['size'] = len(self.hits_fr)
+        stats['nhits'] = len(self.hits_fr_zs)
+        stats['integral'] = np.sum(z)
+        stats['corrintegral'] = corrIntegral(z)
+        stats['rms'] = np.std(z)
+        stats['xmin'],stats['xmax'] = np.min(self.hits_fr[:,1]),np.max(self.hits_fr[:,1])
+        stats['ymin'],stats['ymax'] = np.min(self.hits_fr[:,0]),np.max(self.hits_fr[:,0])
+        return stats
+
     def integral(self):
         if hasattr(self,'hits_fr'):
-            return sum([z for (x,y,z) in self.hits_fr])
+            return self.stats['integral']
         else:
             print("WARNING: Hits with full resolution map not available. Returning 0 integral!")
             return 0
             
     def corr_integral(self):
-        e = 1.60217662e-7
-        d2 = 0.015625
-        omega = 0.00018 
-        alpha = 0.08
-        sigma0 = 2.5
-        a0 = 0.1855
-        a = a0*e/(d2*alpha*omega)
-        b = (1.- 2*a0*sigma0)
-        c = a0*sigma0*sigma0*(d2*alpha*omega)/e
         if hasattr(self,'hits_fr'):
-            return sum([a*z*z + b*z +c for (x,y,z) in self.hits_fr])
+            return self.stats['corrintegral']
         else:
             print("WARNING: Hits with full resolution map not available. Returning 0 corr_integral!")
             return 0
@@ -78,14 +123,10 @@ class Cluster:
             return -999
 
     def size(self):
-        if hasattr(self,'hits_fr'):
-            return len(self.hits_fr)
-        else: return 0
+        return int(self.stats['size'])
 
     def sizeActive(self):
-        if hasattr(self,'hits_fr_zs'):
-            return len(self.hits_fr_zs)
-        else: return 0
+        return int(self.stats['nhits'])
 
     def iterations(self):
         if hasattr(self,'iteration'):
@@ -93,7 +134,7 @@ class Cluster:
         else: return 0
 
     def rms(self):
-        return np.std(np.array([z for (x,y,z) in self.hits_fr]))
+        return self.stats['rms']
             
     def getXmax(self):
         if hasattr(self,'xmax'):
@@ -275,12 +316,11 @@ class Cluster:
               self.shapes['xmax'] = 0
               self.shapes['ymax'] = 0
         else:
-              self.shapes['xmean'] = np.average(np.array(self.hits_fr[:,1]),weights=np.array([max(0,z) for z in self.hits_fr[:,2]]) )
-              self.shapes['ymean'] = np.average(np.array(self.hits_fr[:,0]),weights=np.array([max(0,z) for z in self.hits_fr[:,2]]) )
-              self.shapes['xmin'] = np.min(np.array(self.hits_fr[:,1]))
-              self.shapes['ymin'] = np.min(np.array(self.hits_fr[:,0]))
-              self.shapes['xmax'] = np.max(np.array(self.hits_fr[:,1]))
-              self.shapes['ymax'] = np.max(np.array(self.hits_fr[:,0]))
+              weights = np.maximum(self.hits_fr[:,2],0)
+              self.shapes['xmean'] = np.average(self.hits_fr[:,1],weights=weights)
+              self.shapes['ymean'] = np.average(self.hits_fr[:,0],weights=weights)
+              for k in ('xmin','ymin','xmax','ymax'):
+                  self.shapes[k] = self.stats[k]
         for direction in titles:
             self.shapes['{direction}gaussamp'.format(direction=direction[0])] = (fitResults[direction])['amp']
             self.shapes['{direction}gaussmean'.format(direction=direction[0])] = (fitResults[direction])['mean']
@@ -362,6 +402,8 @@ class Cluster:
     def fullResHits(self,img_fullres,img_fullres_zs):
         if hasattr(self,'hits_fr') and  hasattr(self,'hits_fr_zs'):
             return self.hits_fr,self.hits_fr_zs
+        if hasattr(img_fullres_zs,'lookup'):
+            return self.fullResHitsSparse(img_fullres,img_fullres_zs)
         allhits = []
         activehits = []
         if self.debug: print("X rebinned by ",self.rebin," = ",self.hits)
@@ -376,6 +418,20 @@ class Cluster:
         hits_fr_zs = np.array(activehits)
         if self.debug: print("X fullres = ",hits_fr)
         return hits_fr,hits_fr_zs
+
+    def fullResHitsSparse(self,img_fullres,img_fullres_zs):
+        # as fullResHits, with the zero-suppressed image as a sparseFrame.SparseFrame (same order of the hits)
+        rb = int(self.rebin)
+        off = np.arange(rb)
+        macro = (np.asarray(self.hits)[:,:2]*rb).astype(int)
+        rxf = np.repeat(macro[:,0],rb*rb) + np.tile(np.repeat(off,rb),len(macro))
+        ryf = np.repeat(macro[:,1],rb*rb) + np.tile(np.tile(off,rb),len(macro))
+        hits_fr = np.column_stack((rxf,ryf,img_fullres[rxf,ryf])).astype(float)
+        zs = img_fullres_zs.lookup(rxf,ryf)
+        active = zs > 0
+        hits_fr_zs = np.column_stack((rxf[active],ryf[active],zs[active])).astype(float) if active.any() else np.array([])
+        if self.debug: print("X fullres = ",hits_fr)
+        return hits_fr,hits_fr_zs
     
     def plotFullResolution(self,name,option='colz'):
 
@@ -18,6 +18,39 @@ from sklearn.inspection import permutation_importance
 from sklearn.metrics import mean_squared_error
 from sklearn.model_selection import train_test_split
 
+def read_parquet_tree(dataset,tree,columns,entry_start=None,entry_stop=None):
+    # reads the columnar output of the reconstruction (output_backend='parquet') with the same
+    # layout of uproot's library="pd": one row per cluster, indexed by (entry, subentry), with the stored dtypes.
+    # Only the row groups overlapping [entry_start,entry_stop) are read
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+    start = entry_start or 0
+    stop = entry_stop if entry_stop is not None else float('inf')
+    tables = []
+    offset = 0
+    for fname in sorted(ds.dataset('{d}/{t}'.format(d=dataset,t=tree),format='parquet').files): # in the order of the chunks
+        pf = pq.ParquetFile(fname)
+        for rg in range(pf.num_row_groups):
+            n = pf.metadata.row_group(rg).num_rows
+            if offset < stop and offset+n > start:
+                first = max(start-offset,0)
+                tables.append(pf.read_row_group(rg,columns=columns).slice(first,min(stop-offset,n)-first))
+            offset += n
+    if not len(tables):
+        return pd.DataFrame(columns=columns)
+    table = pa.concat_tables(tables).combine_chunks()
+    entry = np.arange(start,start+table.num_rows)
+    jagged = [c for c in columns if pa.types.is_list(table.schema.field(c).type) or pa.types.is_large_list(table.schema.field(c).type)]
+    if not len(jagged):
+        return pd.DataFrame({c: table[c].to_numpy() for c in columns},index=pd.Index(entry,name='entry'))
+    # one row per element of the lists, the scalar columns repeated, the empty lists dropped (as uproot)
+    parents = pc.list_parent_indices(table[jagged[0]]).to_numpy()
+    subentry = np.arange(len(parents)) - np.searchsorted(parents,parents)
+    data = {c: pc.list_flatten(table[c]).to_numpy() if c in jagged else table[c].to_numpy()[parents] for c in columns}
+    return pd.DataFrame(data,index=pd.MultiIndex.from_arrays([entry[parents],subentry],names=['entry','subentry']))
+
 def fill_hist(hist,arr):
     for i in range(len(arr)):
         hist.Fill(arr[i])
@@ -111,11 +144,14 @@ class GBRLikelihoodTrainer:
 
         if not loadPanda:
             print ("Loading events from file %s and converting to numpy arrays for training. It might take time..." % rfile)
-            events = uproot.open(rfile)
             if friendrfile:
                 friends = uproot.open(friendrfile)
             if self.verbose: print ("---> Now loading main tree %s..." % rfile)
-            data_main = events[self.tree_name].arrays(variables_events,library="pd",entry_start=firstEvent,entry_stop=lastEvent)
+            if rfile.rstrip('/').endswith('.parquet'):
+                data_main = read_parquet_tree(rfile,self.tree_name,variables_events,entry_start=firstEvent,entry_stop=lastEvent)
+            else:
+                events = uproot.open(rfile)
+                data_main = events[self.tree_name].arrays(variables_events,library="pd",entry_start=firstEvent,entry_stop=lastEvent)
             if self.verbose: print ("---> Now loading friend tree %s ..." % friendrfile)
             data_friend = friends["Friends"].arrays(variables_friends,library="pd",entry_start=firstEvent,entry_stop=lastEvent)
             if len(data_main.index)!=len(data_friend.index): RuntimeError("Number of entries in the main tree = %d and in the friend tree = %d don't match " %(len(data_main.index),len(data_friend.index)))
@@ -3,10 +3,8 @@ np.set_printoptions(threshold=np.inf)
 
 from scipy import ndimage
 from skimage.morphology import  thin
-import matplotlib.pyplot as plt
 
 from skimage.morphology import skeletonize,binary_closing
-import mahotas as mh
 import math
 
 from utilities import bcolors
@@ -37,6 +35,7 @@ class EnergyCalibrator:
         return data
 
     def branchedPoints(self,skel):
+        import mahotas as mh
         branch1=np.array([[2, 1, 2], [1, 1, 1], [2, 2, 2]])
         branch2=np.array([[1, 2, 1], [2, 1, 2], [1, 2, 1]])
         branch3=np.array([[1, 2, 1], [2, 1, 2], [1, 2, 2]])
@@ -58,6 +57,7 @@ class EnergyCalibrator:
         return br1+br2+br3+br4+br5+br6+br7+br8+br9
 
     def endPoints(self,skel):
+        import mahotas as mh
         endpoint1=np.array([[0, 0, 0],
                             [0, 1, 0],
                             [2, 1, 2]])
@@ -200,10 +200,10 @@ class EnergyCalibrator:
             l = self.length
         return l
 
-from skimage import io
-from skimage.util import img_as_ubyte
-
 if __name__ == '__main__':
+    from skimage import io
+    from skimage.util import img_as_ubyte
+    import matplotlib.pyplot as plt
 
 
     ## this tests the calibrator with saved numpy array of one cluster
@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+
+# Store of the decoded camera frames of one run, to reprocess it (e.g. with other clustering parameters)
+# without decompressing the MIDAS file and decoding the CAM banks again.
+# It is a HDF5 file (frames_run<run>.h5) with
+#    frames : uint16 [nframes, ny, nx], chunked in blocks of 'block' frames, each compressed (lzf/gzip) or not
+#    event  : int32 [nframes], the event number of each frame
+# and the run number and the camera geometry as attributes. A frame is read by event number decompressing
+# only its block, and the last block read is kept in memory, so a sequential loop decompresses each block once.
+# Written with 'python reconstruction.py <config> -r <run> --write-frames', read with rawdata_tier = 'framestore'.
+
+import os
+import numpy as np
+
+def frameStoreName(run,directory):
+    return os.path.join(directory,'frames_run{r:05d}.h5'.format(r=int(run)))
+
+class FrameStoreWriter:
+    def __init__(self,fname,run,block=16,compression='lzf',geometry=None):
+        self.fname = fname
+        self.tmpname = fname+'.part'
+        self.block = int(block)
+        self.compression = None if compression in (None,'none') else compression
+        import h5py
+        self.file = h5py.File(self.tmpname,'w')
+        self.file.attrs['run'] = int(run)
+        self.file.attrs['block'] = self.block
+        if geometry: self.file.attrs['geometry'] = geometry
+        self.frames = None
+        self.bufevents = []
+        self.nframes = 0
+
+    def create(self,shape):
+        # the datasets are created with the shape of the first frame
+        ny,nx = shape
+        self.frames = self.file.create_dataset('frames',shape=(0,ny,nx),maxshape=(None,ny,nx),dtype='uint16',
+                                               chunks=(self.block,ny,nx),compression=self.compression)
+        self.events = self.file.create_dataset('event',shape=(0,),maxshape=(None,),dtype='int32',chunks=(1024,))
+        self.buffer = np.zeros((self.block,ny,nx),dtype=np.uint16)
+
+    def append(self,event,frame):
+        if self.frames is None: self.create(frame.shape)
+        self.buffer[len(self.bufevents)] = frame
+        self.bufevents.append(event)
+        if len(self.bufevents) == self.block:
+            self.flush()
+
+    def flush(self):
+        # writes the buffered frames as one block (chunk) of the dataset
+        n = len(self.bufevents)
+        if n == 0: return
+        self.frames.resize(self.nframes+n,axis=0)
+        self.frames[self.nframes:self.nframes+n] = self.buffer[:n]
+        self.events.resize(self.nframes+n,axis=0)
+        self.events[self.nframes:self.nframes+n] = self.bufevents
+        self.nframes += n
+        self.bufevents = []
+
+    def close(self):
+        # the store appears under its final name only when complete
+        self.flush()
+        if self.frames is None: self.create((1,1)) # empty run
+        self.file.close()
+        os.replace(self.tmpname,self.fname)
+
+class FrameStore:
+    def __init__(self,fname):
+        self.fname = fname
+        import h5py
+        self.file = h5py.File(fname,'r')
+        self.frames = self.file['frames']
+        self.events = self.file['event'][:]
+        self.run = int(self.file.attrs['run'])
+        self.block = int(self.file.attrs['block'])
+        self.rows = {ev: i for i,ev in enumerate(self.events)}
+        self.cached = (-1,None)
+
+    def __len__(self):
+        return len(self.events)
+
+    def __contains__(self,event):
+        return event in self.rows
+
+    def shape(self):
+        return self.frames.shape[1:]
+
+    def readBlock(self,iblock):
+        if self.cached[0] != iblock:
+            self.cached = (iblock,self.frames[iblock*self.block:(iblock+1)*self.block])
+        return self.cached[1]
+
+    def frame(self,event):
+        # uint16 frame of the given event number (KeyError if not in the store)
+        row = self.rows[event]
+        return self.readBlock(row//self.block)[row%self.block]
+
+    def close(self):
+        self.file.close()
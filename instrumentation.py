@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+
+# Lightweight instrumentation of the reconstruction: per-stage wall time and RSS deltas, plus counters.
+# There is one registry per process (each worker has its own), filled with
+#
+#    import instrumentation as instr
+#    with instr.stage('pedsub'):
+#        ...
+#    @instr.timed('profiles')
+#    def calcProfiles(...): ...
+#    instr.count('clusters',len(snakes))
+#
+# At the end of the job the worker returns instr.summary(), and the main process merges the summaries
+# of all the workers (merge) into the per-run JSON file and, optionally, a Prometheus textfile.
+# The cost of a stage is two perf_counter() calls and two reads of /proc/self/statm.
+# The registry can be filled from several threads (threaded event loop, tiled clustering).
+
+import os,sys,time,json,resource,threading
+from functools import wraps
+
+_PAGESIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os,'sysconf') else 4096
+
+def procRss():
+    # current resident set size in bytes
+    try:
+        with open('/proc/self/statm','rb') as f:
+            return int(f.read().split()[1])*_PAGESIZE
+    except (OSError,IndexError):
+        return 0
+
+def rss():
+    # as procRss, for the instrumentation of the stages timed by hand: 0 (no read) when the instrumentation is off
+    if not (registry.enabled and registry.memory): return 0
+    return procRss()
+
+def peakRss():
+    # peak resident set size in bytes (ru_maxrss is in kB on linux, bytes on macOS)
+    mem = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return mem if sys.platform == "darwin" else mem*1024
+
+class _Stage:
+    __slots__ = ('registry','name','t0','m0')
+    def __init__(self,registry,name):
+        self.registry = registry
+        self.name = name
+    def __enter__(self):
+        reg = self.registry
+        self.m0 = procRss() if reg.memory else 0
+        self.t0 = time.perf_counter()
+        return self
+    def __exit__(self,exc_type,exc,tb):
+        dt = time.perf_counter() - self.t0
+        reg = self.registry
+        reg.add(self.name, dt, procRss() - self.m0 if reg.memory else 0)
+        return False
+
+class _NullStage:
+    __slots__ = ()
+    def __enter__(self): return self
+    def __exit__(self,exc_type,exc,tb): return False
+
+_nullStage = _NullStage()
+
+class Registry:
+    def __init__(self,enabled=True,memory=True):
+        self.reset(enabled,memory)
+
+    def reset(self,enabled=True,memory=True):
+        self.enabled = enabled
+        self.memory = memory
+        self.lock = threading.Lock()
+        self.stages = {}
+        self.counters = {}
+        self.labels = {}
+        self.t0 = time.perf_counter()
+        self.rss0 = procRss()
+
+    def stage(self,name):
+        return _Stage(self,name) if self.enabled else _nullStage
+
+    def add(self,name,dt,dm=0):
+        # records a stage timed outside of stage() (e.g. from existing perf_counter pairs)
+        if not self.enabled: return
+        with self.lock:
+            st = self.stages.get(name)
+            if st is None:
+                st = self.stages[name] = {'calls': 0, 'time': 0., 'time_max': 0., 'rss_delta': 0, 'rss_delta_max': 0}
+            st['calls'] += 1
+            st['time'] += dt
+            if dt > st['time_max']: st['time_max'] = dt
+            st['rss_delta'] += dm
+            if dm > st['rss_delta_max']: st['rss_delta_max'] = dm
+
+    def count(self,name,n=1):
+        if self.enabled:
+            with self.lock:
+                self.counters[name] = self.counters.get(name,0) + n
+
+    def summary(self,**labels):
+        summ = {'labels': dict(self.labels,**labels),
+                'pid': os.getpid(),
+                'wall_time': time.perf_counter() - self.t0,
+                'rss_start': self.rss0, 'rss_end': procRss(), 'rss_peak': peakRss(),
+                'stages': {k: dict(v) for k,v in self.stages.items()},
+                'counters': dict(self.counters)}
+        return summ
+
+# the registry of this process
+registry = Registry()
+
+def reset(enabled=True,memory=True):
+    registry.reset(enabled,memory)
+
+def stage(name):
+    return registry.stage(name)
+
+def add(name,dt,dm=0):
+    registry.add(name,dt,dm)
+
+def count(name,n=1):
+    registry.count(name,n)
+
+def summary(**labels):
+    return registry.summary(**labels)
+
+def timed(name):
+    # decorator version of stage()
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args,**kwargs):
+            with registry.stage(name):
+                return func(*args,**kwargs)
+        return wrapper
+    return decorator
+
+def merge(summaries,**labels):
+    # sums the per-worker summaries into the per-run one (the per-worker ones are kept in 'workers')
+    summaries = [s for s in summaries if s]
+    stages = {}; counters = {}
+    for s in summaries:
+        for name,st in s['stages'].items():
+            tot = stages.setdefault(name,{'calls': 0, 'time': 0., 'time_max': 0., 'rss_delta': 0, 'rss_delta_max': 0})
+            tot['calls'] += st['calls']; tot['time'] += st['time']; tot['rss_delta'] += st['rss_delta']
+            tot['time_max'] = max(tot['time_max'],st['time_max'])
+            tot['rss_delta_max'] = max(tot['rss_delta_max'],st['rss_delta_max'])
+        for name,n in s['counters'].items():
+            counters[name] = counters.get(name,0) + n
+    for st in stages.values():
+        st['time_mean'] = st['time']/st['calls'] if st['calls'] else 0.
+    return {'labels': labels,
+            'nworkers': len(summaries),
+            'wall_time_max': max([s['wall_time'] for s in summaries],default=0.),
+            'rss_peak_max': max([s['rss_peak'] for s in summaries],default=0),
+            'stages': stages,
+            'counters': counters,
+            'workers': summaries}
+
+def writeJSON(summ,fname):
+    with open(fname,'w') as fout:
+        json.dump(summ,fout,indent=1)
+
+def writePrometheus(summ,fname,prefix='cygno_reco'):
+    # textfile for the node_exporter textfile collector: written to a temporary file and renamed,
+    # so that the collector never reads a partial file
+    labels = ','.join('{k}="{v}"'.format(k=k,v=v) for k,v in sorted(summ['labels'].items()))
+    def fmt(name,value,extra=''):
+        lbl = ','.join(l for l in (labels,extra) if l)
+        return '{p}_{n}{{{l}}} {v}\n'.format(p=prefix,n=name,l=lbl,v=value)
+    lines = []
+    lines.append('# TYPE {p}_stage_seconds_total counter\n'.format(p=prefix))
+    for name,st in sorted(summ['stages'].items()):
+        lines.append(fmt('stage_seconds_total',st['time'],'stage="{s}"'.format(s=name)))
+    lines.append('# TYPE {p}_stage_calls_total counter\n'.format(p=prefix))
+    for name,st in sorted(summ['stages'].items()):
+        lines.append(fmt('stage_calls_total',st['calls'],'stage="{s}"'.format(s=name)))
+    lines.append('# TYPE {p}_stage_rss_delta_bytes gauge\n'.format(p=prefix))
+    for name,st in sorted(summ['stages'].items()):
+        lines.append(fmt('stage_rss_delta_bytes',st['rss_delta'],'stage="{s}"'.format(s=name)))
+    lines.append('# TYPE {p}_count_total counter\n'.format(p=prefix))
+    for name,n in sorted(summ['counters'].items()):
+        lines.append(fmt('count_total',n,'counter="{c}"'.format(c=name)))
+    lines.append('# TYPE {p}_wall_seconds gauge\n'.format(p=prefix))
+    lines.append(fmt('wall_seconds',summ['wall_time_max']))
+    lines.append('# TYPE {p}_rss_peak_bytes gauge\n'.format(p=prefix))
+    lines.append(fmt('rss_peak_bytes',summ['rss_peak_max']))
+    tmpname = fname+'.tmp'
+    with open(tmpname,'w') as fout:
+        fout.writelines(lines)
+    os.replace(tmpname,fname)
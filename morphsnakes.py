@@ -80,8 +80,91 @@ def inf_sup(u):
     return np.array(dilations, dtype=np.int8).min(0)
 
 
-_curvop = _fcycle([lambda u: sup_inf(inf_sup(u)),   # SIoIS
-                   lambda u: inf_sup(sup_inf(u))])  # ISoSI
+class _Workspace2D(object):
+
+    def __init__(self, shape):
+        """Preallocated uint8 buffers of the 2D SI and IS operators.
+
+        The level set is copied into the interior of a zero-padded buffer, and
+        the four directional erosions/dilations (along the lines of `_P2`) are
+        computed on shifted views of it, with the same zero border as
+        `ndi.binary_erosion`/`ndi.binary_dilation`. The result can be written
+        over the input level set.
+        """
+        self.pad = np.zeros((shape[0] + 2, shape[1] + 2), dtype=np.uint8)
+        self.tmp = np.empty(shape, dtype=np.uint8)
+        self.acc = np.empty(shape, dtype=np.uint8)
+        p, (m, n) = self.pad, shape
+        self.center = p[1:m + 1, 1:n + 1]
+        # the two neighbours of each pixel along the four orientations of _P2
+        self.lines = [(p[0:m, 0:n], p[2:m + 2, 2:n + 2]),  # diagonal
+                      (p[0:m, 1:n + 1], p[2:m + 2, 1:n + 1]),  # vertical
+                      (p[0:m, 2:n + 2], p[2:m + 2, 0:n]),  # anti-diagonal
+                      (p[1:m + 1, 0:n], p[1:m + 1, 2:n + 2])]  # horizontal
+
+    def sup_inf(self, u, out):
+        """SI operator: max of the erosions."""
+        np.copyto(self.center, u, casting='unsafe')
+        self.acc.fill(0)
+        for a, b in self.lines:
+            np.bitwise_and(a, b, out=self.tmp)
+            np.bitwise_and(self.tmp, self.center, out=self.tmp)
+            np.bitwise_or(self.acc, self.tmp, out=self.acc)
+        np.copyto(out, self.acc, casting='unsafe')
+        return out
+
+    def inf_sup(self, u, out):
+        """IS operator: min of the dilations."""
+        np.copyto(self.center, u, casting='unsafe')
+        self.acc.fill(1)
+        for a, b in self.lines:
+            np.bitwise_or(a, b, out=self.tmp)
+            np.bitwise_or(self.tmp, self.center, out=self.tmp)
+            np.bitwise_and(self.acc, self.tmp, out=self.acc)
+        np.copyto(out, self.acc, casting='unsafe')
+        return out
+
+
+def _sup_inf_inf_sup(u, work=None):
+    if work is None:
+        return sup_inf(inf_sup(u))
+    return work.sup_inf(work.inf_sup(u, u), u)
+
+
+def _inf_sup_sup_inf(u, work=None):
+    if work is None:
+        return inf_sup(sup_inf(u))
+    return work.inf_sup(work.sup_inf(u, u), u)
+
+
+# with a 2D workspace the smoothing is done in place, on the level set u
+_curvop = _fcycle([_sup_inf_inf_sup,   # SIoIS
+                   _inf_sup_sup_inf])  # ISoSI
+
+
+def _workspace(u):
+    """2D fast path of the smoothing operators, None for 3D."""
+    return _Workspace2D(u.shape) if np.ndim(u) == 2 else None
+
+
+class _Convergence(object):
+
+    def __init__(self, u, stop_after):
+        """Counts the consecutive iterations without any pixel flip."""
+        self.stop_after = stop_after
+        self.prev = u.copy() if stop_after > 0 else None
+        self.stable = 0
+
+    def __call__(self, u):
+        """True when the level set did not change for `stop_after` iterations."""
+        if self.stop_after <= 0:
+            return False
+        if np.array_equal(u, self.prev):
+            self.stable += 1
+        else:
+            self.stable = 0
+            np.copyto(self.prev, u)
+        return self.stable >= self.stop_after
 
 
 def _check_input(image, init_level_set):
@@ -213,7 +296,7 @@ def inverse_gaussian_gradient(image, alpha=100.0, sigma=5.0):
 
 def morphological_chan_vese(image, iterations, init_level_set='checkerboard',
                             smoothing=1, lambda1=1, lambda2=1,
-                            iter_callback=lambda x: None):
+                            iter_callback=lambda x: None, stop_after=0):
     """Morphological Active Contours without Edges (MorphACWE)
 
     Active contours without edges implemented with morphological operators. It
@@ -250,7 +333,12 @@ def morphological_chan_vese(image, iterations, init_level_set='checkerboard',
     iter_callback : function, optional
         If given, this function is called once per iteration with the current
         level set as the only argument. This is useful for debugging or for
-        plotting intermediate results during the evolution.
+        plotting intermediate results during the evolution. The level set is
+        updated in place: copy it to keep the intermediate results.
+    stop_after : uint, optional
+        If larger than 0, the evolution stops when no pixel of the level set
+        changed for `stop_after` consecutive iterations. With 0 (default) all
+        the `iterations` are run.
 
     Returns
     -------
@@ -288,6 +376,8 @@ def morphological_chan_vese(image, iterations, init_level_set='checkerboard',
     _check_input(image, init_level_set)
 
     u = np.int8(init_level_set > 0)
+    work = _workspace(u)
+    converged = _Convergence(u, stop_after)
 
     iter_callback(u)
 
@@ -308,9 +398,11 @@ def morphological_chan_vese(image, iterations, init_level_set='checkerboard',
 
         # Smoothing
         for _ in range(smoothing):
-            u = _curvop(u)
+            u = _curvop(u, work)
 
         iter_callback(u)
+        if converged(u):
+            break
 
     return u
 
@@ -318,7 +410,8 @@ def morphological_chan_vese(image, iterations, init_level_set='checkerboard',
 def morphological_geodesic_active_contour(gimage, iterations,
                                           init_level_set='circle', smoothing=1,
                                           threshold='auto', balloon=0,
-                                          iter_callback=lambda x: None):
+                                          iter_callback=lambda x: None,
+                                          stop_after=0):
     """Morphological Geodesic Active Contours (MorphGAC).
 
     Geodesic active contours implemented with morphological operators. It can
@@ -364,7 +457,12 @@ def morphological_geodesic_active_contour(gimage, iterations,
     iter_callback : function, optional
         If given, this function is called once per iteration with the current
         level set as the only argument. This is useful for debugging or for
-        plotting intermediate results during the evolution.
+        plotting intermediate results during the evolution. The level set is
+        updated in place: copy it to keep the intermediate results.
+    stop_after : uint, optional
+        If larger than 0, the evolution stops when no pixel of the level set
+        changed for `stop_after` consecutive iterations. With 0 (default) all
+        the `iterations` are run.
 
     Returns
     -------
@@ -412,6 +510,12 @@ def morphological_geodesic_active_contour(gimage, iterations,
         threshold_mask_balloon = image > threshold / np.abs(balloon)
 
     u = np.int8(init_level_set > 0)
+    work = _workspace(u)
+    converged = _Convergence(u, stop_after)
+    # work buffers reused by all the iterations
+    balloon_aux = np.empty(u.shape, dtype=bool)
+    aux = np.empty(image.shape, dtype=np.result_type(image.dtype, np.float64))
+    prod = np.empty_like(aux)
 
     iter_callback(u)
 
@@ -419,24 +523,27 @@ def morphological_geodesic_active_contour(gimage, iterations,
 
         # Balloon
         if balloon > 0:
-            aux = ndi.binary_dilation(u, structure)
+            ndi.binary_dilation(u, structure, output=balloon_aux)
         elif balloon < 0:
-            aux = ndi.binary_erosion(u, structure)
+            ndi.binary_erosion(u, structure, output=balloon_aux)
         if balloon != 0:
-            u[threshold_mask_balloon] = aux[threshold_mask_balloon]
+            np.copyto(u, balloon_aux, where=threshold_mask_balloon)
 
         # Image attachment
-        aux = np.zeros_like(image)
+        aux.fill(0)
         du = np.gradient(u)
         for el1, el2 in zip(dimage, du):
-            aux += el1 * el2
+            np.multiply(el1, el2, out=prod)
+            aux += prod
         u[aux > 0] = 1
         u[aux < 0] = 0
 
         # Smoothing
         for _ in range(smoothing):
-            u = _curvop(u)
+            u = _curvop(u, work)
 
         iter_callback(u)
+        if converged(u):
+            break
 
     return u
@@ -1,6 +1,5 @@
 from __future__ import print_function
 
-import ROOT as r 
 import numpy as np
 import pickle
 import math
@@ -41,6 +40,10 @@ features = {
 
     }
 
+# branches used by the features, the preselection and the cuts (read from the parquet output)
+readColumns = ['event','nSc','sc_integral','sc_nhits','sc_length','sc_width','sc_lgausssigma','sc_tgausssigma',
+               'sc_latrms','sc_longrms','sc_size','sc_xmean','sc_ymean']
+
 def preselection(ev,isc):
     pixw = 0.152 # pixel width in mm
     NX = 2304
@@ -78,7 +81,14 @@ def toNumpy(maxEntries,task):
     print('starting', task)
     fil, typs = task
     print('List of features for', featureList + eval('featureList'))
-    tfile = r.TFile(fil); ttree = tfile.Events
+    if fil.endswith('.parquet'):
+        # columnar output of the reconstruction (output_backend = 'parquet'): one row per event, the sc_* columns as arrays
+        import pandas as pd
+        tfile = None
+        ttree = pd.read_parquet(fil+'/Events',columns=readColumns).itertuples(index=False)
+    else:
+        import ROOT as r
+        tfile = r.TFile(fil); ttree = tfile.Events
     results = {}
     for ty in typs: 
         results[ty + '_test']  = []
@@ -93,7 +103,7 @@ def toNumpy(maxEntries,task):
            for ty in typs:
                if classes[ty]['cut'](ev,isc):
                    results[ty+'_'+tstr].append([ features[s](ev,isc) for s in (featureList) ])
-    tfile.Close()
+    if tfile: tfile.Close()
     print('finishing', task)
     return results
 
@@ -1,8 +1,7 @@
 from array import array
-import ROOT
-ROOT.PyConfig.IgnoreCommandLineOptions = True
+import numpy as np
 
-_rootBranchType2PythonArray = { 'b':'B', 'B':'b', 'i':'I', 'I':'i', 'F':'f', 'D':'d', 'l':'L', 'L':'l', 'O':'B' }
+_rootBranchType2PythonArray = { 'b':'B', 'B':'b', 's':'H', 'S':'h', 'i':'I', 'I':'i', 'F':'f', 'D':'d', 'l':'L', 'L':'l', 'O':'B' }
 
 class OutputBranch:
     def __init__(self, tree, name, rootBranchType, n=1, lenVar=None, title=None):
@@ -22,7 +21,11 @@ class OutputBranch:
             if len(self.buff) < len(val): # realloc
                 self.buff = array(self.buff.typecode, max(len(val),2*len(self.buff))*[0. if self.buff.typecode in 'fd' else 0])
                 self.branch.SetAddress(self.buff)
-            for i,v in enumerate(val): self.buff[i] = v
+            if isinstance(val,np.ndarray):
+                # bulk copy into the buffer, without looping in python
+                np.frombuffer(self.buff, dtype=self.buff.typecode)[:len(val)] = val
+            else:
+                for i,v in enumerate(val): self.buff[i] = v
         elif self.n == 1: 
             self.buff[0] = val
         else:
@@ -51,4 +54,167 @@ class OutputTree:
     def write(self):
         self._file.cd()
         self._tree.Write()
+    def checkpoint(self):
+        # makes the entries filled so far readable from the file even if the job is killed later
+        self._tree.AutoSave("SaveSelf;FlushBaskets")
+
+
+class BufferedOutputTree:
+    # Stand-in for an OutputTree/ColumnarOutputTree in the threaded event loop (--executor thread): the values
+    # filled by the event are kept, and written into the real tree later by the thread owning it (replay), in
+    # event order. As the buffers of the real branches, the values persist after fill(); a fork starts from the
+    # current values (e.g. the slow control variables filled by the event loop before the camera frame)
+    def __init__(self, target, values=None):
+        self._target = target
+        self._values = dict(values) if values else {}
+        self._entries = []
+    def branch(self, name, rootBranchType, n=1, lenVar=None, title=None):
+        return self._target.branch(name, rootBranchType, n=n, lenVar=lenVar, title=title)
+    def fillBranch(self, name, val):
+        self._values[name] = val
+    def fork(self):
+        return BufferedOutputTree(self._target, self._values)
+    def tree(self):
+        return self._target.tree()
+    def fill(self):
+        self._entries.append(dict(self._values))
+    def replay(self):
+        for values in self._entries:
+            for name,val in values.items():
+                self._target.fillBranch(name, val)
+            self._target.fill()
+        self._entries = []
+    def write(self):
+        self._target.write()
+    def checkpoint(self):
+        self._target.checkpoint()
+
+
+########################################################  COLUMNAR   ############################################################################################################################
+# Alternative backend writing the same trees (Events, PMT_Events, ...) as Parquet files, without the need of ROOT in the worker.
+# The output "file" is a directory: <name>.parquet/<tree name>/<part>.parquet, where each job chunk writes its own part,
+# so the chunks do not need to be merged (pandas.read_parquet('<name>.parquet/Events') reads all of them at once).
+# Branches with a lenVar are written as list (jagged) columns, the counter branch is kept as a plain column.
+# Each fill() appends one entry, and every 'rowgroup' entries one Parquet row group is flushed to disk.
+
+_rootBranchType2NumpyType = { 'b':'uint8', 'B':'int8', 's':'uint16', 'S':'int16', 'i':'uint32', 'I':'int32', 'F':'float32', 'D':'float64', 'l':'uint64', 'L':'int64', 'O':'bool' }
+
+class ColumnarOutputBranch:
+    def __init__(self, name, rootBranchType, n=1, lenVar=None, title=None):
+        import numpy as np
+        self.name   = name
+        self.dtype  = np.dtype(_rootBranchType2NumpyType[rootBranchType])
+        self.n      = int(n)
+        self.lenVar = lenVar
+        self.title  = title
+        # as for the ROOT buffers, the value is kept until it is filled again
+        self.value  = np.zeros(self.n, dtype=self.dtype) if (lenVar == None and self.n > 1) else (np.zeros(0, dtype=self.dtype) if lenVar != None else self.dtype.type(0))
+        self.rows   = []
+    def fill(self, val):
+        import numpy as np
+        if self.lenVar:
+            self.value = np.array(val, dtype=self.dtype).ravel()
+        elif self.n == 1:
+            self.value = val
+        else:
+            if len(val) != self.n: raise RuntimeError("Mismatch in filling branch %s of fixed length %d with %d values (%s)" % (self.name,self.n,len(val),val))
+            self.value = np.array(val, dtype=self.dtype)
+    def commit(self):
+        self.rows.append(self.value)
+    def arrowType(self):
+        import pyarrow as pa
+        t = pa.from_numpy_dtype(self.dtype)
+        if self.lenVar: return pa.list_(t)
+        elif self.n > 1: return pa.list_(t, self.n)
+        return t
+    def field(self):
+        import pyarrow as pa
+        return pa.field(self.name, self.arrowType(), metadata={'title': self.title} if self.title else None)
+    def column(self):
+        import numpy as np
+        import pyarrow as pa
+        if self.lenVar == None and self.n == 1:
+            col = pa.array(np.array(self.rows, dtype=self.dtype))
+        else:
+            lengths = np.array([len(r) for r in self.rows], dtype=np.int32)
+            offsets = np.zeros(len(lengths)+1, dtype=np.int32)
+            np.cumsum(lengths, out=offsets[1:])
+            values = np.concatenate(self.rows) if len(self.rows) else np.zeros(0, dtype=self.dtype)
+            col = pa.ListArray.from_arrays(pa.array(offsets), pa.array(values.astype(self.dtype, copy=False)), type=self.arrowType())
+        self.rows = []
+        return col
+
+class ColumnarOutputTree:
+    def __init__(self, tfile, name, title=None):
+        self._file = tfile
+        self._name = name
+        self._title = title
+        self._branches = {}
+        self._nentries = 0
+        self._file.register(self)
+    def branch(self, name, rootBranchType, n=1, lenVar=None, title=None):
+        if (lenVar != None) and (lenVar not in self._branches):
+            self._branches[lenVar] = ColumnarOutputBranch(lenVar, "i")
+        self._branches[name] = ColumnarOutputBranch(name, rootBranchType, n=n, lenVar=lenVar, title=title)
+        return self._branches[name]
+    def fillBranch(self, name, val):
+        br = self._branches[name]
+        if br.lenVar and (br.lenVar in self._branches):
+            self._branches[br.lenVar].value = len(val)
+        br.fill(val)
+    def tree(self):
+        return self
+    def name(self):
+        return self._name
+    def fill(self):
+        for br in self._branches.values():
+            br.commit()
+        self._nentries += 1
+        if self._nentries >= self._file.rowgroup:
+            self.flush()
+    def flush(self):
+        if self._nentries == 0: return
+        import pyarrow as pa
+        schema = pa.schema([br.field() for br in self._branches.values()], metadata={'title': self._title} if self._title else None)
+        table = pa.Table.from_arrays([br.column() for br in self._branches.values()], schema=schema)
+        self._file.writer(self._name, schema).write_table(table)
+        self._nentries = 0
+    def write(self):
+        self.flush()
+    def checkpoint(self):
+        self.flush()
 
+class ColumnarOutputFile:
+    def __init__(self, path, part='chunk00000', rowgroup=1000):
+        import os
+        self.path = path
+        self.part = part
+        self.rowgroup = max(1,int(rowgroup))
+        self._trees = []
+        self._writers = {}
+        self.seq = 0 # incremented at each Flush(): the following entries go to a new file <part>_<seq>.parquet
+        os.makedirs(self.path, exist_ok=True)
+    def register(self, tree):
+        self._trees.append(tree)
+    def writer(self, treename, schema):
+        if treename not in self._writers:
+            import os
+            import pyarrow.parquet as pq
+            os.makedirs(os.path.join(self.path,treename), exist_ok=True)
+            self._writers[treename] = pq.ParquetWriter(os.path.join(self.path,treename,self.partFile(self.part,self.seq)), schema)
+        return self._writers[treename]
+    @staticmethod
+    def partFile(part, seq):
+        return part+'.parquet' if seq == 0 else '%s_%05d.parquet' % (part,seq)
+    def cd(self):
+        pass
+    def Flush(self):
+        # closes the files written so far (a Parquet file is readable only once closed) and moves on to new ones
+        self.Close()
+        self.seq += 1
+    def Close(self):
+        for t in self._trees:
+            t.flush()
+        for w in self._writers.values():
+            w.close()
+        self._writers = {}
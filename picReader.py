@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+
+# Reader of the camera frames of the ROOT and h5 raw data tiers (one pic_run<run>_ev<event> object per frame).
+# The keys are parsed once and sorted by event number; the frames to be reconstructed are read ahead by a small
+# thread pool, so that the decompression of the next frames (zlib/lz4 release the GIL) overlaps with the
+# reconstruction of the current one.
+# The frames are returned in the MIDAS orientation as views of the arrays read from the file (no copies):
+# the TH2 values are [x,y], the MIDAS frames [row,column] with the rows flipped (see utilities.rootflip).
+# For h5 the dataset is read directly into a preallocated buffer of a small ring (one buffer per frame in
+# flight, plus the one returned last), so an h5 frame stays valid only until the next call of frame().
+#
+#    reader = PicReader(fname,'root',workers=2,depth=4)
+#    reader.prefetch([key for key in reader.keys if first <= reader.event(key) <= last])
+#    for key in reader.keys:
+#        img_fr = reader.frame(key)
+
+import re
+from collections import deque
+from concurrent import futures
+import numpy as np
+
+PIC_PATTERN = re.compile(r'\S+run(\d+)_ev(\d+)')
+
+def parsePicKeys(keys):
+    # {key: (run,event)} of the camera frames, and their keys sorted by event number
+    index = {}
+    for key in keys:
+        if 'pic' not in key: continue
+        m = PIC_PATTERN.match(key)
+        if m: index[key] = (int(m.group(1)),int(m.group(2)))
+    return index,sorted(index,key=lambda k: index[k][1])
+
+class PicReader:
+    def __init__(self,fname,tier,workers=2,depth=4):
+        self.tier = tier
+        if tier == 'root':
+            import uproot
+            self.file = uproot.open(fname)
+        elif tier == 'h5':
+            import h5py
+            self.file = h5py.File(fname,'r')
+        else:
+            raise ValueError("PicReader reads only the root and h5 raw data tiers, not {t}".format(t=tier))
+        self.index,self.keys = parsePicKeys(self.file.keys())
+        self.workers = max(int(workers),0)
+        self.depth = max(int(depth),1)
+        self.pool = futures.ThreadPoolExecutor(self.workers) if self.workers>0 else None
+        self.queue = deque()
+        self.pending = {}
+        self.buffers = []
+        self.nread = 0
+
+    def __len__(self):
+        return len(self.keys)
+
+    def run(self,key):
+        return self.index[key][0]
+
+    def event(self,key):
+        return self.index[key][1]
+
+    def buffer(self,ds):
+        # h5: the next buffer of the ring (one more than the frames in flight, the last one returned included)
+        slot = self.nread % (self.depth+1)
+        self.nread += 1
+        if len(self.buffers) <= slot:
+            self.buffers.append(np.empty(ds.shape,dtype=ds.dtype))
+        buf = self.buffers[slot]
+        if buf.shape != ds.shape or buf.dtype != ds.dtype:
+            buf = self.buffers[slot] = np.empty(ds.shape,dtype=ds.dtype)
+        return buf
+
+    def read(self,key,buf=None):
+        # [x,y] values of the frame
+        if self.tier == 'root':
+            return self.file[key].values()
+        ds = self.file[key]
+        if buf is None: buf = np.empty(ds.shape,dtype=ds.dtype)
+        ds.read_direct(buf)
+        return buf
+
+    def submit(self):
+        while self.queue and len(self.pending) < self.depth:
+            key = self.queue.popleft()
+            buf = self.buffer(self.file[key]) if self.tier == 'h5' else None
+            self.pending[key] = self.pool.submit(self.read,key,buf)
+
+    def prefetch(self,keys):
+        # frames to be read ahead, in the order in which they will be asked
+        if self.pool is None: return
+        self.discard()
+        self.queue = deque(keys)
+        self.submit()
+
+    def discard(self,upto=None):
+        # drops the frames read ahead (before 'upto', if given), e.g. when the frames are not asked in the prefetch order
+        for key in list(self.pending):
+            if key == upto: break
+            future = self.pending.pop(key)
+            if not future.cancel(): futures.wait([future]) # a running read still writes into its buffer
+
+    def frame(self,key):
+        # frame in the MIDAS orientation (a view)
+        if key in self.pending:
+            self.discard(upto=key)
+            values = self.pending.pop(key).result()
+            self.submit()
+        else:
+            self.discard()
+            self.queue.clear()
+            values = self.read(key,self.buffer(self.file[key]) if self.tier == 'h5' else None)
+        return values.T[::-1]
+
+    def close(self):
+        if self.pool:
+            self.discard()
+            self.pool.shutdown(wait=True)
+            self.pool = None
+        if self.tier == 'h5': self.file.close()
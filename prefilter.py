@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+
+# Quick classification of the raw camera frames before the full resolution processing. In the low-rate runs most
+# frames are empty (or pedestal-like), and would otherwise go through the pedestal subtraction, zero suppression,
+# median filter and noise reduction before the clustering finds no points.
+# A few cheap statistics are computed on a strided subsample of the frame in the xy acceptance (one pixel every
+# 'stride' per axis), pedestal subtracted:
+#  - the blocks of block x block pixels whose sum is above nsigma times its noise (from the noise map)
+#  - the significance of the sum of the whole subsample, and of its largest row and column projections
+#    (a long faint track can be below threshold in every block)
+# and the frame is routed to:
+#  - PREFILTER_SKIP: no active block and no significant sum or projection. No clustering: the camera variables
+#                    are estimated on the subsample
+#  - PREFILTER_FAST: a few active blocks, and nothing significant outside them. The frame is zero-suppressed only
+#                    in the active blocks (plus one block around them), as a sparse frame (see sparseFrame.py)
+#  - PREFILTER_FULL: the full processing
+#
+#    pf = FramePrefilter(pedarr_fr,noisearr_fr,(ymin,ymax,xmin,xmax),stride=4,block=32,nsigma=5)
+#    result = pf.classify(img_fr)
+#    if result.status == PREFILTER_FAST: rows,cols = pf.roi(result.active)
+
+import numpy as np
+
+PREFILTER_FULL = 0
+PREFILTER_FAST = 1
+PREFILTER_SKIP = 2
+
+PREFILTER_NAMES = {PREFILTER_FULL: 'full', PREFILTER_FAST: 'fast', PREFILTER_SKIP: 'skip'}
+
+class PrefilterResult:
+    def __init__(self,status,active,nactive,projsig,sumsig,camera):
+        self.status = status
+        self.active = active     # boolean map of the blocks above threshold
+        self.nactive = nactive
+        self.projsig = projsig   # largest significance of the row/column projections
+        self.sumsig = sumsig     # significance of the sum of the subsample
+        self.camera = camera     # (integral,mean,rms) of the zero-suppressed frame, estimated on the subsample
+
+    def stats(self):
+        # as sparseFrame.SparseFrame.stats, for treeVars.fillCameraVariables of the skipped frames
+        return self.camera
+
+class FramePrefilter:
+    def __init__(self,pedarr,noisearr,acceptance,stride=4,block=32,nsigma=5,proj_nsigma=5,sum_nsigma=5,fast_blocks=16,cimax=5000,zs_nsigma=1):
+        # acceptance: (ymin,ymax,xmin,xmax) in full resolution pixels; block: a multiple of the stride
+        self.shape = pedarr.shape
+        self.ymin,self.ymax,self.xmin,self.xmax = acceptance
+        self.stride = max(int(stride),1)
+        self.step = max(int(block)//self.stride,1) # block size in subsample pixels
+        self.block = self.step*self.stride
+        self.nsigma,self.proj_nsigma,self.sum_nsigma = nsigma,proj_nsigma,sum_nsigma
+        self.fast_blocks = fast_blocks
+        self.cimax,self.zs_nsigma = cimax,zs_nsigma
+        # subsampled maps and the noise of the blocks and of the projections
+        window = self.subsample
+        self.ped = window(pedarr).astype(np.float32)
+        self.noise = window(noisearr).astype(np.float32)
+        var = self.noise.astype(np.float64)**2
+        self.edges = (np.arange(0,var.shape[0],self.step),np.arange(0,var.shape[1],self.step))
+        self.blockSigma = np.sqrt(self.blockSum(var))
+        self.rowSigma = np.sqrt(var.sum(axis=1))
+        self.colSigma = np.sqrt(var.sum(axis=0))
+        self.sumSigma = np.sqrt(var.sum())
+
+    def subsample(self,img):
+        s = self.stride
+        return img[self.ymin:self.ymax:s,self.xmin:self.xmax:s]
+
+    def blockSum(self,arr):
+        return np.add.reduceat(np.add.reduceat(arr,self.edges[0],axis=0),self.edges[1],axis=1)
+
+    def expand(self,blocks):
+        # block map -> subsample map
+        return np.repeat(np.repeat(blocks,self.step,axis=0),self.step,axis=1)[:self.ped.shape[0],:self.ped.shape[1]]
+
+    def projections(self,excess):
+        return max(np.max(excess.sum(axis=1)/self.rowSigma,initial=0),np.max(excess.sum(axis=0)/self.colSigma,initial=0))
+
+    def classify(self,img_fr):
+        sub = self.subsample(img_fr)
+        excess = np.where(sub < self.cimax,sub,0) - self.ped
+        active = self.blockSum(excess) > self.nsigma*self.blockSigma
+        nactive = int(np.count_nonzero(active))
+        projsig = self.projections(excess)
+        sumsig = float(excess.sum()/self.sumSigma)
+        if nactive == 0 and projsig < self.proj_nsigma and sumsig < self.sum_nsigma:
+            status = PREFILTER_SKIP
+        elif nactive <= self.fast_blocks and self.projections(np.where(self.expand(self.dilate(active)),0,excess)) < self.proj_nsigma:
+            status = PREFILTER_FAST
+        else:
+            status = PREFILTER_FULL
+        camera = None
+        if status == PREFILTER_SKIP:
+            # zero suppression of the subsample, each pixel standing for stride x stride pixels of the frame
+            zs = np.where(excess > self.zs_nsigma*self.noise,excess,0).astype(np.float64)
+            npix = self.shape[0]*self.shape[1]
+            integral = zs.sum()*self.stride**2
+            mean = integral/npix
+            camera = (integral,mean,np.sqrt(max(np.sum(zs**2)*self.stride**2/npix - mean**2,0.)))
+        return PrefilterResult(status,active,nactive,projsig,sumsig,camera)
+
+    def dilate(self,active):
+        # one block around the active ones
+        rows = active.copy()
+        rows[1:] |= active[:-1]
+        rows[:-1] |= active[1:]
+        ret = rows.copy()
+        ret[:,1:] |= rows[:,:-1]
+        ret[:,:-1] |= rows[:,1:]
+        return ret
+
+    def roi(self,active):
+        # full resolution pixels (row-major order) of the active blocks and of the ones around them
+        ny,nx = min(self.ymax,self.shape[0])-self.ymin,min(self.xmax,self.shape[1])-self.xmin
+        mask = np.repeat(np.repeat(self.dilate(active),self.block,axis=0),self.block,axis=1)[:ny,:nx]
+        rows,cols = np.nonzero(mask)
+        return rows+self.ymin,(cols+self.xmin).astype(np.int32)
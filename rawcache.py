@@ -0,0 +1,223 @@
+#!/usr/bin/env python
+
+# Local cache of the raw data files (ROOT/h5/MIDAS) downloaded from the cloud storage, shared by all
+# the jobs running on the same node:
+#  - a download lock per file (fcntl): exactly one process downloads a given run, the others wait
+#    and then find it in the cache;
+#  - the download goes to <name>.part.<pid> and is renamed to <name> only when complete, so a file
+#    in the cache is always complete;
+#  - the total size of the cache is kept below a byte budget evicting the least recently used files
+#    (the mtime is touched at every hit). Files being read by a job (shared lock) are never evicted;
+#  - hits/misses/bytes are counted and printed with report().
+# The pins and the counters are shared by the threads of the process (e.g. RunPrefetcher), behind a lock.
+# Any URL understood by urllib works, so a file:// URL or a local HTTP server can be used as stand-in
+# for the S3 endpoint (see swiftlib.BASE_URL).
+
+import os,sys,time,fcntl,shutil,threading
+from urllib.request import urlopen
+
+class RawFileCache:
+    def __init__(self,cachedir,budget=None,verbose=True):
+        self.cachedir = cachedir
+        self.budget = budget # bytes, None = unlimited
+        self.verbose = verbose
+        self.stats = {'hits': 0, 'misses': 0, 'bytes_downloaded': 0, 'bytes_served': 0,
+                      'evicted_files': 0, 'evicted_bytes': 0, 'wait_time': 0., 'download_time': 0.}
+        self._pins = {}
+        self._lock = threading.Lock()
+        os.makedirs(cachedir,exist_ok=True)
+
+    def _lockname(self,fname):
+        return os.path.join(self.cachedir,'.{f}.lock'.format(f=fname))
+
+    def _count(self,key,value=1):
+        with self._lock:
+            self.stats[key] += value
+
+    def path(self,url,fname=None):
+        return os.path.join(self.cachedir,fname if fname else os.path.basename(url))
+
+    def cached(self,url,fname=None):
+        return os.path.isfile(self.path(url,fname))
+
+    def fetch(self,url,fname=None):
+        # returns the local path of the file, downloading it if not in the cache.
+        # The file stays pinned (not evictable) until release() or the end of the process
+        fname = fname if fname else os.path.basename(url)
+        path = os.path.join(self.cachedir,fname)
+        with self._lock:
+            if fname not in self._pins:
+                pinfd = os.open(self._lockname(fname),os.O_RDWR|os.O_CREAT,0o664)
+                fcntl.flock(pinfd,fcntl.LOCK_SH)
+                self._pins[fname] = pinfd
+        if os.path.isfile(path):
+            self._count('hits')
+            os.utime(path) # LRU bookkeeping
+        else:
+            # only one process downloads, the others wait here and then find the file
+            dlfd = os.open(self._lockname(fname+'.download'),os.O_RDWR|os.O_CREAT,0o664)
+            t0 = time.perf_counter()
+            fcntl.flock(dlfd,fcntl.LOCK_EX)
+            self._count('wait_time',time.perf_counter()-t0)
+            try:
+                if os.path.isfile(path):
+                    self._count('hits')
+                    os.utime(path)
+                else:
+                    self._count('misses')
+                    self._download(url,path)
+            finally:
+                fcntl.flock(dlfd,fcntl.LOCK_UN)
+                os.close(dlfd)
+        self._count('bytes_served',os.path.getsize(path))
+        return path
+
+    def release(self,path):
+        fname = os.path.basename(path)
+        with self._lock:
+            lockfd = self._pins.pop(fname,None)
+        if lockfd is not None:
+            fcntl.flock(lockfd,fcntl.LOCK_UN)
+            os.close(lockfd)
+
+    def _download(self,url,path):
+        t0 = time.perf_counter()
+        partname = '{p}.part.{pid}'.format(p=path,pid=os.getpid())
+        if self.verbose: print("Downloading {url} into the cache {d}".format(url=url,d=self.cachedir))
+        try:
+            with urlopen(url) as src:
+                size = src.headers.get('Content-Length') if hasattr(src,'headers') else None
+                if size: self.evict(int(size))
+                with open(partname,'wb') as dst:
+                    shutil.copyfileobj(src,dst,length=1<<22)
+            os.replace(partname,path)
+        except BaseException:
+            if os.path.exists(partname): os.remove(partname)
+            raise
+        nbytes = os.path.getsize(path)
+        self._count('bytes_downloaded',nbytes)
+        self._count('download_time',time.perf_counter()-t0)
+        if not size: self.evict(0,keep=os.path.basename(path))
+
+    def entries(self):
+        # (mtime, size, name) of the complete files in the cache
+        ret = []
+        for f in os.listdir(self.cachedir):
+            if f.startswith('.') or '.part.' in f: continue
+            full = os.path.join(self.cachedir,f)
+            if os.path.isfile(full):
+                st = os.stat(full)
+                ret.append((st.st_mtime,st.st_size,f))
+        return ret
+
+    def usage(self):
+        return sum([size for _,size,_ in self.entries()])
+
+    def evict(self,needed,keep=None,warn=True):
+        # removes the least recently used files until 'needed' more bytes fit in the budget. Returns whether they fit
+        if self.budget is None: return True
+        lockfd = os.open(os.path.join(self.cachedir,'.evict.lock'),os.O_RDWR|os.O_CREAT,0o664)
+        fcntl.flock(lockfd,fcntl.LOCK_EX)
+        try:
+            entries = sorted(self.entries())
+            with self._lock:
+                pinned = set(self._pins)
+            total = sum([size for _,size,_ in entries])
+            for mtime,size,f in entries:
+                if total+needed <= self.budget: break
+                if f == keep or f in pinned: continue
+                flock = os.open(self._lockname(f),os.O_RDWR|os.O_CREAT,0o664)
+                try:
+                    fcntl.flock(flock,fcntl.LOCK_EX|fcntl.LOCK_NB)
+                except BlockingIOError:
+                    os.close(flock) # in use by another job
+                    continue
+                try:
+                    os.remove(os.path.join(self.cachedir,f))
+                    total -= size
+                    self._count('evicted_files')
+                    self._count('evicted_bytes',size)
+                    if self.verbose: print("Cache: evicted {f} ({s:.1f} MB)".format(f=f,s=size/1e6))
+                finally:
+                    fcntl.flock(flock,fcntl.LOCK_UN)
+                    os.close(flock)
+            if total+needed > self.budget and warn:
+                print("WARNING: raw file cache {d} over budget ({u:.1f} GB used, {b:.1f} GB budget): all the files are in use".format(d=self.cachedir,u=total/1e9,b=self.budget/1e9))
+        finally:
+            fcntl.flock(lockfd,fcntl.LOCK_UN)
+            os.close(lockfd)
+        return total+needed <= self.budget
+
+    def report(self,out=sys.stdout):
+        with self._lock:
+            s = dict(self.stats)
+        out.write("Raw file cache {d}: {h} hits, {m} misses, {dl:.1f} MB downloaded in {dt:.1f} s, {sv:.1f} MB served, {ef} files ({eb:.1f} MB) evicted, {w:.1f} s waiting for other jobs. Usage {u:.2f} GB{b}\n".format(
+            d=self.cachedir,h=s['hits'],m=s['misses'],dl=s['bytes_downloaded']/1e6,dt=s['download_time'],sv=s['bytes_served']/1e6,
+            ef=s['evicted_files'],eb=s['evicted_bytes']/1e6,w=s['wait_time'],u=self.usage()/1e9,
+            b='' if self.budget is None else ' / {b:.2f} GB'.format(b=self.budget/1e9)))
+        return s
+
+
+class RunPrefetcher:
+    # downloads in a background thread the raw files of the next runs of a run list into the cache,
+    # while the current run is reconstructed. At most 'depth' runs ahead of the current one are
+    # fetched, and only if the cache has (or can make, evicting the files not in use) room for them,
+    # assuming they are as big as the last one
+    def __init__(self,cache,urls,depth=2):
+        import threading
+        self.cache = cache
+        self.urls = list(urls) # [(run,url),...] in processing order
+        self.depth = depth
+        self.current = 0
+        self.lastsize = 0
+        self.ready = {}  # run -> threading.Event
+        self.errors = {}
+        self.paths = {}
+        self.stopped = False
+        self.cond = threading.Condition()
+        for run,url in self.urls:
+            self.ready[run] = threading.Event()
+        self.thread = threading.Thread(target=self._loop,name='RunPrefetcher',daemon=True)
+        self.thread.start()
+
+    def _hasRoom(self):
+        # a full cache is the steady state: the least recently used files not in use are evicted to make room,
+        # the prefetcher waits only if all the files are pinned
+        return self.cache.evict(self.lastsize,warn=False)
+
+    def _loop(self):
+        for i,(run,url) in enumerate(self.urls):
+            with self.cond:
+                # the current run is always fetched, the following ones only within depth and budget
+                while not self.stopped and i > self.current and (i > self.current+self.depth or not self._hasRoom()):
+                    self.cond.wait(timeout=5)
+                if self.stopped: break
+            try:
+                path = self.cache.fetch(url)
+                self.paths[run] = path
+                self.lastsize = max(self.lastsize,os.path.getsize(path))
+            except Exception as e:
+                self.errors[run] = e
+            self.ready[run].set()
+        for ev in self.ready.values(): ev.set()
+
+    def wait(self,run):
+        # blocks until the file of the run is in the cache. Returns the time spent waiting (I/O wait)
+        t0 = time.perf_counter()
+        self.ready[run].wait()
+        if run in self.errors:
+            raise self.errors[run]
+        return time.perf_counter()-t0
+
+    def done(self,run):
+        # the run is reconstructed: its file can be evicted, and the prefetcher can move on
+        with self.cond:
+            if run in self.paths:
+                self.cache.release(self.paths[run])
+            self.current = [r for r,_ in self.urls].index(run)+1
+            self.cond.notify_all()
+
+    def stop(self):
+        with self.cond:
+            self.stopped = True
+            self.cond.notify_all()
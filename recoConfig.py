@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+
+# Run configuration: all the parameter sets in modules_config/ are read (and eval'd) once per job,
+# checked, and then passed down to the reconstruction stages (SnakesFactory, DDBSCAN, EnergyCalibrator,
+# SuperClusterAlgorithm, env variables conversion) instead of re-reading the files in the event loop.
+# The object is read-only and made of plain dicts, so it is cheap to pickle when sent to the workers.
+
+class FrozenDict(dict):
+    def _readonly(self, *args, **kwargs):
+        raise TypeError("The reconstruction configuration is read-only")
+    __setitem__ = __delitem__ = clear = pop = popitem = setdefault = update = _readonly
+    def __reduce__(self):
+        return (FrozenDict, (dict(self),))
+
+def _freeze(obj):
+    if isinstance(obj, dict):
+        return FrozenDict((k, _freeze(v)) for k, v in obj.items())
+    if isinstance(obj, list):
+        return tuple(_freeze(v) for v in obj)
+    return obj
+
+def loadParams(configFile):
+    with open(configFile,'r') as f:
+        return eval(f.read())
+
+class RecoConfig:
+    # parameter set -> (file, mandatory keys)
+    _psets = {
+        'geometry'         : ('modules_config/geometry_{det}.txt', ['name','pixelwidth','cameratype','vignette']),
+        'clustering'       : ('modules_config/clustering.txt',     ['dbscan_eps','dbscan_minsamples','dir_radius','dir_min_accuracy','dir_minsamples','dir_thickness',
+                                                                     'time_threshold','max_attempts','isolation_radius','metric','metric_params','algorithm',
+                                                                     'leaf_size','p','n_jobs','expand_noncore']),
+        'energyCalibrator' : ('modules_config/energyCalibrator.txt', ['p0','p1','p2','p3','p4','norm','xscale','sliceRadius','noiseThr']),
+        'env_variables'    : ('modules_config/env_variables.txt',  ['humidity','lime_pressure','atm_pressure','lime_temperature','atm_temperature','mixture_density']),
+        'eventContent'     : ('modules_config/reco_eventcontent.txt', ['scfullinfo','scpixels_sel','save_MC_data']),
+    }
+
+    def __init__(self,geometry):
+        for pset,(fname,keys) in self._psets.items():
+            fname = fname.format(det=geometry)
+            params = loadParams(fname)
+            if not isinstance(params, dict):
+                raise ValueError("Parameter set {f} is not a dictionary".format(f=fname))
+            missing = [k for k in keys if k not in params]
+            if len(missing):
+                raise ValueError("Parameter set {f} is missing the mandatory parameters: {m}".format(f=fname,m=', '.join(missing)))
+            object.__setattr__(self, pset, _freeze(params))
+
+    def override(self, **psets):
+        # a copy of the configuration with some parameters of some parameter sets changed, e.g. for a parameter scan:
+        # config.override(clustering={'dbscan_eps': 1.2})
+        new = object.__new__(RecoConfig)
+        for pset in self._psets:
+            params = getattr(self, pset)
+            if pset in psets:
+                unknown = [k for k in psets[pset] if k not in params]
+                if len(unknown):
+                    raise ValueError("Unknown parameters for the parameter set {p}: {u}".format(p=pset,u=', '.join(unknown)))
+                params = _freeze(dict(params, **psets[pset]))
+            object.__setattr__(new, pset, params)
+        return new
+
+    def __setattr__(self, name, value):
+        raise TypeError("The reconstruction configuration is read-only")
+
+    def __delattr__(self, name):
+        raise TypeError("The reconstruction configuration is read-only")
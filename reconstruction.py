@@ -1,39 +1,237 @@
-import os
-cythonized=False
-for fname in os.listdir('.'):
-        if fname.endswith('.so'):
-          cythonized=True
-          break
-          
-if cythonized==False:
-          os.system('sh cythonize.sh')
+import os,time
+_t_import0 = time.perf_counter()
+try:
+    import cython_cygno
+except ImportError:
+    os.system('sh cythonize.sh')
         
 from concurrent import futures
+import multiprocessing
 from subprocess import Popen, PIPE
-import signal,time
+import signal,threading
+from collections import deque
 
-import math,sys,random,re,gc
+import math,sys,random,re,gc,json,copy
 import numpy as np
 
 import ROOT
+ROOT.PyConfig.IgnoreCommandLineOptions = True
 ROOT.gROOT.SetBatch(True)
 import uproot
 from cameraChannel import cameraTools, cameraGeometry
-import midas.file_reader
-import h5py
 
 from snakes import SnakesProducer
-from output import OutputTree
+from recoConfig import RecoConfig, loadParams
+from output import OutputTree, ColumnarOutputTree, ColumnarOutputFile, BufferedOutputTree
 from treeVars import AutoFillTreeProducer
+from utilities import EnvVariablesConverter
+import instrumentation as instr
 import swiftlib as sw
-import cygno as cy
-
-import pandas as pd
+from rawcache import RunPrefetcher
+from watchdog import EventWatchdog, EventBudgetExceeded, STATUS_OK
+from picReader import PicReader
+from sparseFrame import SparseFrame
+from prefilter import FramePrefilter, PREFILTER_FULL, PREFILTER_FAST, PREFILTER_SKIP, PREFILTER_NAMES
+from frameStore import FrameStore, FrameStoreWriter, frameStoreName
+# the modules of a single raw data tier or mode (cygno and midas for MIDAS, h5py, pandas, the PMT reconstruction)
+# are imported by the functions using them, so a worker imports only what its run needs
 
 import utilities
 utilities = utilities.utils()
 
-from waveform import PMTreco
+# time spent importing the modules above, by the process which did it: a worker started by the forkserver
+# inherits them already imported (see workerPool)
+_importTime = (os.getpid(), time.perf_counter() - _t_import0)
+
+# Pedestal and vignetting maps cached in each process (the driver and the warm workers), keyed by the
+# pedestal file (i.e. pedestal run) and by the geometry: consecutive runs using the same pedestal run
+# do not reload them, and they are not pickled with the analysis object sent to the workers.
+_pedestalCache = {}
+_vignetteCache = {}
+_rootlogonDone = False
+
+# Threaded event loop (--executor thread): the frames are reconstructed by a pool of threads of the same process,
+# sharing the calibration maps and the output trees. Each frame fills forks of the trees (output.BufferedOutputTree),
+# which the event loop writes into the real ones in event order. The scratch images are per thread.
+_local = threading.local()
+
+def scratchBuffer(name,shape,dtype=np.float64):
+    # full resolution work image reused across the events of the calling thread
+    bufs = _local.__dict__.setdefault('buffers',{})
+    buf = bufs.get(name)
+    if buf is None or buf.shape != shape or buf.dtype != dtype:
+        buf = bufs[name] = np.empty(shape,dtype=dtype)
+    return buf
+
+# Worker processes of the chunks: with the forkserver start method a server process imports the modules used by
+# every worker once, and the workers are forked from it with those modules already imported (this script is
+# executed again in each worker, as __mp_main__, but all its imports are then found in sys.modules). Unlike fork,
+# the workers do not inherit the state of the driver (ROOT objects, logbook, maps of the previous runs).
+COMMON_MODULES = ['numpy','ROOT','uproot','scipy.ndimage','skimage.morphology','sklearn.cluster','cython_cygno',
+                  'cameraChannel','snakes','recoConfig','output','treeVars','utilities','instrumentation','swiftlib',
+                  'watchdog','picReader','sparseFrame','frameStore','prefilter']
+
+def preloadModules(options):
+    modules = list(COMMON_MODULES)
+    if options.rawdata_tier == 'midas': modules += ['cygno','midas.file_reader']
+    if options.rawdata_tier in ('h5','framestore'): modules += ['h5py']
+    if options.pmt_mode: modules += ['waveform']
+    if options.output_backend == 'parquet': modules += ['pyarrow','pyarrow.parquet']
+    return modules
+
+def workerPool(nThreads,options):
+    method = getattr(options,'start_method','forkserver')
+    if method not in multiprocessing.get_all_start_methods():
+        method = None # the default of the platform
+    ctx = multiprocessing.get_context(method)
+    if method == 'forkserver':
+        # effective only when the server is started, i.e. at the first pool of the process
+        ctx.set_forkserver_preload(preloadModules(options))
+    return futures.ProcessPoolExecutor(nThreads,mp_context=ctx)
+
+def loadPedestalMaps(pedfile):
+    if pedfile not in _pedestalCache:
+        if len(_pedestalCache) >= 2: _pedestalCache.clear()
+        pedrf_fr = uproot.open(pedfile)
+        _pedestalCache[pedfile] = (pedrf_fr['pedmap'].values().T, pedrf_fr['pedmap'].errors().T)
+    return _pedestalCache[pedfile]
+
+def loadVignettingMap(cg,vignetteCorr):
+    key = (cg.name,cg.cameratype,vignetteCorr)
+    if key not in _vignetteCache:
+        if vignetteCorr and cg.cameratype != 'Quest':
+            _vignetteCache[key] = cameraTools(cg).loadVignettingMap()
+        else:
+            if cg.cameratype == 'Quest':
+                print('There is no vignetting map for QUEST camera')
+            _vignetteCache[key] = np.ones((cg.npixy, cg.npixx))
+    return _vignetteCache[key]
+
+# MC truth of the simulated runs (event_info/info_tree of the raw file): branch of the output tree -> branch of info_tree
+MC_BRANCHES = [('eventnumber','eventnumber'), ('particle_type','particle_type'), ('energy','energy_ini'),
+               ('ioniz_energy','ioniz_energy'), ('drift','drift'), ('phi_initial','phi_ini'), ('theta_initial','theta_ini'),
+               ('MC_x_vertex','x_vertex'), ('MC_y_vertex','y_vertex'), ('MC_z_vertex','z_vertex'),
+               ('MC_x_vertex_end','x_vertex_end'), ('MC_y_vertex_end','y_vertex_end'), ('MC_z_vertex_end','z_vertex_end'),
+               ('MC_2D_pathlength','proj_track_2D'), ('MC_3D_pathlength','track_length_3D')]
+
+class MCTruth:
+    # the info_tree entries of the event range, read once as numpy columns from the (uproot) raw file (entry = event number);
+    # get(event) returns the values of the output branches of one event
+    def __init__(self,tf,first,last):
+        tree = tf['event_info/info_tree']
+        first = max(first,0)
+        last = tree.num_entries-1 if last<0 else min(last,tree.num_entries-1)
+        self.first = first
+        self.columns = tree.arrays([b for _,b in MC_BRANCHES],entry_start=first,entry_stop=last+1,library='np')
+        self.entries = max(last+1-first,0)
+
+    def get(self,event):
+        i = event-self.first
+        if not 0 <= i < self.entries:
+            print("WARNING: no MC truth for event ",event)
+            return None
+        return {out: self.columns[b][i] for out,b in MC_BRANCHES}
+
+# Checkpointing: every options.checkpointEvery events each worker makes its output persistent and records in a small
+# json journal next to it the first event not yet committed. With --resume pendingChunks() reads the journals of the
+# killed job, and only the missing event ranges are reconstructed, in new chunks merged with the old ones.
+# For ROOT the journal also records the entries of each tree at the checkpoint: the file can have more (ROOT autosaves,
+# or a kill between the AutoSave and the journal), which are dropped on resume as their events are reconstructed again.
+
+def chunkName(cid):
+    # zero padded, so that the lexical order of the files (parquet dataset, hadd of chunk*) is the event order:
+    # chunk00000 < chunk00000_00001 (parquet file after a checkpoint) < chunk00000r0000150 (resumed from event 150) < chunk00001
+    return 'chunk'+(cid if isinstance(cid,str) else '%05d' % cid)
+
+def resumedChunk(cid,event):
+    return '{c:05d}r{e:07d}'.format(c=max(cid,0),e=event)
+
+def chunkOutput(options,cid):
+    # output file (and part, for the columnar backend) and journal of the chunk cid (-1 = the run is not split in chunks)
+    base = options.outFile.split('.')[0]
+    if options.output_backend == 'parquet':
+        # all the chunks write their own part inside the same dataset directory, no merging needed
+        outfname = '{outdir}/{base}.parquet'.format(base=base,outdir=options.outdir)
+        part = chunkName(0 if cid==-1 else cid)
+        return outfname,part,'{f}/{p}.journal'.format(f=outfname,p=part)
+    elif cid==-1:
+        outfname = '{outdir}/{base}'.format(base=options.outFile,outdir=options.outdir)
+    else:
+        outfname = '{outdir}/{base}_{ij}.root'.format(base=base,ij=chunkName(cid),outdir=options.outdir)
+    return outfname,None,outfname+'.journal'
+
+def writeJournal(fname,**state):
+    # written to a temporary file and renamed, so that the journal is never partial
+    with open(fname+'.tmp','w') as fout:
+        json.dump(state,fout)
+    os.replace(fname+'.tmp',fname)
+
+def readJournal(fname):
+    if not os.path.isfile(fname): return None
+    with open(fname) as fin:
+        return json.load(fin)
+
+def truncateOutput(fname,entries):
+    # keeps only the first entries[name] entries of each tree of the file (the other objects are copied as they are)
+    fin = ROOT.TFile.Open(fname)
+    fout = ROOT.TFile.Open(fname+'.tmp','recreate')
+    for name in sorted(set([key.GetName() for key in fin.GetListOfKeys()])):
+        obj = fin.Get(name)
+        fout.cd()
+        if obj.InheritsFrom('TTree') and name in entries:
+            if obj.GetEntries() > entries[name]:
+                print("Resume: {n} entries of the tree {t} in {f} were not committed, dropped".format(n=obj.GetEntries()-entries[name],t=name,f=fname))
+            obj = obj.CopyTree('','',entries[name])
+        obj.Write(name)
+    fout.Close()
+    fin.Close()
+    os.replace(fname+'.tmp',fname)
+
+def pendingChunks(options,chunks):
+    # the chunks (id,first,last) still to be reconstructed according to the journals of a killed job on the same run:
+    # completed chunks are dropped, partially done ones are kept up to their last checkpoint and the missing events
+    # go to a new chunk '<id>r<first missing event>' (which can in turn be partially done by a previous resume)
+    pending = []
+    for ichunk,first,last in chunks:
+        if ichunk==-1 and options.output_backend != 'parquet':
+            # the partial output of a job without chunks becomes chunk 0, merged with the missing events at the end
+            outfname,_,jname = chunkOutput(options,-1)
+            journal = readJournal(jname)
+            if journal and not journal['done'] and os.path.isfile(outfname):
+                chunk0,_,journal0 = chunkOutput(options,0)
+                os.replace(outfname,chunk0)
+                os.replace(jname,journal0)
+            if os.path.isfile(chunkOutput(options,0)[2]): ichunk = 0
+        cid,start = ichunk,first
+        while True:
+            outfname,part,jname = chunkOutput(options,cid)
+            journal = readJournal(jname)
+            if journal is None:
+                pending.append((cid,start,last))
+                break
+            if journal['first'] != start or journal['last'] != last:
+                print("ERROR: the journal {j} is for the events {f}-{l}, not {f2}-{l2}. Resume with the same --jobs, --first-event and --max-entries of the killed job".format(j=jname,f=journal['first'],l=journal['last'],f2=start,l2=last))
+                sys.exit(1)
+            if journal['done']:
+                print("Resume: events {f}-{l} already reconstructed".format(f=start,l=last))
+                break
+            if options.output_backend == 'parquet':
+                # the files written after the last checkpoint were not closed, hence are not readable: drop them
+                patt = re.compile(re.escape(part)+r'(?:_(\d+))?\.parquet')
+                for tree in [d for d in os.listdir(outfname) if os.path.isdir(os.path.join(outfname,d))]:
+                    for f in os.listdir(os.path.join(outfname,tree)):
+                        m = patt.fullmatch(f)
+                        if m and int(m.group(1) or 0) >= journal['seq']:
+                            os.remove(os.path.join(outfname,tree,f))
+            elif journal['next'] != start and 'entries' in journal:
+                truncateOutput(outfname,journal['entries'])
+            if journal['next'] == start:
+                # nothing committed: the chunk is redone from scratch
+                pending.append((cid,start,last))
+                break
+            print("Resume: events {f}-{n} already reconstructed, the missing ones up to {l} go to a new chunk".format(f=start,n=journal['next']-1,l=last))
+            cid,start = resumedChunk(ichunk,journal['next']),journal['next']
+    return pending
 
 class analysis:
 
@@ -43,14 +241,13 @@ class analysis:
         if options.camera_mode:
             self.pedfile_fullres_name = options.pedfile_fullres_name
         self.tmpname = options.tmpname
-        geometryPSet   = open('modules_config/geometry_{det}.txt'.format(det=options.geometry),'r')
-        geometryParams = eval(geometryPSet.read())
-        self.cg = cameraGeometry(geometryParams)
+        # all the modules_config parameter sets, read once and shared with all the reconstruction steps
+        self.config = RecoConfig(options.geometry)
+        self.cg = cameraGeometry(self.config.geometry)
         self.xmax = self.cg.npixx
         self.ymax = self.cg.npixy
 
-        eventContentPSet = open('modules_config/reco_eventcontent.txt')
-        self.eventContentParams = eval(eventContentPSet.read())
+        self.eventContentParams = self.config.eventContent
         for k,v in self.eventContentParams.items():
             setattr(self.options,k,v)
         
@@ -61,18 +258,24 @@ class analysis:
                 self.calcPedestal(options,1)
             if not options.justPedestal:
                 print("Pulling pedestals...")
-                # first the one for clustering with rebin
-                ctools = cameraTools(self.cg)
-                # then the full resolution one
-                pedrf_fr = uproot.open(self.pedfile_fullres_name)
-                self.pedarr_fr   = pedrf_fr['pedmap'].values().T
-                self.noisearr_fr = pedrf_fr['pedmap'].errors().T
-                if options.vignetteCorr and self.cg.cameratype != 'Quest':
-                    self.vignmap = ctools.loadVignettingMap()
-                else:
-                    if self.cg.cameratype == 'Quest':
-                        print('There is no vignetting map for QUEST camera')
-                    self.vignmap = np.ones((self.ymax, self.xmax))
+                self.loadMaps()
+
+        # parameter scan: each scan point overrides some options and/or some parameters of the modules_config
+        # parameter sets (e.g. {'nsigma': 1.5, 'clustering': {'dbscan_eps': 1.2}}) and is written in its own tree
+        self.scan = []
+        if options.scan:
+            if not options.camera_mode:
+                raise RuntimeError("The parameter scan mode needs camera_mode")
+            for overrides in loadParams(options.scan):
+                opt = copy.copy(self.options)
+                psets = {k:v for k,v in overrides.items() if k in RecoConfig._psets}
+                for k,v in overrides.items():
+                    if k in psets: continue
+                    if not hasattr(opt,k):
+                        raise ValueError("Unknown option in the parameter scan: {k}".format(k=k))
+                    setattr(opt,k,v)
+                self.scan.append((opt,self.config.override(**psets)))
+            print("Parameter scan with {n} points".format(n=len(self.scan)))
 
         ## Dictionary with the PMT parameters found in config_file
         self.pmt_params = {
@@ -95,82 +298,133 @@ class analysis:
             self.pmt_params['pmt_verb']=3
             self.pmt_params['plotpy']= True
         if options.pmt_mode and not options.board_pmt_channels:
-            print('\nIt seems you are trying to analyse the PMT signals without selecting their channels. Untoggle PMT mode or add channels.\n ANALYSIS FAILED')
-            sys.exit()
+            raise RuntimeError('It seems you are trying to analyse the PMT signals without selecting their channels. Untoggle PMT mode or add channels. ANALYSIS FAILED')
         if options.include_gem and not options.pmt_mode:
-            print('\nIt seems you are trying to analyse the GEM signals without the PMT Mode On. This does not work.\n ANALYSIS FAILED')
-            sys.exit()
+            raise RuntimeError('It seems you are trying to analyse the GEM signals without the PMT Mode On. This does not work. ANALYSIS FAILED')
         if options.include_gem and not options.board_gem_channels:
-            print('\nIt seems you are trying to analyse the GEM signals without selecting their channels. Untoggle GEM mode or add channels.\n ANALYSIS FAILED')
-            sys.exit()
-
+            raise RuntimeError('It seems you are trying to analyse the GEM signals without selecting their channels. Untoggle GEM mode or add channels. ANALYSIS FAILED')
+
+
+    def loadMaps(self):
+        # full resolution pedestal/noise maps and vignetting map
+        self.pedarr_fr,self.noisearr_fr = loadPedestalMaps(self.pedfile_fullres_name)
+        self.vignmap = loadVignettingMap(self.cg,self.options.vignetteCorr)
+        # quick classification of the raw frames (see prefilter.py)
+        self.prefilter = None
+        if getattr(self.options,'prefilter',False):
+            opt = self.options
+            self.prefilter = FramePrefilter(self.pedarr_fr,self.noisearr_fr,(self.cg.ymin,self.cg.ymax,self.cg.xmin,self.cg.xmax),
+                                            stride=getattr(opt,'prefilter_stride',4),block=getattr(opt,'prefilter_block',32),
+                                            nsigma=getattr(opt,'prefilter_nsigma',5),proj_nsigma=getattr(opt,'prefilter_proj_nsigma',5),
+                                            sum_nsigma=getattr(opt,'prefilter_sum_nsigma',5),fast_blocks=getattr(opt,'prefilter_fast_blocks',16),
+                                            cimax=opt.cimax,zs_nsigma=opt.nsigma)
+
+    # the big maps are not pickled when sending the object to the workers: they are taken from the worker cache
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for k in ('pedarr_fr','noisearr_fr','vignmap','prefilter'):
+            state.pop(k,None)
+        return state
+
+    def __setstate__(self,state):
+        self.__dict__.update(state)
+        if self.options.camera_mode and not self.options.justPedestal:
+            self.loadMaps()
 
     # the following is needed for multithreading
     def __call__(self,evrange=(-1,-1,-1)):
-        if evrange[0]==-1:
-            outfname = '{outdir}/{base}'.format(base=self.options.outFile,outdir=options.outdir)
-        else:
-            outfname = '{outdir}/{base}_chunk{ij}.root'.format(base=self.options.outFile.split('.')[0],ij=evrange[0],outdir=self.options.outdir)
-        self.beginJob(outfname)
+        global _importTime
+        outfname,part,self.journal = chunkOutput(self.options,evrange[0])
+        instr.reset(enabled=self.options.instrumentation)
+        if _importTime[0] == os.getpid():
+            # imports done by this process (once per process)
+            instr.add('imports',_importTime[1])
+            _importTime = (None,0.)
+        self.watchdog = EventWatchdog(getattr(self.options,'event_time_budget',0),getattr(self.options,'event_memory_budget',0)*1e6)
+        self.beginJob(outfname,part)
+        self.evrange = evrange
+        self.committed = evrange[1]
+        if self.options.checkpointEvery>0: self.writeJournal(evrange[1])
+        self.picReader = self.frameStore = None
+        self.startFramePool()
         self.reconstruct(evrange)
+        self.stopFramePool()
+        if self.picReader: self.picReader.close(); self.picReader = None
+        if self.frameStore: self.frameStore.close(); self.frameStore = None
         self.endJob()
-        
-    def beginJob(self,outfname):
+        if self.options.checkpointEvery>0: self.writeJournal(evrange[2]+1,done=True)
+        # per-worker telemetry, merged by the main process. The events aborted by the watchdog are always counted
+        summary = instr.summary(chunk=evrange[0],first=evrange[1],last=evrange[2])
+        for reason,n in self.watchdog.aborted.items():
+            summary['counters']['events_aborted_'+reason] = n + sum([wd.aborted[reason] for wd in self.frameWatchdogs])
+        return summary
+
+    def writeJournal(self,nextEvent,done=False):
+        # entries of the ROOT trees (not needed once done: the trees are already written and the file closed)
+        entries = {} if done or self.options.output_backend == 'parquet' else {t.tree().GetName(): t.tree().GetEntries() for t in self.outTrees}
+        writeJournal(self.journal,chunk=self.evrange[0],first=self.evrange[1],last=self.evrange[2],
+                     next=nextEvent,done=done,seq=getattr(self.outputFile,'seq',0),entries=entries)
+
+    def checkpoint(self,nextEvent):
+        # makes the events before nextEvent persistent in the output, and only then records it in the journal
+        self.drainFrames()
+        with instr.stage('checkpoint'):
+            for t in self.outTrees:
+                t.checkpoint()
+            self.outputFile.Flush()
+            self.writeJournal(nextEvent)
+        self.committed = nextEvent
+
+    def newOutputTree(self,name,title):
+        if self.options.output_backend == 'parquet':
+            tree = ColumnarOutputTree(self.outputFile,name,title)
+        else:
+            tree = OutputTree(self.outputFile,ROOT.TTree(name,title))
+        self.outTrees.append(tree)
+        return tree
+
+    def beginJob(self,outfname,part=None):
+        self.outTrees = []
         # prepare output file
-        ROOT.EnableThreadSafety()
-        self.outputFile = ROOT.TFile.Open(outfname, "RECREATE")
-        print("Opening out file: ",outfname," self.outputFile = ",self.outputFile)
-        ROOT.gDirectory.cd()
-        # prepare output tree
-        if options.camera_mode or options.environment_variables:
-            self.outputTree = ROOT.TTree("Events","Tree containing reconstructed quantities")
-            self.outTree = OutputTree(self.outputFile,self.outputTree)
-            self.autotree = AutoFillTreeProducer(self.outTree,self.eventContentParams)
+        if self.options.output_backend == 'parquet':
+            self.outputFile = ColumnarOutputFile(outfname,part,rowgroup=self.options.output_rowgroup)
+            print("Opening out dataset: ",outfname," part = ",part)
+        else:
+            ROOT.EnableThreadSafety()
+            self.outputFile = ROOT.TFile.Open(outfname, "RECREATE")
+            print("Opening out file: ",outfname," self.outputFile = ",self.outputFile)
+            ROOT.gDirectory.cd()
+        # prepare output tree: one per scan point in the parameter scan mode. Each point is (options,config,tree,autotree)
+        if self.options.camera_mode or self.options.environment_variables:
+            if len(self.scan):
+                self.scanPoints = []
+                for k,(opt,config) in enumerate(self.scan):
+                    outTree,autotree = self.createEventsTree(opt,"Events_scan{k}".format(k=k),"Tree containing reconstructed quantities, scan point {k}".format(k=k))
+                    self.scanPoints.append((opt,config,outTree,autotree))
+                self.outTree,self.autotree = self.scanPoints[0][2:]
+            else:
+                self.outTree,self.autotree = self.createEventsTree(self.options,"Events","Tree containing reconstructed quantities")
+                self.scanPoints = [(self.options,self.config,self.outTree,self.autotree)]
+            if self.options.camera_mode and getattr(self.options,'frameThreads',1)>1:
+                # threaded event loop: the event loop (slow control variables) and the frames fill buffers of the trees
+                self.scanPoints = [(opt,config,BufferedOutputTree(outTree),autotree) for opt,config,outTree,autotree in self.scanPoints]
+                self.scanPoints = [(opt,config,tree,autotree.withTree(tree)) for opt,config,tree,autotree in self.scanPoints]
 
         ## Prepare PMT waveform Tree (1 event = 1 waveform)
-        if options.pmt_mode:
-            self.outputTree_pmt = ROOT.TTree("PMT_Events","Tree containing reconstructed PMT quantities")
-            self.outTree_pmt = OutputTree(self.outputFile,self.outputTree_pmt)
+        if self.options.pmt_mode:
+            self.outTree_pmt = self.newOutputTree("PMT_Events","Tree containing reconstructed PMT quantities")
             self.autotree_pmt = AutoFillTreeProducer(self.outTree_pmt,self.eventContentParams)
 
             ## Prepare PMT average waveform Tree (1 event = 1 averaged waveform using 4 PMTs)
             ## Only does average if there are more than one channel
             if len(self.options.board_pmt_channels) > 1:
-                self.outputTree_pmt_avg = ROOT.TTree("PMT_Avg_Events","Tree containing the average PMT waveforms of 4 channels")
-                self.outTree_pmt_avg = OutputTree(self.outputFile,self.outputTree_pmt_avg)
+                self.outTree_pmt_avg = self.newOutputTree("PMT_Avg_Events","Tree containing the average PMT waveforms of 4 channels")
                 self.autotree_pmt_avg = AutoFillTreeProducer(self.outTree_pmt_avg,self.eventContentParams)
 
-            if options.include_gem:
-                self.outputTree_gem = ROOT.TTree("GEM_Events","Tree containing reconstructed GEM quantities")
-                self.outTree_gem = OutputTree(self.outputFile,self.outputTree_gem)
+            if self.options.include_gem:
+                self.outTree_gem = self.newOutputTree("GEM_Events","Tree containing reconstructed GEM quantities")
                 self.autotree_gem = AutoFillTreeProducer(self.outTree_gem,self.eventContentParams)
 
-        if self.options.camera_mode:
-            self.outTree.branch("run", "I", title="run number")
-            self.outTree.branch("event", "I", title="event number")
-            self.outTree.branch("pedestal_run", "I", title="run number used for pedestal subtraction")
-            self.autotree.createCameraVariables()
-            self.autotree.createTimeCameraVariables()
-            self.autotree.createClusterVariables('sc')
-        if self.options.save_MC_data:
-#           self.outTree.branch("MC_track_len","F")
-            self.outTree.branch("eventnumber","I")
-            self.outTree.branch("particle_type","I")
-            self.outTree.branch("energy","F")
-            self.outTree.branch("ioniz_energy","F")
-            self.outTree.branch("drift","F")
-            self.outTree.branch("phi_initial","F")
-            self.outTree.branch("theta_initial","F")
-            self.outTree.branch("MC_x_vertex","F")
-            self.outTree.branch("MC_y_vertex","F")
-            self.outTree.branch("MC_z_vertex","F")
-            self.outTree.branch("MC_x_vertex_end","F")
-            self.outTree.branch("MC_y_vertex_end","F")
-            self.outTree.branch("MC_z_vertex_end","F")
-            self.outTree.branch("MC_3D_pathlength","F")
-            self.outTree.branch("MC_2D_pathlength","F")
-            
-        if options.environment_variables: self.autotree.createEnvVariables()
         if self.options.pmt_mode:
             self.autotree_pmt.createPMTVariables(self.pmt_params)
             self.autotree_pmt.createTimePMTVariables()
@@ -179,22 +433,57 @@ class analysis:
                 self.autotree_pmt_avg.createPMTVariables_average(self.pmt_params)            
                 self.autotree_pmt_avg.createTimePMTVariables()
 
-            if options.include_gem:
+            if self.options.include_gem:
                 self.autotree_gem.createPMTVariables(self.pmt_params)   ## We base GEM analysis on PMT, for now.
 
 
+    def createEventsTree(self,options,name,title):
+        outTree = self.newOutputTree(name,title)
+        autotree = AutoFillTreeProducer(outTree,self.eventContentParams)
+        if options.camera_mode:
+            outTree.branch("run", "I", title="run number")
+            outTree.branch("event", "I", title="event number")
+            outTree.branch("pedestal_run", "I", title="run number used for pedestal subtraction")
+            outTree.branch("event_status", "I", title="0 = reconstructed, 1 = aborted over the time budget, 2 = aborted over the memory budget (no clusters, partial timings)")
+            outTree.branch("prefilter_status", "I", title="0 = full processing, 1 = fast path (zero suppression in the active region only), 2 = skipped by the pre-filter (no clusters, camera variables estimated)")
+            autotree.createCameraVariables()
+            autotree.createTimeCameraVariables()
+            autotree.createClusterVariables('sc')
+        if options.save_MC_data:
+#           outTree.branch("MC_track_len","F")
+            outTree.branch("eventnumber","I")
+            outTree.branch("particle_type","I")
+            outTree.branch("energy","F")
+            outTree.branch("ioniz_energy","F")
+            outTree.branch("drift","F")
+            outTree.branch("phi_initial","F")
+            outTree.branch("theta_initial","F")
+            outTree.branch("MC_x_vertex","F")
+            outTree.branch("MC_y_vertex","F")
+            outTree.branch("MC_z_vertex","F")
+            outTree.branch("MC_x_vertex_end","F")
+            outTree.branch("MC_y_vertex_end","F")
+            outTree.branch("MC_z_vertex_end","F")
+            outTree.branch("MC_3D_pathlength","F")
+            outTree.branch("MC_2D_pathlength","F")
+            
+        if options.environment_variables: autotree.createEnvVariables()
+        return outTree,autotree
+
     def endJob(self):
-        if options.camera_mode or options.environment_variables:
-            self.outTree.write()
+        if self.options.camera_mode or self.options.environment_variables:
+            for point in self.scanPoints:
+                point[2].write()
         
         if self.options.pmt_mode:
             self.outTree_pmt.write()
             if len(self.options.board_pmt_channels) > 1:
                 self.outTree_pmt_avg.write()            
-            if options.include_gem:
+            if self.options.include_gem:
                 self.outTree_gem.write()
         
         self.outputFile.Close()
+        self.watchdog.stop()
         
     def getNEvents(self,options):
         if options.rawdata_tier == 'root':
@@ -206,13 +495,19 @@ class analysis:
             pics = [k for k in tf.keys() if 'pic' in k]
             print("n events:", len(pics))
             return len(pics)
+        elif options.rawdata_tier == 'framestore':
+            store = FrameStore(self.tmpname)
+            nevents = len(store)
+            store.close()
+            return nevents
             
         run,tmpdir,tag = self.tmpname
-        mf = sw.swift_download_midas_file(run,tmpdir,tag)     #you download the file here so that in multithread does not confuse if it downloaded or not
+        mf = sw.swift_download_midas_file(run,tmpdir,tag,cache=self.options.rawcache)     #you download the file here so that in multithread does not confuse if it downloaded or not
         if options.offline==False:
-            df = cy.read_cygno_logbook(tag=options.tag,start_run=run-2000,end_run=run+1)
+            df = utilities.read_logbook(options.tag,run-2000,run+1)
         else:
             runlog='runlog_%s_auto.csv' % (options.tag)
+            import pandas as pd
             df = pd.read_csv('pedestals/%s'%runlog)
         if df.run_number.isin({int(options.run)}).any():
            dffilter = df["run_number"] == int(options.run)
@@ -234,7 +529,40 @@ class analysis:
                     evs += 1
         return evs
 
+    def writeFrames(self,fname):
+        # first pass of a reprocessing campaign: all the camera frames of the run are decoded once into the frame store,
+        # which the following passes read with rawdata_tier = 'framestore'
+        writer = FrameStoreWriter(fname,self.options.run,block=self.options.framesBlock,compression=self.options.framesCompression,geometry=self.options.geometry)
+        if self.options.rawdata_tier in ['root','h5']:
+            reader = PicReader(self.tmpname,self.options.rawdata_tier,workers=getattr(self.options,'raw_read_workers',2),depth=getattr(self.options,'raw_read_ahead',4))
+            reader.prefetch(reader.keys)
+            for key in reader.keys:
+                with instr.stage('decode'):
+                    arr = reader.frame(key)
+                writer.append(reader.event(key),arr)
+            reader.close()
+        else:
+            import cygno as cy
+            run,tmpdir,tag = self.tmpname
+            mf = sw.swift_download_midas_file(run,tmpdir,tag,cache=self.options.rawcache)
+            mf.jump_to_start()
+            # same event numbering as in reconstruct() (one camera frame per event)
+            numev = 0
+            for mevent in mf:
+                if mevent.header.is_midas_internal_event():
+                    continue
+                for key in mevent.banks.keys():
+                    if key.startswith('CAM'):
+                        with instr.stage('decode'):
+                            arr,_,_ = cy.daq_cam2array(mevent.banks[key])
+                        writer.append(numev,arr)
+                        numev += 1
+        writer.close()
+        print("Written {n} frames into the frame store {f}".format(n=writer.nframes,f=fname))
+
     def calcPedestal(self,options,alternativeRebin=-1):
+        if options.rawdata_tier == 'framestore':
+            raise RuntimeError("The pedestals cannot be computed from a frame store: compute them first from the raw data (--justPedestal with the original rawdata_tier)")
         maxImages=options.maxEntries
         nx=self.xmax
         ny=self.ymax
@@ -250,7 +578,9 @@ class analysis:
 
         if options.rawdata_tier == 'root' or options.rawdata_tier == 'h5':
             tmpdir = '{tmpdir}'.format(tmpdir=options.tmpdir if options.tmpdir else "/tmp/")
-            if not sw.checkfiletmp(int(options.pedrun),'root',tmpdir):
+            if options.rawcache:
+                pedfilename = sw.raw_file_cache(*options.rawcache).fetch(sw.swift_root_file(options.tag, int(options.pedrun)))
+            elif not sw.checkfiletmp(int(options.pedrun),'root',tmpdir):
                 print ('Downloading file: ' + sw.swift_root_file(options.tag, int(options.pedrun)))
                 pedfilename = sw.swift_download_root_file(sw.swift_root_file(options.tag, int(options.pedrun)),int(options.pedrun),tmpdir)
             else:
@@ -259,8 +589,9 @@ class analysis:
             keys = tf.keys()
             mf = [0] # dummy array to make a common loop with MIDAS case
         else:
+            import cygno as cy
             sigrun,tmpdir,tag = self.tmpname
-            mf = sw.swift_download_midas_file(options.pedrun,tmpdir,tag)
+            mf = sw.swift_download_midas_file(options.pedrun,tmpdir,tag,cache=self.options.rawcache)
             #mf = self.tmpname
 
         # first calculate the mean 
@@ -384,29 +715,225 @@ class analysis:
         print("Pedestal calculated and saved into ",pedfilename)
 
 
+    def startFramePool(self):
+        threads = getattr(self.options,'frameThreads',1) if self.options.camera_mode else 1
+        self.framePool = futures.ThreadPoolExecutor(threads) if threads>1 else None
+        self.maxPendingFrames = 2*threads
+        self.pendingFrames = deque()
+        self.frameWatchdogs = [] # one per thread of the pool, for the count of the aborted events
+
+    def stopFramePool(self):
+        if self.framePool:
+            self.drainFrames()
+            self.framePool.shutdown()
+            self.framePool = None
+
+    def reconstructEvent(self,forks,run,event,name,img_fr,ctools,mc=None):
+        # all the scan points of one frame, in a thread of the pool, filling the forks of their trees
+        if not hasattr(_local,'watchdog'):
+            # one per thread: the memory budget is on the RSS of the whole process (see watchdog.py)
+            _local.watchdog = EventWatchdog(getattr(self.options,'event_time_budget',0),getattr(self.options,'event_memory_budget',0)*1e6)
+            self.frameWatchdogs.append(_local.watchdog)
+        shared = {}
+        for (opt,config,outTree,autotree),fork in zip(self.scanPoints,forks):
+            self.reconstructFrame((opt,config,fork,autotree.withTree(fork)),run,event,name,img_fr,ctools,shared,mc,_local.watchdog)
+        return forks
+
+    def submitFrame(self,*args):
+        # the forks are taken here, in the event loop: they keep the values filled so far (e.g. the slow control
+        # variables of this event), not the ones of the following events
+        forks = [outTree.fork() for opt,config,outTree,autotree in self.scanPoints]
+        self.pendingFrames.append(self.framePool.submit(self.reconstructEvent,forks,*args))
+        while len(self.pendingFrames) > self.maxPendingFrames:
+            self.commitFrame()
+
+    def commitFrame(self):
+        # writes the oldest frame in flight into the trees
+        forks = self.pendingFrames.popleft().result()
+        with instr.stage('fill_replay'):
+            for fork in forks:
+                fork.replay()
+
+    def drainFrames(self):
+        while getattr(self,'pendingFrames',None):
+            self.commitFrame()
+
+    def reconstructFrame(self,point,run,event,name,img_fr,ctools,shared,mc=None,watchdog=None):
+        # reconstruction of one camera frame with the options and configuration of one scan point (the only one if not
+        # in scan mode), filling its tree. The preprocessed images are kept in 'shared', keyed by the parameters they
+        # depend on, so the scan points differing only in the clustering parameters reuse them
+        options,config,outTree,autotree = point
+        watchdog = watchdog or self.watchdog
+        outTree.fillBranch("run",run)
+        outTree.fillBranch("event",event)
+        outTree.fillBranch("pedestal_run", int(options.pedrun))
+        watchdog.start()
+
+        if mc:
+            for branch,value in mc.items():
+                outTree.fillBranch(branch,value)
+
+        # quick classification of the raw frame, once for all the scan points
+        if 'prefilter' not in shared:
+            prefilter = None
+            if self.prefilter:
+                with instr.stage('prefilter'):
+                    prefilter = self.prefilter.classify(img_fr)
+                instr.count('prefilter_'+PREFILTER_NAMES[prefilter.status])
+            shared['prefilter'] = prefilter
+        prefilter = shared['prefilter']
+        prefilter_status = prefilter.status if prefilter else PREFILTER_FULL
+        outTree.fillBranch("prefilter_status", prefilter_status)
+        if prefilter_status == PREFILTER_SKIP:
+            # empty frame: only the camera level variables
+            outTree.fillBranch("event_status", STATUS_OK)
+            autotree.fillCameraVariables(prefilter)
+            autotree.fillClusterVariables([],'sc')
+            autotree.fillTimeCameraVariables(0, 0, 0, 0, 0, 0, 0, 0, 0, 0)
+            with instr.stage('fill_tree'):
+                outTree.fill()
+            watchdog.stop()
+            return
+
+        # Upper Threshold full image + pedestal subtraction + saturation correction on full image or skip it
+        key = (options.cimax,options.saturation_corr)
+        if key not in shared:
+            img_cimax = np.where(img_fr < options.cimax, img_fr, 0)
+            t_pre0 = time.perf_counter()
+            with instr.stage('pedsub'):
+                img_fr_sub = ctools.pedsub(img_cimax,self.pedarr_fr,out=scratchBuffer(('pedsub',)+key,img_fr.shape,np.result_type(img_cimax,self.pedarr_fr)))
+            t_pre1 = time.perf_counter()
+            if options.saturation_corr:
+                #print("you are in saturation correction mode")
+                with instr.stage('saturation'):
+                    img_fr_satcor = ctools.satur_corr(img_fr_sub) 
+            else:
+                #print("you are in poor mode")
+                img_fr_satcor = img_fr_sub
+            t_pre2 = time.perf_counter()
+            shared[key] = (img_fr_satcor, t_pre1 - t_pre0, t_pre2 - t_pre1)
+        img_fr_satcor, t_pedsub, t_saturation = shared[key]
+
+        # zs on full image + xy acceptance
+        # with sparse_frames the zero-suppressed frame is a list of the active pixels (see sparseFrame.py)
+        # the frames of the fast path are zero-suppressed only in the region found by the pre-filter, always sparse
+        fast = prefilter_status == PREFILTER_FAST
+        sparse = getattr(options,'sparse_frames',False) or fast
+        key = key + (options.nsigma,sparse,fast)
+        if key not in shared:
+            t_pre2 = time.perf_counter()
+            with instr.stage('zerosup'):
+                if fast:
+                    rows,cols = self.prefilter.roi(prefilter.active)
+                    values = img_fr_satcor[rows,cols]
+                    sel = values > options.nsigma * self.noisearr_fr[rows,cols]
+                    img_fr_zs  = SparseFrame.fromCoordinates(img_fr_satcor.shape,rows[sel],cols[sel],values[sel])
+                elif sparse:
+                    img_fr_zs  = SparseFrame.zeroSuppress(img_fr_satcor,self.noisearr_fr,nsigma=options.nsigma)
+                else:
+                    img_fr_zs  = ctools.zsfullres(img_fr_satcor,self.noisearr_fr,nsigma=options.nsigma)
+            t_pre3 = time.perf_counter()
+            with instr.stage('xycut'):
+                if sparse:
+                    img_fr_zs = img_fr_zs_acc = img_fr_zs.acceptance(self.cg.ymin,self.cg.ymax,self.cg.xmin,self.cg.xmax)
+                else:
+                    img_fr_zs_acc = ctools.acceptance(img_fr_zs,self.cg.ymin,self.cg.ymax,self.cg.xmin,self.cg.xmax)
+            t_pre4 = time.perf_counter()
+            shared[key] = (img_fr_zs, img_fr_zs_acc, t_pre3 - t_pre2, t_pre4 - t_pre3)
+        img_fr_zs, img_fr_zs_acc, t_zerosup, t_xycut = shared[key]
+
+        # rebinning
+        key = key + (options.rebin,)
+        if key not in shared:
+            t_pre4 = time.perf_counter()
+            with instr.stage('rebin'):
+                img_rb_zs  = img_fr_zs_acc.rebin(options.rebin) if sparse else ctools.arrrebin(img_fr_zs_acc,options.rebin)
+            t_pre5 = time.perf_counter()
+            shared[key] = (img_rb_zs, t_pre5 - t_pre4)
+        img_rb_zs, t_rebin = shared[key]
+
+        # Cluster reconstruction on 2D picture
+        algo = 'DBSCAN'
+        snprod_inputs = {'picture': img_rb_zs, 'pictureHD': img_fr_satcor, 'picturezsHD': img_fr_zs, 'pictureOri': img_fr, 'vignette': self.vignmap, 'name': name, 'algo': algo}
+        plotpy = options.jobs < 2 # for some reason on macOS this crashes in multicore
+        snprod_params = {'snake_qual': 3, 'plot2D': False, 'plotpy': False, 'plotprofiles': False, 'watchdog': watchdog}
+        t_DBSCAN_0 = time.perf_counter()
+        snprod = SnakesProducer(snprod_inputs,snprod_params,options,self.cg,config)
+        t_DBSCAN_1 = time.perf_counter()
+        try:
+            with watchdog.guard():
+                snakes, t_DBSCAN, t_variables, lp_len, t_medianfilter, t_noisered = snprod.run()
+            event_status = STATUS_OK
+        except EventBudgetExceeded as e:
+            # the event is saved without clusters, with the timings of the steps completed before the abort
+            print("WARNING: Run ",run,"- Event ",event," aborted by the watchdog: ",e)
+            event_status = e.status
+            timings = dict({'t_medianfilter': -1, 't_noisered': -1, 'lp_len': 0, 't_DBSCAN': -1, 't_variables': -1},**snprod.timings)
+            snakes = []
+            t_DBSCAN, t_variables, lp_len = timings['t_DBSCAN'], timings['t_variables'], timings['lp_len']
+            t_medianfilter, t_noisered = timings['t_medianfilter'], timings['t_noisered']
+        outTree.fillBranch("event_status", event_status)
+        t_DBSCAN_2 = time.perf_counter()
+        if options.debug_mode == 1:
+            print(f"1. DBSCAN run + variables calculation in {t_DBSCAN_2 - t_DBSCAN_1:0.4f} seconds")
+        autotree.fillCameraVariables(img_fr_zs)
+        t_DBSCAN_3 = time.perf_counter()
+        if options.debug_mode == 1:
+            print(f"fillCameraVariables in {t_DBSCAN_3 - t_DBSCAN_2:0.4f} seconds")
+        with instr.stage('fill_vars'):
+            autotree.fillClusterVariables(snakes,'sc')
+        t_DBSCAN_4 = time.perf_counter()
+        autotree.fillTimeCameraVariables(t_variables, t_DBSCAN, lp_len, t_pedsub, t_saturation, t_zerosup, t_xycut, t_rebin, t_medianfilter, t_noisered)
+        if options.debug_mode == 1:
+            print(f"fillClusterVariables in {t_DBSCAN_4 - t_DBSCAN_3:0.04f} seconds")
+            print()
+        with instr.stage('fill_tree'):
+            outTree.fill()
+        watchdog.stop()
+
     def reconstruct(self,evrange=(-1,-1,-1)):
 
-        ROOT.gROOT.Macro('rootlogon.C')
+        global _rootlogonDone
+        if not _rootlogonDone:
+            ROOT.gROOT.Macro('rootlogon.C')
+            _rootlogonDone = True
         ROOT.gStyle.SetOptStat(0)
         ROOT.gStyle.SetPalette(ROOT.kRainBow)
         savErrorLevel = ROOT.gErrorIgnoreLevel; ROOT.gErrorIgnoreLevel = ROOT.kWarning
         
         ctools = cameraTools(self.cg)
+        mcTruth = {}
         print("Reconstructing event range: ",evrange[1],"-",evrange[2])
         self.outputFile.cd()
         
-        if self.options.rawdata_tier == 'root':
-            tf = sw.swift_read_root_file(self.tmpname)
-            keys = tf.keys()
+        # frames to be reconstructed (the others are skipped without reading them)
+        def wanted(event):
+            if self.options.debug_mode == 1 and event != self.options.ev: return False
+            return evrange[1] <= event <= evrange[2] and event not in self.options.excImages
+
+        if self.options.rawdata_tier in ['root','h5']:
+            # keys parsed and sorted by event once, frames of the range read ahead in background threads
+            reader = self.picReader = PicReader(self.tmpname,self.options.rawdata_tier,workers=getattr(self.options,'raw_read_workers',2),depth=getattr(self.options,'raw_read_ahead',4))
+            keys = reader.keys
+            if self.options.camera_mode:
+                reader.prefetch([k for k in keys if wanted(reader.event(k))])
             mf = [0] # dummy array to make a common loop with MIDAS case
-        elif self.options.rawdata_tier == 'h5':
-            tf = sw.swift_read_h5_file(self.tmpname)
-            keys = tf.keys()
+            # MC truth of the events of the range, read once as columns
+            if self.options.save_MC_data:
+                if self.options.rawdata_tier == 'root':
+                    mcTruth = MCTruth(reader.file,evrange[1],evrange[2])
+                else:
+                    print("WARNING: the MC truth (event_info/info_tree) is read only from the root raw data tier, not saved")
+        elif self.options.rawdata_tier == 'framestore':
+            store = self.frameStore = FrameStore(self.tmpname)
+            keys = store.events
             mf = [0] # dummy array to make a common loop with MIDAS case
 
         elif self.options.rawdata_tier == 'midas':
+            import cygno as cy
+            if self.options.pmt_mode: from waveform import PMTreco
             run,tmpdir,tag = self.tmpname
-            mf = sw.swift_download_midas_file(run,tmpdir,tag)
+            mf = sw.swift_download_midas_file(run,tmpdir,tag,cache=self.options.rawcache)
             
             ## Necessary to read the ODB to retrieve some info necessary for the waveform analysis
             ## Seems to repeat the opening process but *doesn't* slow down the code.
@@ -415,28 +942,21 @@ class analysis:
                 odb,corrected,channels_offsets,camera_exposure = utilities.get_odb_pmt_info(mf,self.options,run)
 
             mf.jump_to_start()
-            dslow = pd.DataFrame()
             if self.options.environment_variables:
         
                 odb = cy.get_bor_odb(mf)
                 header_environment = odb.data['Equipment']['Environment']['Settings']['Names Input']
                 value_variables = odb.data['Equipment']['Environment']['Variables']
-                dslow = pd.DataFrame(columns = header_environment)
-                dslow.loc[len(dslow)] = value_variables['Input']
-                for i in dslow.keys():
-                    #try:
-                    dslow = utilities.conversion_env_variables(dslow, odb, i, j_env = 0)
-                    #except:
-                        #print("WARNING: conversion_env_variables failed.")
+                # formulas compiled once per run, first row from the BOR values
+                envconv = EnvVariablesConverter(odb, header_environment, self.config.env_variables)
                 try:
-                   self.autotree.fillEnvVariables(dslow.take([0]))
+                   dslow = envconv.append(value_variables['Input'])
+                   for point in self.scanPoints:
+                       point[3].fillEnvVariables(dslow,self.config.env_variables)
                    if not self.options.camera_mode:
                             self.outTree.fill()
                 except:
                    print("WARNING: could not fill dslow variables.")   
-                #print(dslow)
-
-                j_env = 1
 
         numev = 0
         event=0
@@ -448,6 +968,7 @@ class analysis:
         exist_pmt = False
         exist_cam = False
         fails_count = 0
+        lastEvent = None
 
         for mevent in mf:
             if self.options.rawdata_tier == 'midas':
@@ -466,8 +987,7 @@ class analysis:
                 if exist_cam and not exist_pmt:
                     fails_count +=1
                     if fails_count==3:
-                        print('\nCareful: you set the PMT analysis ON but no PMT bank was found. Are you sure PMT data is available for this run?\n ANALYSIS FAILED')
-                        sys.exit()
+                        raise RuntimeError('Careful: you set the PMT analysis ON but no PMT bank was found. Are you sure PMT data is available for this run? ANALYSIS FAILED')
                     else:
                          exist_pmt = False
                          exist_cam = False   
@@ -479,22 +999,21 @@ class analysis:
                 #print(name)
 
 
-                if self.options.rawdata_tier == 'root':
-                    if 'pic' in name:
-                        patt = re.compile('\S+run(\d+)_ev(\d+)')
-                        m = patt.match(name)
-                        run = int(m.group(1))
-                        event = int(m.group(2))
-                        img_fr = utilities.rootflip(tf,key)     #necessary to uniform root raw data to midas. This is a vertical flip (raw data differ between ROOT and MIDAS formats)
+                if self.options.rawdata_tier in ['root','h5']:
+                    run,event = reader.index[key]
+                    if self.options.camera_mode and wanted(event):
+                        with instr.stage('decode'):
+                            img_fr = reader.frame(key)     # already in the MIDAS orientation (vertical flip of the ROOT raw data), as a view
                         camera=True
 
-                elif self.options.rawdata_tier == 'h5':
-                    if 'pic' in name:
-                        patt = re.compile('\S+run(\d+)_ev(\d+)')
-                        m = patt.match(name)
-                        run = int(m.group(1))
-                        event = int(m.group(2))
-                        img_fr = utilities.rootflip(tf,key)                   #structure for h5 copied from ROOT as it was in the past. Unsure if it is correct
+                elif self.options.rawdata_tier == 'framestore':
+                    run = store.run
+                    event = int(key)
+                    name = 'pic_run{r:05d}_ev{e}'.format(r=run,e=event)
+                    # frames already decoded: only the block of the frame is decompressed, and only for the wanted events
+                    if self.options.camera_mode and wanted(event):
+                        with instr.stage('decode'):
+                            img_fr = store.frame(event)
                         camera=True
 
                 elif self.options.rawdata_tier == 'midas':
@@ -502,15 +1021,16 @@ class analysis:
                     if name.startswith('CAM'):
                         camera_read = True
                         exist_cam = True
-                        if options.camera_mode:
-                            img_fr,_,_ = cy.daq_cam2array(mevent.banks[key])
+                        if self.options.camera_mode:
+                            with instr.stage('decode'):
+                                img_fr,_,_ = cy.daq_cam2array(mevent.banks[key])
                             camera=True
                     
                     elif name.startswith('INPT') and self.options.environment_variables: # SLOW channels array
                         #try:
-                        dslow = utilities.read_env_variables(mevent.banks[key], dslow, odb, j_env=j_env)
-                        self.autotree.fillEnvVariables(dslow.take([j_env]))
-                        j_env = j_env+1
+                        dslow = envconv.append(cy.daq_slow2array(mevent.banks[key]))
+                        for point in self.scanPoints:
+                            point[3].fillEnvVariables(dslow,self.config.env_variables)
                         if not self.options.camera_mode:
                             if self.options.jobs != 1:
                                 if numev>=evrange[1]: self.outTree.fill()
@@ -560,90 +1080,32 @@ class analysis:
                 if justSkip:
                     continue
 
+                if event != lastEvent:
+                    # all the events before this one are complete
+                    if self.options.checkpointEvery>0 and event-self.committed >= self.options.checkpointEvery:
+                        self.checkpoint(event)
+                    lastEvent = event
+
                 if self.options.camera_mode:
                     if camera==True:
                         print("Processing Run: ",run,"- Event ",event,"Camera...")
-                        self.outTree.fillBranch("run",run)
-                        self.outTree.fillBranch("event",event)
-                        self.outTree.fillBranch("pedestal_run", int(self.options.pedrun))
-                    
                         testspark=2*100*self.cg.npixx*self.cg.npixy+9000000		
                         if np.sum(img_fr)>testspark:
                             print("Run ",run,"- Event ",event," has spark, will not be analyzed!")
                             continue
-
-                        if self.options.save_MC_data:
-                            mc_tree = tf.Get('event_info/info_tree')
-                            mc_tree.GetEntry(event)
-                            self.outTree.fillBranch("eventnumber",mc_tree.eventnumber)
-                            self.outTree.fillBranch("particle_type",mc_tree.particle_type)
-                            self.outTree.fillBranch("energy",mc_tree.energy_ini)
-                            self.outTree.fillBranch("ioniz_energy",mc_tree.ioniz_energy)
-                            self.outTree.fillBranch("drift",mc_tree.drift)
-                            self.outTree.fillBranch("phi_initial",mc_tree.phi_ini)
-                            self.outTree.fillBranch("theta_initial",mc_tree.theta_ini)
-                            self.outTree.fillBranch("MC_x_vertex",mc_tree.x_vertex)
-                            self.outTree.fillBranch("MC_y_vertex",mc_tree.y_vertex)
-                            self.outTree.fillBranch("MC_z_vertex",mc_tree.z_vertex)
-                            self.outTree.fillBranch("MC_x_vertex_end",mc_tree.x_vertex_end)
-                            self.outTree.fillBranch("MC_y_vertex_end",mc_tree.y_vertex_end)
-                            self.outTree.fillBranch("MC_z_vertex_end",mc_tree.z_vertex_end)
-                            self.outTree.fillBranch("MC_2D_pathlength",mc_tree.proj_track_2D)
-                            self.outTree.fillBranch("MC_3D_pathlength",mc_tree.track_length_3D)
-         
-                        # Upper Threshold full image
-                        img_cimax = np.where(img_fr < self.options.cimax, img_fr, 0)
-                        
-                        # zs on full image + saturation correction on full image or skip it
-                        t_pre0 = time.perf_counter()
-                        img_fr_sub = ctools.pedsub(img_cimax,self.pedarr_fr)
-                        t_pre1 = time.perf_counter()
-                        if self.options.saturation_corr:
-                            #print("you are in saturation correction mode")
-                            img_fr_satcor = ctools.satur_corr(img_fr_sub) 
-                        else:
-                            #print("you are in poor mode")
-                            img_fr_satcor = img_fr_sub
-                        t_pre2 = time.perf_counter()
-                        img_fr_zs  = ctools.zsfullres(img_fr_satcor,self.noisearr_fr,nsigma=self.options.nsigma)
-                        t_pre3 = time.perf_counter()
-                        img_fr_zs_acc = ctools.acceptance(img_fr_zs,self.cg.ymin,self.cg.ymax,self.cg.xmin,self.cg.xmax)
-                        t_pre4 = time.perf_counter()
-                        img_rb_zs  = ctools.arrrebin(img_fr_zs_acc,self.rebin)
-                        t_pre5 = time.perf_counter()
-                            
-                        t_pedsub = t_pre1 - t_pre0
-                        t_saturation = t_pre2 - t_pre1
-                        t_zerosup = t_pre3 - t_pre2
-                        t_xycut = t_pre4 - t_pre3
-                        t_rebin = t_pre5 - t_pre4
-                            
-                        # Cluster reconstruction on 2D picture
-                        algo = 'DBSCAN'
                         if self.options.rawdata_tier == 'midas':
                             name = name + '_run' + str(run)+ '_' + str(event)
-                        snprod_inputs = {'picture': img_rb_zs, 'pictureHD': img_fr_satcor, 'picturezsHD': img_fr_zs, 'pictureOri': img_fr, 'vignette': self.vignmap, 'name': name, 'algo': algo}
-                        plotpy = self.options.jobs < 2 # for some reason on macOS this crashes in multicore
-                        snprod_params = {'snake_qual': 3, 'plot2D': False, 'plotpy': False, 'plotprofiles': False}
-                        t_DBSCAN_0 = time.perf_counter()
-                        snprod = SnakesProducer(snprod_inputs,snprod_params,self.options,self.cg)
-                        t_DBSCAN_1 = time.perf_counter()
-                        snakes, t_DBSCAN, t_variables, lp_len, t_medianfilter, t_noisered = snprod.run()
-                        t_DBSCAN_2 = time.perf_counter()
-                        if self.options.debug_mode == 1:
-                            print(f"1. DBSCAN run + variables calculation in {t_DBSCAN_2 - t_DBSCAN_1:0.4f} seconds")
-                        self.autotree.fillCameraVariables(img_fr_zs)
-                        t_DBSCAN_3 = time.perf_counter()
-                        if self.options.debug_mode == 1:
-                            print(f"fillCameraVariables in {t_DBSCAN_3 - t_DBSCAN_2:0.4f} seconds")
-                        self.autotree.fillClusterVariables(snakes,'sc')
-                        t_DBSCAN_4 = time.perf_counter()
-                        self.autotree.fillTimeCameraVariables(t_variables, t_DBSCAN, lp_len, t_pedsub, t_saturation, t_zerosup, t_xycut, t_rebin, t_medianfilter, t_noisered)
-                        if self.options.debug_mode == 1:
-                            print(f"fillClusterVariables in {t_DBSCAN_4 - t_DBSCAN_3:0.04f} seconds")
-                            print()
-                        del img_fr_sub,img_fr_satcor,img_fr_zs,img_fr_zs_acc,img_rb_zs
-                        self.outTree.fill()
+                        # the frame is decoded once, and reconstructed with the parameters of each scan point
+                        if self.framePool:
+                            # the h5 frames are views of the buffers of the reader, reused by the next frames
+                            if self.options.rawdata_tier == 'h5': img_fr = img_fr.copy()
+                            self.submitFrame(run,event,name,img_fr,ctools,mcTruth.get(event))
+                        else:
+                            shared = {}
+                            for point in self.scanPoints:
+                                self.reconstructFrame(point,run,event,name,img_fr,ctools,shared,mcTruth.get(event))
+                            del shared
+                        instr.count('events')
                         del img_fr
                         
          
@@ -688,6 +1150,7 @@ class analysis:
                                     self.autotree_pmt.fillPMTVariables(fast_waveform) 
                                     self.autotree_pmt.fillTimePMTVariables(t_waveforms)
                                     self.outTree_pmt.fill()
+                                    instr.count('pmt_waveforms')
 
                                     # Weighted averaged waveform (weight = SNR)
                                     snr_ratio = fast_waveform.getSignalToNoise()
@@ -728,7 +1191,7 @@ class analysis:
                                 
                                 # GEM readout. Only available for fast digitizer
                                 # No computing time properties for GEM for now.
-                                if options.include_gem:
+                                if self.options.include_gem:
                                     for ichf_gem,chf_gem in enumerate(self.options.board_gem_channels):
 
                                         indx = trg * nChannels_f + chf_gem
@@ -775,6 +1238,7 @@ class analysis:
                                     self.autotree_pmt.fillPMTVariables(slow_waveform) 
                                     self.autotree_pmt.fillTimePMTVariables(t_waveforms)
                                     self.outTree_pmt.fill()
+                                    instr.count('pmt_waveforms')
 
                                     snr_ratio = slow_waveform.getSignalToNoise()
                                     slow_wf_weights_snr[ichs] = snr_ratio
@@ -816,6 +1280,7 @@ class analysis:
                         del header
                         
                         t01_wave =  time.perf_counter()
+                        instr.add('pmt', t01_wave - t00_wave)
                         if self.options.debug_mode == 1:
                             print(f'PMT Reco Code Took: {t01_wave - t00_wave} seconds')
                         # END of `if pmt`
@@ -825,29 +1290,9 @@ class analysis:
              
         ROOT.gErrorIgnoreLevel = savErrorLevel
                 
-if __name__ == '__main__':
-    from optparse import OptionParser
-    t0 = time.perf_counter()
-    parser = OptionParser(usage='%prog h5file1,...,h5fileN [opts] ')
-    parser.add_option('-r', '--run', dest='run', default='00000', type='string', help='run number with 5 characteres')
-    parser.add_option('-j', '--jobs', dest='jobs', default=1, type='int', help='Jobs to be run in parallel (-1 uses all the cores available)')
-    parser.add_option(      '--max-entries', dest='maxEntries', default=-1, type='int', help='Process only the first n entries')
-    parser.add_option(      '--first-event', dest='firstEvent', default=-1, type='int', help='Skip all the events before this one')
-    parser.add_option(      '--pdir', dest='plotDir', default='./', type='string', help='Directory where to put the plots')
-    parser.add_option('-t',  '--tmp',  dest='tmpdir', default=None, type='string', help='Directory where to put the input file. If none is given, /tmp/<user> is used')
-    parser.add_option(      '--max-hours', dest='maxHours', default=-1, type='float', help='Kill a subprocess if hanging for more than given number of hours.')
-    parser.add_option('-o', '--outname', dest='outname', default='reco', type='string', help='prefix for the output file name')
-    parser.add_option('-d', '--outdir', dest='outdir', default='.', type='string', help='Directory where to save the output file')
-    parser.add_option(      '--git', dest='githash', default=None, type='string', help='git hash of the version of the reco code in use which you may want to give manually')
-        
-    (options, args) = parser.parse_args()
-    
-    f = open(args[0], "r")
-    params = eval(f.read())
-
-    for k,v in params.items():
-        setattr(options,k,v)
-
+def reconstructRun(options,args,executor=None):
+    # reconstruction of the run options.run: input file, pedestals, event loop over the chunks, merging.
+    # If an executor is given (multi-run driver) its warm worker processes are used for the chunks
     run = int(options.run)
     
     if options.debug_mode == 1:
@@ -856,6 +1301,10 @@ if __name__ == '__main__':
         #if options.daq == 'midas': options.ev +=0.5 
     else:
         setattr(options,'outFile','%s_run%05d_%s.root' % (options.outname, run, options.tip))
+    if options.output_backend == 'parquet' and 0 < options.checkpointEvery < options.output_rowgroup:
+        # each checkpoint closes the parquet files: not more often than one row group
+        print("WARNING: --checkpoint-every {c} rounded up to output_rowgroup = {r}".format(c=options.checkpointEvery,r=options.output_rowgroup))
+        options.checkpointEvery = options.output_rowgroup
     # FIX: if only pmt mode, don't need to compute pedestal
     if options.camera_mode:
         utilities.setPedestalRun(options)        
@@ -874,7 +1323,18 @@ if __name__ == '__main__':
     tmpdir = '/tmp'
     os.system('mkdir -p {tmpdir}/{user}'.format(tmpdir=tmpdir,user=USER))
     tmpdir = '{tmpdir}/{user}/'.format(tmpdir=tmpdir,user=USER) if not options.tmpdir else options.tmpdir+"/"
-    if sw.checkfiletmp(int(options.run),options.rawdata_tier,tmpdir):
+    options.rawcache = (options.cacheDir, options.cacheBudget*1e9 if options.cacheBudget>0 else None) if options.cacheDir else None
+    framesDir = options.framesDir if options.framesDir else tmpdir
+    if options.rawdata_tier == 'framestore':
+        options.tmpname = frameStoreName(options.run,framesDir)
+        if not os.path.isfile(options.tmpname):
+            raise RuntimeError("Frame store {f} not found: write it first with --write-frames".format(f=options.tmpname))
+        if options.pmt_mode or options.environment_variables:
+            print("WARNING: the frame store has only the camera frames: PMT and environment variables will not be reconstructed")
+            options.pmt_mode = 0; options.include_gem = 0; options.environment_variables = False
+    elif options.rawcache and options.rawdata_tier == 'root':
+        options.tmpname = sw.raw_file_cache(*options.rawcache).fetch(sw.swift_root_file(options.tag, int(options.run)))
+    elif sw.checkfiletmp(int(options.run),options.rawdata_tier,tmpdir):
         if options.rawdata_tier=='root':
             prefix = 'histograms_Run'
             postfix = 'root'
@@ -896,12 +1356,17 @@ if __name__ == '__main__':
     if options.rawdata_tier == 'midas':
         ## need to open it (and create the midas object) in the function, otherwise the async run when multithreaded will confuse events in the two threads
         options.tmpname = [int(options.run),tmpdir,options.tag]		#This line needs to be corrected if MC data will be in midas format. Not foreseen at all
-    if options.justPedestal:
+    if options.justPedestal or options.writeFrames:
         ana = analysis(options)
-        print("Pedestals done. Exiting.")
-        if options.donotremove == False:
+        if options.writeFrames:
+            ana.writeFrames(frameStoreName(options.run,framesDir))
+        else:
+            print("Pedestals done. Exiting.")
+        if options.rawcache:
+            sw.raw_file_cache(*options.rawcache).report()
+        elif options.donotremove == False and options.rawdata_tier != 'framestore':
             sw.swift_rm_root_file(options.tmpname)
-        sys.exit(0)
+        return
 
     ana = analysis(options)
     nev = ana.getNEvents(options)
@@ -918,6 +1383,12 @@ if __name__ == '__main__':
         nThreads = multiprocessing.cpu_count()
     else:
         nThreads = options.jobs
+    frameThreads = 1
+    if getattr(options,'executor','process') == 'thread' and nThreads>1 and options.camera_mode:
+        # a single process: the frames are reconstructed by nThreads threads sharing the maps and the output file
+        print ("RUNNING USING ",nThreads," THREADS IN ONE PROCESS.")
+        frameThreads,nThreads = nThreads,1
+    options.frameThreads = ana.options.frameThreads = frameThreads
 
     t1 = time.perf_counter()
     firstEvent = 0 if options.firstEvent<0 else options.firstEvent
@@ -933,47 +1404,195 @@ if __name__ == '__main__':
         if len(chunks)>nThreads:
             chunks[-2] = (chunks[-2][0],chunks[-2][1],chunks[-1][2])
             del chunks[-1]
-        print("Chunks = ",chunks)
-        with futures.ProcessPoolExecutor(nThreads) as executor:
-            futures_list = [executor.submit(ana,c) for c in chunks]
+    else:
+        chunks = [(-1,firstEvent,lastEvent)]
+    if options.resume:
+        chunks = pendingChunks(options,chunks)
+    print("Chunks = ",chunks)
+    # the chunks are merged at the end (ROOT only), also when resuming a job without chunks
+    merge = options.output_backend != 'parquet' and (nThreads>1 or any([c[0]!=-1 for c in chunks]) or (options.resume and os.path.isfile(chunkOutput(options,0)[0])))
+    summaries = []
+    if nThreads>1:
+        pool = executor if executor else workerPool(nThreads,options)
+        try:
+            futures_list = [pool.submit(ana,c) for c in chunks]
             for future in futures.as_completed(futures_list):
                 # retrieve the result. This is crucial, because result() does not exit until the process is completed.
-                future.result()
+                summaries.append(future.result())
+        finally:
+            if not executor: pool.shutdown()
+    else:
+        summaries = [ana(c) for c in chunks]
+    if options.output_backend == 'parquet':
+        if nThreads>1: print("Chunks written as parts of the dataset {outdir}/{base}.parquet".format(base=base, outdir=options.outdir))
+        os.system('rm -f {outdir}/{base}.parquet/*.journal'.format(base=base, outdir=options.outdir))
+    elif merge:
         print("Now hadding the chunks...")
         if flag_env == 0:
             os.system('hadd -k -f {outdir}/{base}.root {outdir}/{base}_chunk*.root'.format(base=base, outdir=options.outdir))
         else:
             os.system('/usr/bin/hadd -k -f {outdir}/{base}.root {outdir}/{base}_chunk*.root'.format(base=base, outdir=options.outdir))
-        os.system('rm {outdir}/{base}_chunk*.root'.format(base=base, outdir=options.outdir))
-    else:
-        evrange=(-1,firstEvent,lastEvent)
-        ana(evrange)
+        os.system('rm -f {outdir}/{base}_chunk*.root {outdir}/{base}_chunk*.root.journal'.format(base=base, outdir=options.outdir))
+    # the run is complete, the journals are not needed anymore
+    os.system('rm -f {outdir}/{base}.root.journal'.format(base=base, outdir=options.outdir))
     t2 = time.perf_counter()
+    aborted = sum([n for s in summaries if s for k,n in s['counters'].items() if k.startswith('events_aborted_')])
+    if aborted:
+        print("WARNING: {n} events aborted by the per-event watchdog (event_status != 0 in the output)".format(n=aborted))
+    if options.instrumentation:
+        summary = instr.merge(summaries,run=run,jobs=max(nThreads,frameThreads),executor=getattr(options,'executor','process'))
+        instr.writeJSON(summary,'{outdir}/{base}_instrumentation.json'.format(base=base, outdir=options.outdir))
+        if options.instrumentation_prometheus:
+            instr.writePrometheus(summary,options.instrumentation_prometheus)
+        if options.debug_mode == 1:
+            for name,st in sorted(summary['stages'].items(), key=lambda x: -x[1]['time']):
+                print(f"{name:>16s}: {st['time']:8.3f} s in {st['calls']} calls, RSS delta {st['rss_delta']/1e6:.1f} MB")
     if options.debug_mode == 1:
         print(f'Reconstruction Code Took: {t2 - t1} seconds')
 
     # now add extra information
-    tf = ROOT.TFile.Open("{outdir}/{base}.root".format(base=base, outdir=options.outdir),'update')
-    # now add parameters of the reconstruction
-    utilities.Param_storage(tf,base,args[0],options)
-    # now add the git commit hash to track the version in the ROOT file
-    if options.githash != None:
-       githash=ROOT.TNamed("gitHash",options.githash)
-       githash.Write()       
+    if options.githash == None:
+        try:
+            options.githash = str(utilities.get_git_revision_hash()).replace("\\n'","").replace("b'","")
+        except:
+            print('No githash provided nor githash found (no .git folder?)') 
+    if options.output_backend == 'parquet':
+        # the parameters go in the text file, the git hash, the time and the numerical parameters in a small json inside the dataset
+        recoparams = utilities.Param_storage(None,base,args[0],options)
+        utilities.Param_storage_columnar("{outdir}/{base}.parquet".format(base=base, outdir=options.outdir),options,t2-t1,recoparams)
+        if options.scan:
+            with open("{outdir}/{base}.parquet/scan.json".format(base=base, outdir=options.outdir),'w') as fscan:
+                json.dump(loadParams(options.scan),fscan,indent=1)
     else:
-       try:
-          githash = ROOT.TNamed("gitHash",str(utilities.get_git_revision_hash()).replace("\\n'","").replace("b'",""))
-          githash.Write()
-       except:
-          print('No githash provided nor githash found (no .git folder?)') 
-    # now add the time of reconstruction
-    total_time = ROOT.TNamed("total_time", str(t2-t1))
-    total_time.Write()
-    tf.Close()
+        tf = ROOT.TFile.Open("{outdir}/{base}.root".format(base=base, outdir=options.outdir),'update')
+        # now add parameters of the reconstruction
+        utilities.Param_storage(tf,base,args[0],options)
+        # now add the git commit hash to track the version in the ROOT file
+        if options.githash != None:
+           githash=ROOT.TNamed("gitHash",options.githash)
+           githash.Write()       
+        # now add the time of reconstruction
+        total_time = ROOT.TNamed("total_time", str(t2-t1))
+        total_time.Write()
+        # the overrides of each scan point, tree Events_scan<k> <-> element k
+        if options.scan:
+            scan = ROOT.TNamed("scan", json.dumps(loadParams(options.scan)))
+            scan.Write()
+        tf.Close()
     
-    if options.donotremove == False:
+    if options.rawcache:
+        # files in the cache are removed only by the LRU eviction
+        sw.raw_file_cache(*options.rawcache).report()
+    elif options.donotremove == False and options.rawdata_tier != 'framestore':
         sw.swift_rm_root_file(options.tmpname)
     
+    return t2-t1
+
+if __name__ == '__main__':
+    from optparse import OptionParser
+    t0 = time.perf_counter()
+    parser = OptionParser(usage='%prog h5file1,...,h5fileN [opts] ')
+    parser.add_option('-r', '--run', dest='run', default='00000', type='string', help='run number with 5 characteres')
+    parser.add_option(      '--run-list', dest='runList', default=None, type='string', help='reconstruct several runs in sequence in the same process: comma-separated runs or ranges (e.g. 100,102-105), optionally with their own configuration file (e.g. 106:configFile_LNF_test.txt), or a text file with one entry per line. The raw files of the next runs are downloaded in background into the raw file cache')
+    parser.add_option(      '--prefetch', dest='prefetch', default=2, type='int', help='with --run-list: number of runs downloaded in advance (bounded also by --cache-budget)')
+    parser.add_option('-j', '--jobs', dest='jobs', default=1, type='int', help='Jobs to be run in parallel (-1 uses all the cores available)')
+    parser.add_option(      '--executor', dest='executor', default='process', type='choice', choices=['process','thread'], help='with --jobs: process = one process per chunk of events, merged at the end; thread = one process, the frames reconstructed by a pool of threads sharing the calibration maps and the output file')
+    parser.add_option(      '--start-method', dest='start_method', default='forkserver', type='choice', choices=['forkserver','fork','spawn'], help='start method of the worker processes: forkserver = forked from a server with the common modules already imported')
+    parser.add_option(      '--max-entries', dest='maxEntries', default=-1, type='int', help='Process only the first n entries')
+    parser.add_option(      '--first-event', dest='firstEvent', default=-1, type='int', help='Skip all the events before this one')
+    parser.add_option(      '--pdir', dest='plotDir', default='./', type='string', help='Directory where to put the plots')
+    parser.add_option('-t',  '--tmp',  dest='tmpdir', default=None, type='string', help='Directory where to put the input file. If none is given, /tmp/<user> is used')
+    parser.add_option(      '--max-hours', dest='maxHours', default=-1, type='float', help='Kill a subprocess if hanging for more than given number of hours.')
+    parser.add_option(      '--checkpoint-every', dest='checkpointEvery', default=0, type='int', help='every N events each worker makes its output persistent and records the progress in a journal (<output file>.journal), so that a killed job can be continued with --resume. 0 = no checkpoints')
+    parser.add_option(      '--resume', dest='resume', action='store_true', default=False, help='continue a killed job from the journals of its chunks: only the missing event ranges are reconstructed, then all the chunks are merged. Use the same --jobs, --first-event and --max-entries of the killed job')
+    parser.add_option('-o', '--outname', dest='outname', default='reco', type='string', help='prefix for the output file name')
+    parser.add_option('-d', '--outdir', dest='outdir', default='.', type='string', help='Directory where to save the output file')
+    parser.add_option(      '--git', dest='githash', default=None, type='string', help='git hash of the version of the reco code in use which you may want to give manually')
+    parser.add_option(      '--cache-dir', dest='cacheDir', default=None, type='string', help='Directory of the raw file cache shared by the jobs on this node (files are locked, downloaded once and evicted LRU). If not given, the old tmp directory logic is used')
+    parser.add_option(      '--cache-budget', dest='cacheBudget', default=-1, type='float', help='Maximum size of the raw file cache in GB (-1 = unlimited)')
+    parser.add_option(      '--scan', dest='scan', default=None, type='string', help='parameter scan: text file with a list of dictionaries, each overriding some options and/or modules_config parameters (e.g. [{\'nsigma\': 1.3}, {\'clustering\': {\'dbscan_eps\': 1.2}}]). Each frame is decoded once and reconstructed for every point, into the trees Events_scan<k>')
+    parser.add_option(      '--write-frames', dest='writeFrames', action='store_true', default=False, help='only decode the camera frames of the run into the frame store (frames_run<run>.h5), to be reprocessed with rawdata_tier = \'framestore\'')
+    parser.add_option(      '--frames-dir', dest='framesDir', default=None, type='string', help='directory of the frame stores (default: the tmp directory)')
+    parser.add_option(      '--frames-block', dest='framesBlock', default=16, type='int', help='with --write-frames: number of frames per compressed block')
+    parser.add_option(      '--frames-compression', dest='framesCompression', default='lzf', type='string', help='with --write-frames: compression of the blocks (lzf, gzip or none)')
+        
+    (options, args) = parser.parse_args()
+    
+    f = open(args[0], "r")
+    params = eval(f.read())
+
+    for k,v in params.items():
+        setattr(options,k,v)
+
+    if options.runList:
+        queue = utilities.parseRunQueue(options.runList,args[0])
+    else:
+        queue = [(int(options.run),args[0])]
+
+    if len(queue) == 1:
+        reconstructRun(options,args)
+    else:
+        # multi-run driver: one process for the whole queue, keeping the imports, the worker pool,
+        # the logbook and the pedestal/vignetting maps warm. The raw files go through the cache,
+        # and the next runs are prefetched
+        import copy,shutil,traceback
+        runs = [r for r,_ in queue]
+        if not options.cacheDir:
+            options.cacheDir = '{tmp}/rawcache'.format(tmp=options.tmpdir if options.tmpdir else '/tmp/'+os.environ.get('USER','autoreco'))
+        cache = sw.raw_file_cache(options.cacheDir, options.cacheBudget*1e9 if options.cacheBudget>0 else None)
+        if options.rawdata_tier == 'root':
+            urls = [(r,sw.swift_root_file(options.tag,r)) for r in runs]
+        elif options.rawdata_tier == 'midas':
+            urls = [(r,sw.swift_midas_file(options.tag,r)) for r in runs]
+        else:
+            urls = []
+            print("WARNING: no prefetching available for rawdata_tier = ",options.rawdata_tier)
+        prefetcher = RunPrefetcher(cache,urls,depth=options.prefetch) if len(urls) else None
+        if options.offline==False and 'MC' not in options.tag:
+            utilities.read_logbook(options.tag,min(runs)-2000,max(runs)+1)
+
+        nThreads = multiprocessing.cpu_count() if options.jobs==-1 else options.jobs
+        executor = workerPool(nThreads,options) if nThreads>1 and getattr(options,'executor','process') == 'process' else None
+        report = []
+        for irun,(run,config) in enumerate(queue):
+            print("\n====> Reconstructing run {r} with {c} ({i}/{n})".format(r=run,c=config,i=irun+1,n=len(queue)))
+            # each run gets its own copy of the options (pedestal run, file names, ... do not leak to the next one)
+            # and writes into a staging directory, moved to the output directory only if the run succeeds
+            runoptions = copy.copy(options)
+            if config != args[0]:
+                for k,v in eval(open(config).read()).items():
+                    setattr(runoptions,k,v)
+            runoptions.run = '%05d' % run
+            runoptions.outdir = '{outdir}/.staging_run{r:05d}'.format(outdir=options.outdir,r=run)
+            os.makedirs(runoptions.outdir,exist_ok=True)
+            t_io, t_reco, status = 0, 0, 'ok'
+            try:
+                t_io = prefetcher.wait(run) if prefetcher else 0
+                t_reco = reconstructRun(runoptions,[config]+args[1:],executor)
+                for f in os.listdir(runoptions.outdir):
+                    target = os.path.join(options.outdir,f)
+                    # the output of a previous reconstruction of the run is replaced (os.replace fails on a non-empty directory, e.g. <base>.parquet)
+                    if os.path.isdir(target) and not os.path.islink(target): shutil.rmtree(target)
+                    os.replace(os.path.join(runoptions.outdir,f),target)
+            except (Exception,SystemExit) as e:
+                # SystemExit: the checks calling sys.exit() fail only this run
+                status = 'FAILED: {e}'.format(e=repr(e))
+                print("ERROR: reconstruction of run {r} failed. Its partial output is removed, going on with the next run".format(r=run))
+                traceback.print_exc()
+                if isinstance(e,futures.process.BrokenProcessPool):
+                    executor = workerPool(nThreads,options)
+            finally:
+                shutil.rmtree(runoptions.outdir,ignore_errors=True)
+                if prefetcher: prefetcher.done(run)
+            report.append((run,t_io,t_reco,status))
+        if prefetcher: prefetcher.stop()
+        if executor: executor.shutdown()
+        print("\nRun      I/O wait (s)   reconstruction (s)   status")
+        for run,t_io,t_reco,status in report:
+            print("{r:05d}   {io:12.1f}   {reco:18.1f}   {st}".format(r=run,io=t_io,reco=t_reco if t_reco else 0,st=status))
+        if any([st != 'ok' for _,_,_,st in report]):
+            sys.exit(1)
+
     t3 = time.perf_counter()
     if options.debug_mode == 1:
-           print(f'Total time the Code Took: {t3 - t0} seconds')
\ No newline at end of file
+           print(f'Total time the Code Took: {t3 - t0} seconds')
@@ -52,6 +52,7 @@ if __name__ == "__main__":
     parser.add_option('-t',   '--tmp',dest='tmpdir', default="/tmp/",  type='string', help='the input directory')
     parser.add_option('-r',   '--resubmit',dest='resubmit', action='store_true', default=False, help='check the existence of the output in the outdir and resubmit the requested run range')
     parser.add_option(        '--pedestals-only',dest='pedOnly', action='store_true', default=False, help='run only on pedestal runs')
+    parser.add_option(        '--checkpoint-every',dest='checkpointEvery', default=100, type='int', help='checkpoint interval (events) of the jobs, so that the resubmitted ones (-r) continue from it. 0 = no checkpoints');
     parser.add_option(        '--runlog', dest='runlog', default=None, type='string', help='if given, check in the runlog that the runs exists before creating the job')
     (options, args) = parser.parse_args()
 
@@ -122,6 +123,9 @@ if __name__ == "__main__":
     # IT SEEMS THAT /mnt/ssdcache is not mounted even in cygno-custom
     #tmpdir_opt = ' --tmp /tmp/'
     maxtime_opt = '' if options.maxHours < 0 else '--max-hours {hr}'.format(hr=options.maxHours)
+    # the jobs always checkpoint: a resubmission (-r) of a killed job continues from its journal instead of restarting
+    if options.checkpointEvery > 0: maxtime_opt += ' --checkpoint-every {n}'.format(n=options.checkpointEvery)
+    if options.resubmit: maxtime_opt += ' --resume'
     commands = []
     maxresub=-1
     for run in runs:
@@ -147,7 +151,7 @@ if __name__ == "__main__":
         if options.resubmit:
             recofile = '%s/reco_run%05d_3D.root' % (absopath,run)
             if os.path.exists(recofile): continue
-            else: print ("Run %d has no good output file. Resubmitting it" %run )
+            else: print ("Run %d has no good output file. Resubmitting it (continuing from its checkpoints, if any)" %run )
         if len(options.eventChunks)>0:
             (totEv,evPerJob) = options.eventChunks
             print ("Preparing jobs for run {r}. The task subdivides a total of {nT} events in chunks of {nJ} events per job.".format(r=run,nT=totEv,nJ=evPerJob))
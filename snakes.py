@@ -16,15 +16,52 @@ from morphsnakes import(morphological_chan_vese,
 
 from clusterTools import Cluster
 from cameraChannel import cameraTools
+from sparseFrame import ScaledFrame
 from cluster.ddbscan_ import DDBSCAN
+from cluster.tiled import TiledDDBSCAN, getPool
+from cluster.supercluster import SuperClusterAlgorithm
 from energyCalibrator import EnergyCalibrator
 from cython_cygno import nred_cython
 import debug_code.tools_lib as tl
+import instrumentation as instr
+
+# Per-cluster features in a pool (cluster_workers > 1): the clusters are independent, so their calibration and
+# profiles are computed concurrently. The largest clusters are submitted first, the small ones are grouped in tasks
+# of at least cluster_batch_pixels pixels; the results are stored by cluster index, so the output does not depend on
+# the scheduling.
+
+def clusterBatches(sizes,minPixels):
+    # lists of cluster indices, one per task, the largest clusters first
+    order = sorted(range(len(sizes)),key=lambda i: (-sizes[i],i))
+    batches = []
+    small = []; npix = 0
+    for i in order:
+        if sizes[i] >= minPixels:
+            batches.append([i])
+            continue
+        small.append(i); npix += sizes[i]
+        if npix >= minPixels:
+            batches.append(small)
+            small = []; npix = 0
+    if small: batches.append(small)
+    return batches
+
+def calibrateClusters(params,debug,hitsList,check=None):
+    # (energy, slice energies, slice centers, path length) of each cluster, with one calibrator per task.
+    # check: called before each cluster (the watchdog check, only in the sequential path)
+    calibrator = EnergyCalibrator(params,debug)
+    ret = []
+    for hits in hitsList:
+        if check: check()
+        calEnergy,slicesCalEnergy,centers = calibrator.calibratedEnergy(hits)
+        ret.append((calEnergy,slicesCalEnergy,centers,calibrator.clusterLength()))
+    return ret
 
 class SnakesFactory:
-    def __init__(self,img,img_fr,img_fr_zs,img_ori,vignette,name,options,geometry):
+    def __init__(self,img,img_fr,img_fr_zs,img_ori,vignette,name,options,geometry,config):
         self.name = name
         self.options = options
+        self.config = config
         self.rebin = options.rebin
         self.geometry = geometry
         self.ct = cameraTools(geometry)
@@ -34,6 +71,13 @@ class SnakesFactory:
         self.image_fr_zs = img_fr_zs
         self.vignette = vignette
         self.contours = []
+        # timings of the steps done so far, also available if the event is aborted by the watchdog
+        self.timings = {'t_medianfilter': -1, 't_noisered': -1, 'lp_len': 0, 't_DBSCAN': -1, 't_variables': -1}
+        self.watchdog = None
+
+    def check(self):
+        # boundary of a step: the event is aborted here if over its budget (see watchdog.py)
+        if self.watchdog: self.watchdog.check()
         
     def getClusters(self,plot=False):
 
@@ -63,27 +107,43 @@ class SnakesFactory:
         rescaley=int(self.geometry.npixy/self.rebin)
 
         t0 = time.perf_counter()
-        filtimage = median_filter(self.image_fr_zs, size=2)
+        sparse = hasattr(self.image_fr_zs,'medianFilter')
+        with instr.stage('median_filter'):
+            if sparse:
+                filtimage = self.image_fr_zs.medianFilter()
+            else:
+                filtimage = median_filter(self.image_fr_zs, size=2)
         t1_med = time.perf_counter()
-        edges = self.ct.arrrebin(filtimage,self.rebin)
+        self.check()
+        edges = filtimage.rebin(self.rebin) if sparse else self.ct.arrrebin(filtimage,self.rebin)
         edcopy = edges.copy()
         t0_noise = time.perf_counter()
-        edcopyTight = nred_cython(edcopy, rescalex, rescaley, self.options.min_neighbors_average)
+        with instr.stage('noise_reduction'):
+            edcopyTight = nred_cython(edcopy, rescalex, rescaley, self.options.min_neighbors_average)
         t1_noise = time.perf_counter()
+        self.check()
 
         t_medianfilter = t1_med - t0
         t_noisered = t1_noise - t0_noise
+        self.timings.update(t_medianfilter=t_medianfilter, t_noisered=t_noisered)
 
         
         # make the clustering with DBSCAN algo
         # this kills all macrobins with N photons < 1
         points = np.array(np.nonzero(np.round(edcopyTight))).astype(int).T
         lp = points.shape[0]
+        instr.count('points',lp)
+        self.timings['lp_len'] = lp
 
         ## apply vignetting (if not applied, vignette map is all ones)
         ## this is done only for energy calculation, not for clustering (would make it crazy)
-        image_fr_vignetted = self.ct.vignette_corr(self.image_fr,self.vignette)
-        image_fr_zs_vignetted = self.ct.vignette_corr(self.image_fr_zs,self.vignette)    
+        if sparse:
+            # only the pixels of the clusters are used: the full frame is corrected lazily
+            image_fr_vignetted = ScaledFrame(self.image_fr,self.vignette)
+            image_fr_zs_vignetted = self.image_fr_zs.scaled(self.vignette)
+        else:
+            image_fr_vignetted = self.ct.vignette_corr(self.image_fr,self.vignette)
+            image_fr_zs_vignetted = self.ct.vignette_corr(self.image_fr_zs,self.vignette)
         if tip=='3D':
             sample_weight = np.take(self.image, self.image.shape[0]*points[:,0]+points[:,1]).astype(int)
             sample_weight[sample_weight==0] = 1
@@ -110,8 +170,7 @@ class SnakesFactory:
         if self.options.debug_mode:
             if self.options.flag_dbscan_seeds:
                 #reading params of dbscan seeding
-                filePar = open('modules_config/clustering.txt','r')
-                params = eval(filePar.read())
+                params = self.config.clustering
                 seed_eps = params['dbscan_eps']
                 seed_mpts = params['dbscan_minsamples']
                 seed_metric = params['metric']
@@ -167,13 +226,22 @@ class SnakesFactory:
         # - - - - - - - - - - - - - -
         if self.options.debug_mode: print ("starting DBscan")
         t1 = time.perf_counter()
-        ddb = DDBSCAN('modules_config/clustering.txt').fit(X, sample_weight = sample_weight)
+        params = self.config.clustering
+        with instr.stage('dbscan'):
+            if params.get('tiled_clustering',False):
+                # large/busy frames: the tiles of the frame are clustered in parallel and merged at the seams
+                ddb = TiledDDBSCAN(params,grid=params['tile_grid'],margin=params['tile_margin'],workers=params['tile_workers'],
+                                   executor=params['tile_executor'],validate=params['tile_validate']).fit(X, sample_weight = sample_weight)
+            else:
+                ddb = DDBSCAN(params).fit(X, sample_weight = sample_weight)
 
         if self.options.debug_mode: print(f"basic clustering in {t1 - t0:0.4f} seconds")
         t2 = time.perf_counter()
         if self.options.debug_mode: print(f"ddbscan clustering in {t2 - t1:0.4f} seconds")
 
         t_DBSCAN = t2-t1
+        self.timings['t_DBSCAN'] = t_DBSCAN
+        self.check()
         
         # Black removed and is used for noise instead.
         unique_labels = set(ddb.labels_[:,0])
@@ -181,9 +249,12 @@ class SnakesFactory:
         # Number of polynomial clusters in labels, ignoring noise if present.
         n_superclusters = len(unique_labels) - (1 if -1 in ddb.labels_[:,0] else 0)
 
+        t_build = time.perf_counter(); m_build = instr.rss()
+        basic_clusters = []
         for k in unique_labels:
             if k == -1:
                 break # noise: the unclustered
+            self.check()
 
             class_member_mask = (ddb.labels_[:,0] == k)
             #class_member_mask = (ddb.labels_ == k)
@@ -197,6 +268,19 @@ class SnakesFactory:
                 cl.iteration = 0
                 cl.pearson = 999#p_value
                 superclusters.append(cl)
+                basic_clusters.append(xy)
+        instr.add('cluster_build', time.perf_counter()-t_build, instr.rss()-m_build)
+
+        # optional second iteration: the basic clusters are the seeds of the superclustering (geodesic active
+        # contour around them), which recovers the low-light pixels. The superclusters replace the basic clusters
+        if params.get('supercluster',False) and len(basic_clusters):
+            with instr.stage('supercluster'):
+                sca = SuperClusterAlgorithm(self.options,self.image.shape,neighbor_window=params['sc_neighbor_window'],config=self.config,
+                                            roi_margin=params['sc_roi_margin'],gac_iterations=params['sc_gac_iterations'],gac_step=params['sc_gac_step'],
+                                            calibrate=False) # calibrated with the other clusters in SnakesProducer
+                superclusters,self.contours = sca.findSuperClusters(basic_clusters,self.image,image_fr_vignetted,image_fr_zs_vignetted,1)
+            if self.options.debug_mode: print("superclustering: {n} superclusters from {b} basic clusters".format(n=len(superclusters),b=len(basic_clusters)))
+            self.check()
                 
         t2 = time.perf_counter()
         if self.options.debug_mode: print(f"label basic clusters in {t2 - t1:0.4f} seconds")
@@ -211,7 +295,7 @@ class SnakesFactory:
 
             if self.options.flag_full_image == 1:
                 fig = plt.figure(figsize=(self.options.figsizeX, self.options.figsizeY))
-                plt.imshow(self.image_fr_zs,cmap=self.options.cmapcolor, vmin=vmin, vmax=vmax,origin='upper' )
+                plt.imshow(self.image_fr_zs.toDense() if sparse else self.image_fr_zs,cmap=self.options.cmapcolor, vmin=vmin, vmax=vmax,origin='upper' )
                 plt.title("Original Image")
                 for ext in ['png']:       #,'pdf'
                     plt.savefig('{pdir}/{name}_{esp}.{ext}'.format(pdir=outname,name=self.name,esp='oriIma',ext=ext), bbox_inches='tight', pad_inches=0)
@@ -283,8 +367,11 @@ class SnakesFactory:
         for k,cl in enumerate(clusters):
             cl.plotFullResolution('{pdir}/{name}_cluster{iclu}'.format(pdir=outname,name=self.name,iclu=k))
 
+    @instr.timed('profiles')
     def calcProfiles(self,clusters,plot=False):
+        # sequential: the profiles create ROOT histograms and fits
         for k,cl in enumerate(clusters):
+            self.check()
             profName = '{name}_cluster{iclu}'.format(name=self.name,iclu=k)
             cl.calcProfiles(name=profName,plot=plot)
                              
@@ -302,7 +389,7 @@ class SnakesFactory:
                         canv.SaveAs('{pdir}/{name}profile.{ext}'.format(pdir=outname,name=profName,ext=ext))
 
 class SnakesProducer:
-    def __init__(self,sources,params,options,geometry):
+    def __init__(self,sources,params,options,geometry,config):
         self.picture     = sources['picture']     if 'picture' in sources else None
         self.pictureHD   = sources['pictureHD']   if 'pictureHD' in sources else None
         self.picturezsHD = sources['picturezsHD'] if 'picturezsHD' in sources else None
@@ -315,12 +402,12 @@ class SnakesProducer:
         self.plot2D            = params['plot2D']       if 'plot2D' in params else False
         self.plotpy            = params['plotpy']       if 'plotpy' in params else False
         self.plotprofiles      = params['plotprofiles'] if 'plotprofiles' in params else False
+        self.watchdog          = params['watchdog']     if 'watchdog' in params else None
 
         self.options = options
         self.geometry = geometry
-        geometryPSet   = open('modules_config/geometry_{det}.txt'.format(det=options.geometry),'r')
-        geometryParams = eval(geometryPSet.read())
-        
+        self.config = config
+        self.timings = {}
         
     def run(self):
         ret = []
@@ -330,30 +417,47 @@ class SnakesProducer:
         t0 = time.perf_counter()
         
         # Cluster reconstruction on 2D picture
-        snfac = SnakesFactory(self.picture,self.pictureHD,self.picturezsHD,self.pictureOri,self.vignette,self.name,self.options,self.geometry)
+        snfac = SnakesFactory(self.picture,self.pictureHD,self.picturezsHD,self.pictureOri,self.vignette,self.name,self.options,self.geometry,self.config)
+        self.timings = snfac.timings
+        snfac.watchdog = self.watchdog
 
         # this plotting is only the pyplot representation.
         # Doesn't work on MacOS with multithreading for some reason... 
         if self.algo=='DBSCAN':
             snakes, lp_len, t_medianfilter, t_noisered, t_DBSCAN = snfac.getClusters(plot=self.plotpy)
+            snfac.check()
+
+            # energy calibration of the clusters in a pool (not with the python plots). It does not use ROOT
+            params = self.config.clustering
+            workers = params.get('cluster_workers',1)
+            pool = None
+            if workers > 1 and len(snakes) > 1 and not self.plotpy and self.options.calibrate_clusters:
+                batches = clusterBatches([cl.size() for cl in snakes],params.get('cluster_batch_pixels',5000))
+                pool = getPool(params.get('cluster_executor','thread'),workers)
+                instr.count('cluster_tasks',len(batches))
 
             # supercluster energy calibration for the saturation effect
-            fileCalPar = open('modules_config/energyCalibrator.txt','r')
-            params = eval(fileCalPar.read())
-            calibrator = EnergyCalibrator(params,self.options.debug_mode)
-            
-            for sclu in snakes:
-                if self.options.calibrate_clusters:
-                    calEnergy,slicesCalEnergy,centers = calibrator.calibratedEnergy(sclu.hits_fr)
+            t_calib = time.perf_counter(); m_calib = instr.rss()
+            calibrations = [(-1,[],[],-1) for sclu in snakes]
+            if self.options.calibrate_clusters:
+                if pool:
+                    jobs = [(batch,pool.submit(calibrateClusters,self.config.energyCalibrator,self.options.debug_mode,[snakes[k].hits_fr for k in batch])) for batch in batches]
+                    for batch,job in jobs:
+                        snfac.check()
+                        for k,result in zip(batch,job.result()):
+                            calibrations[k] = result
                 else:
-                    calEnergy,slicesCalEnergy,centers = -1,[],[]
+                    calibrations = calibrateClusters(self.config.energyCalibrator,self.options.debug_mode,[sclu.hits_fr for sclu in snakes],check=snfac.check)
+            for sclu,(calEnergy,slicesCalEnergy,centers,pathlength) in zip(snakes,calibrations):
                 if self.options.debug_mode:
                     print ( "SUPERCLUSTER BARE INTEGRAL = {integral:.1f}".format(integral=sclu.integral()) )
                 sclu.calibratedEnergy = calEnergy
                 sclu.nslices = len(slicesCalEnergy)
                 sclu.energyprofile = slicesCalEnergy
                 sclu.centers = centers
-                sclu.pathlength = -1 if self.options.calibrate_clusters==False else calibrator.clusterLength()    
+                sclu.pathlength = pathlength
+            instr.add('calibration', time.perf_counter()-t_calib, instr.rss()-m_calib)
+            instr.count('clusters',len(snakes))
             
         else:
             print('\nIt seems that the DBSCAN algorithm is not selected in SnakeProducer. ERROR.\n ANALYSIS FAILED')
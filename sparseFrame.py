@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+
+# Sparse representation of the zero-suppressed full resolution frame: the pixels above threshold as a sorted
+# coordinate list (row-major order) with per-row offsets, as a CSR matrix. After the zero suppression only a
+# small fraction of the sensor is left, so the later steps (acceptance, median filter, rebinning, vignetting,
+# hits of the clusters, camera variables) work on the list of the active pixels instead of the whole sensor.
+# The dense array is rebuilt only when needed (debug plots).
+#
+#    zs = SparseFrame.zeroSuppress(img_sub,noisearr,nsigma)
+#    zs = zs.acceptance(ymin,ymax,xmin,xmax)
+#    img_rb = zs.rebin(rebin)
+#    edges = zs.medianFilter().rebin(rebin)   # = arrrebin(median_filter(dense,size=2),rebin)
+
+import numpy as np
+
+class SparseFrame:
+    def __init__(self,shape,indptr,cols,values):
+        self.shape = tuple(shape)
+        self.indptr = indptr # pixels of the row r: indptr[r]:indptr[r+1]
+        self.cols = cols
+        self.values = values
+
+    @classmethod
+    def fromCoordinates(cls,shape,rows,cols,values):
+        # rows,cols have to be in row-major order
+        indptr = np.zeros(shape[0]+1,dtype=np.int64)
+        np.cumsum(np.bincount(rows,minlength=shape[0]),out=indptr[1:])
+        return cls(shape,indptr,cols,values)
+
+    @classmethod
+    def fromDense(cls,img):
+        rows,cols = np.nonzero(img)
+        return cls.fromCoordinates(img.shape,rows,cols.astype(np.int32),img[rows,cols])
+
+    @classmethod
+    def zeroSuppress(cls,img_sub,noisearr,nsigma=1):
+        # as cameraTools.zsfullres, without the dense zero-suppressed image
+        rows,cols = np.nonzero(img_sub > nsigma * noisearr)
+        return cls.fromCoordinates(img_sub.shape,rows,cols.astype(np.int32),img_sub[rows,cols])
+
+    def __len__(self):
+        return len(self.values)
+
+    def rows(self):
+        return np.repeat(np.arange(self.shape[0],dtype=np.int32),np.diff(self.indptr))
+
+    def select(self,mask):
+        rows = self.rows()[mask]
+        return SparseFrame.fromCoordinates(self.shape,rows,self.cols[mask],self.values[mask])
+
+    def any(self):
+        return bool(np.any(self.values))
+
+    def toDense(self,dtype=None):
+        img = np.zeros(self.shape,dtype=dtype or self.values.dtype)
+        img[self.rows(),self.cols] = self.values
+        return img
+
+    def acceptance(self,rowmin,rowmax,colmin,colmax):
+        # as cameraTools.acceptance (not in place)
+        rows = self.rows()
+        return self.select((rows>=rowmin) & (rows<rowmax) & (self.cols>=colmin) & (self.cols<colmax))
+
+    def scaled(self,weights):
+        # pixel by pixel product with a full resolution map (e.g. the vignetting correction)
+        return SparseFrame(self.shape,self.indptr,self.cols,self.values*weights[self.rows(),self.cols])
+
+    def lookup(self,rows,cols):
+        # values at the given pixels, 0 for the pixels not in the list
+        ncols = self.shape[1]
+        keys = self.rows().astype(np.int64)*ncols + self.cols
+        query = np.asarray(rows,dtype=np.int64)*ncols + np.asarray(cols)
+        pos = np.minimum(np.searchsorted(keys,query),max(len(keys)-1,0))
+        found = (keys[pos] == query) if len(keys) else np.zeros(len(query),dtype=bool)
+        return np.where(found,self.values[pos] if len(keys) else 0,0)
+
+    def rebin(self,rebin):
+        # dense rebinned image (mean of the rebin x rebin macro-pixels), as cameraTools.arrrebin
+        ny,nx = self.shape[0]//rebin,self.shape[1]//rebin
+        macro = (self.rows()//rebin)*nx + self.cols//rebin
+        img = np.bincount(macro,weights=self.values,minlength=ny*nx)
+        return img.reshape(ny,nx)/(rebin*rebin)
+
+    def medianFilter(self):
+        # as scipy.ndimage.median_filter(dense,size=2): the 3rd smallest value of the 2x2 window [r-1:r+1,c-1:c+1]
+        # (reflected at the borders, i.e. the row/column -1 is the row/column 0). With one non-zero value at most
+        # in the window the result is 0, so only the windows containing some pixel of the list are computed: each
+        # pixel is scattered into its slot of the (up to 4) windows containing it
+        ny,nx = self.shape
+        rows,cols = self.rows().astype(np.int64),self.cols.astype(np.int64)
+        keys,slots,values = [],[],[]
+        for slot,(dr,dc) in enumerate(((0,0),(0,1),(1,0),(1,1))):
+            # window (r,c) has in this slot the pixel (max(r-dr,0),max(c-dc,0))
+            outr = [(rows+dr,np.ones(len(rows),dtype=bool))] + ([(rows*0,rows==0)] if dr else [])
+            outc = [(cols+dc,np.ones(len(cols),dtype=bool))] + ([(cols*0,cols==0)] if dc else [])
+            for r,rsel in outr:
+                for c,csel in outc:
+                    sel = rsel & csel & (r < ny) & (c < nx)
+                    keys.append(r[sel]*nx + c[sel])
+                    slots.append(np.full(np.count_nonzero(sel),slot,dtype=np.int8))
+                    values.append(self.values[sel])
+        # the keys are a few sorted runs: the stable (merge) sort is much faster than the default one
+        keys = np.concatenate(keys)
+        order = np.argsort(keys,kind='stable')
+        skeys = keys[order]
+        first = np.empty(len(skeys),dtype=bool)
+        first[:1] = True
+        np.not_equal(skeys[1:],skeys[:-1],out=first[1:])
+        cand = skeys[first]
+        inverse = np.empty(len(keys),dtype=np.int64)
+        inverse[order] = np.cumsum(first)-1
+        a,b,c,d = window = np.zeros((4,len(cand)),dtype=self.values.dtype)
+        window[np.concatenate(slots),inverse] = np.concatenate(values)
+        # 3rd smallest of 4 = max(min(max(a,b),max(c,d)),max(min(a,b),min(c,d)))
+        med = np.maximum(np.minimum(np.maximum(a,b),np.maximum(c,d)),np.maximum(np.minimum(a,b),np.minimum(c,d)))
+        keep = med != 0
+        return SparseFrame.fromCoordinates(self.shape,cand[keep]//nx,(cand[keep]%nx).astype(np.int32),med[keep])
+
+    def stats(self):
+        # sum, mean and rms of the whole frame (zeros included), as np.sum/np.mean/np.std of the dense one
+        npix = self.shape[0]*self.shape[1]
+        integral = np.sum(self.values)
+        mean = integral/npix
+        return integral,mean,np.sqrt(max(np.sum(self.values**2)/npix - mean**2,0.))
+
+class ScaledFrame:
+    def __init__(self,img,weights):
+        # lazy pixel by pixel product of a dense frame with a map, e.g. the vignetting correction of the full
+        # frame, where only the pixels of the clusters are used
+        self.img = img
+        self.weights = weights
+        self.shape = img.shape
+
+    def __getitem__(self,index):
+        return self.img[index]*self.weights[index]
+
+    def any(self):
+        return self.img.any()
+
+    def toDense(self):
+        return np.multiply(self.img,self.weights)
@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+
+import numpy as np
+import instrumentation as instr
+
+# Compact storage of the supercluster pixels (scfullinfo):
+# all the pixels of the selected superclusters of one event are stored in three flat arrays
+#    redpix_ix, redpix_iy : uint16 coordinates (int16 if delta-encoded)
+#    redpix_iz            : int16 charge = round(counts*charge_scale) (saturates at +/-32767: with the default
+#                           scale of 5 up to 6553.4 counts, above cimax; the saturated pixels are counted)
+# and sc_redpixIdx gives the index of the first pixel of each supercluster (-1 if not saved).
+# With delta encoding the pixels of each cluster are sorted by (y,x), the first one has absolute
+# coordinates, the following ones store the difference wrt the previous one.
+
+_INT16_MAX = np.iinfo(np.int16).max
+
+class SparsePixelWriter:
+    def __init__(self,tree,eventContent):
+        self.outTree = tree
+        self.selection = eventContent["scpixels_sel"]
+        self.compact = eventContent.get("redpix_compact",False)
+        self.delta = eventContent.get("redpix_delta",False) and self.compact
+        self.scale = float(eventContent.get("redpix_charge_scale",5))
+        # the saturated charges are warned once per job, then only counted (redpix_clipped). A dict, shared with the
+        # copies of the writer filling the trees of the threaded event loop (treeVars.AutoFillTreeProducer.withTree)
+        self.warned = {'clipped': False}
+
+    def createBranches(self,name='sc',sizeStr='nSc'):
+        self.outTree.branch('{name}_redpixIdx'.format(name=name),   'F',  lenVar=sizeStr, title="index of the first pixel in the reduced pixel (redpix) collection belonging to the cluster")
+        if not self.compact:
+            self.outTree.branch('redpix_ix',        'I', lenVar='nRedpix', title="x coordinate of the pixel")
+            self.outTree.branch('redpix_iy',        'I', lenVar='nRedpix', title="y coordinate of the pixel")
+            self.outTree.branch('redpix_iz',        'F', lenVar='nRedpix', title="number of counts of the pixel (after pedestal subtraction)")
+        else:
+            ctype = 'S' if self.delta else 's'
+            cdesc = " (delta-encoded within the cluster)" if self.delta else ""
+            self.outTree.branch('redpix_ix',        ctype, lenVar='nRedpix', title="x coordinate of the pixel"+cdesc)
+            self.outTree.branch('redpix_iy',        ctype, lenVar='nRedpix', title="y coordinate of the pixel"+cdesc)
+            self.outTree.branch('redpix_iz',        'S', lenVar='nRedpix', title="number of counts of the pixel (after pedestal subtraction) times {s:g}".format(s=self.scale))
+
+    def clusterPixels(self,cl):
+        # contiguous views on the full resolution hits of the cluster (set by Cluster with fullinfo=True)
+        ix = np.rint(cl.xallpixelcoord[:cl.nallintpixels])
+        iy = np.rint(cl.yallpixelcoord[:cl.nallintpixels])
+        iz = cl.zallpixel[:cl.nallintpixels]
+        if self.delta:
+            order = np.lexsort((ix,iy))
+            ix = ix[order]; iy = iy[order]; iz = iz[order]
+            ix = np.diff(ix,prepend=0); iy = np.diff(iy,prepend=0)
+        return ix,iy,iz
+
+    def fill(self,clusters,name='sc'):
+        redPixIdxs = []
+        ixs = []; iys = []; izs = []
+        npix = 0
+        for cl in clusters:
+            if cl.shapes['long_width'] < float(self.selection["max_len"]) and cl.integral() > float(self.selection["min_integral"]):
+                redPixIdxs.append(npix)
+                ix,iy,iz = self.clusterPixels(cl)
+                ixs.append(ix); iys.append(iy); izs.append(iz)
+                npix += len(ix)
+            else:
+                redPixIdxs.append(-1)
+        if npix:
+            ix = np.concatenate(ixs); iy = np.concatenate(iys); iz = np.concatenate(izs)
+        else:
+            ix = iy = iz = np.zeros(0)
+        if self.compact:
+            ctype = np.int16 if self.delta else np.uint16
+            ix = ix.astype(ctype); iy = iy.astype(ctype)
+            iz = np.rint(iz*self.scale)
+            clipped = np.count_nonzero(np.abs(iz) > _INT16_MAX)
+            if clipped:
+                instr.count('redpix_clipped',clipped)
+                if not self.warned['clipped']:
+                    print("WARNING: {n} redpix charges above the int16 range (redpix_charge_scale = {s:g}), saturated. Not warned again in this job: the saturated pixels are counted in the instrumentation (redpix_clipped)".format(n=clipped,s=self.scale))
+                    self.warned['clipped'] = True
+            iz = np.clip(iz,-_INT16_MAX,_INT16_MAX).astype(np.int16)
+        else:
+            ix = ix.astype(np.int32); iy = iy.astype(np.int32)
+            iz = np.rint(iz*10)/10.
+        self.outTree.fillBranch('redpix_ix', ix)
+        self.outTree.fillBranch('redpix_iy', iy)
+        self.outTree.fillBranch('redpix_iz', iz)
+        self.outTree.fillBranch('{name}_redpixIdx'.format(name=name),   redPixIdxs)
+
+
+def clusterPixels(redpix_ix,redpix_iy,redpix_iz,redpixIdx,delta=False,scale=5):
+    # reader helper: from the redpix branches of one event returns, for each supercluster,
+    # the arrays (x,y,counts) of its pixels, or None if the pixels were not saved
+    ix = np.asarray(redpix_ix); iy = np.asarray(redpix_iy); iz = np.asarray(redpix_iz)
+    idx = np.asarray(redpixIdx).astype(int)
+    starts = np.sort(idx[idx>=0])
+    ends = dict(zip(starts,np.append(starts[1:],len(ix))))
+    ret = []
+    for i in idx:
+        if i<0:
+            ret.append(None)
+            continue
+        x = ix[i:ends[i]].astype(int); y = iy[i:ends[i]].astype(int); z = iz[i:ends[i]]
+        if delta:
+            x = np.cumsum(x); y = np.cumsum(y)
+        if np.issubdtype(z.dtype,np.integer):
+            z = z/float(scale)
+        ret.append((x,y,z))
+    return ret
+
+def clusterImages(redpix_ix,redpix_iy,redpix_iz,redpixIdx,delta=False,scale=5):
+    # as clusterPixels, but returns for each supercluster (xmin,ymin,image) where image is the
+    # 2D array (rows = y, columns = x) of the bounding box of the cluster
+    ret = []
+    for pix in clusterPixels(redpix_ix,redpix_iy,redpix_iz,redpixIdx,delta,scale):
+        if pix is None:
+            ret.append(None)
+            continue
+        x,y,z = pix
+        xmin,ymin = x.min(),y.min()
+        img = np.zeros((y.max()-ymin+1,x.max()-xmin+1))
+        img[y-ymin,x-xmin] = z
+        ret.append((xmin,ymin,img))
+    return ret
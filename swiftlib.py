@@ -1,12 +1,12 @@
 #!/usr/bin/env python
 import uproot
-import midas.file_reader
-import h5py
-import cygno as cy
 import os
+# midas, h5py and cygno are imported only by the functions of their raw data tier
+
+# the S3 endpoint can be replaced (e.g. by a file:// directory or a local HTTP server for tests)
+BASE_URL = os.environ.get('CYGNO_S3_BASE_URL', "https://s3.cloud.infn.it/v1/AUTH_2ebf769785574195bde2ff418deac08a/")
 
 def swift_root_file(tag, run):    
-    BASE_URL = "https://s3.cloud.infn.it/v1/AUTH_2ebf769785574195bde2ff418deac08a/"
     if 'MC' in tag:
         tag,path=tag.split('$')
         bucket= 'cygno-sim'
@@ -74,6 +74,7 @@ def swift_read_root_file(tmpname):
     return f
 
 def swift_read_h5_file(tmpname):
+    import h5py
     f  = h5py.File(tmpname, 'r')
     return f
 
@@ -110,8 +111,28 @@ def checkfiletmp(run,tier,tmp=None):
        postfix = 'mid.gz'
     return os.path.isfile("%s/%s%05d.%s" % (tmpdir,prefix,run,postfix))
 
-def swift_download_midas_file(run,tmpdir,tag='LNGS'):
+def swift_midas_file(tag, run):
+    if 'MC' in tag:
+        print("WARNING: MC data are not foreseen in MIDAS format")
+    sel = 'LAB' if (tag=='LNF' and run>5000 and run<6633) else tag
+    return BASE_URL+'cygno-data/'+sel+('/run%05d.mid.gz' % run)
+
+# one raw file cache per process and cache directory (it keeps the files in use pinned)
+_caches = {}
+def raw_file_cache(cachedir,budget=None):
+    from rawcache import RawFileCache
+    if cachedir not in _caches:
+        _caches[cachedir] = RawFileCache(cachedir,budget)
+    return _caches[cachedir]
+
+def swift_download_midas_file(run,tmpdir,tag='LNGS',cache=None):
     print("download or open midas file for run ",int(run))
+    if cache:
+        # cache = (cache directory, byte budget)
+        fname = raw_file_cache(*cache).fetch(swift_midas_file(tag,int(run)))
+        import midas.file_reader
+        return midas.file_reader.MidasFile(fname)
+    import cygno as cy
     mfile = cy.open_mid(int(run), path=tmpdir, cloud=True, tag=tag, verbose=True)
     return mfile
     
@@ -1,8 +1,18 @@
+import copy
 import numpy as np
-from waveform import PMTreco
-import ROOT
+from sparsepix import SparsePixelWriter
+from clusterTools import clusterRecords
 
 
+# branch suffix -> field of the cluster shape record (clusterTools.SHAPE_FIELDS)
+CLUSTER_SHAPE_BRANCHES = [('theta','theta'), ('length','long_width'), ('width','lat_width'),
+                          ('longrms','longrms'), ('latrms','latrms'), ('lfullrms','long_fullrms'), ('tfullrms','lat_fullrms'),
+                          ('lp0amplitude','long_p0amplitude'), ('lp0prominence','long_p0prominence'), ('lp0fwhm','long_p0fwhm'),
+                          ('lp0mean','long_p0mean'), ('tp0fwhm','lat_p0fwhm'),
+                          ('xmean','xmean'), ('ymean','ymean'), ('xmax','xmax'), ('xmin','xmin'), ('ymax','ymax'), ('ymin','ymin'),
+                          ('tgaussamp','tgaussamp'), ('tgaussmean','tgaussmean'), ('tgausssigma','tgausssigma'), ('tchi2','tchi2'), ('tstatus','tstatus'),
+                          ('lgaussamp','lgaussamp'), ('lgaussmean','lgaussmean'), ('lgausssigma','lgausssigma'), ('lchi2','lchi2'), ('lstatus','lstatus')]
+
 class AutoFillTreeProducer:
     def __init__(self,tree,eventContent):
         self.outTree = tree
@@ -17,9 +27,7 @@ class AutoFillTreeProducer:
         self.outTree.branch('Mixture_Density', 'F', title="Mixture_Density")
         
 
-    def fillEnvVariables(self, dslow):
-        env_var = open('modules_config/env_variables.txt','r')
-        env_var = eval(env_var.read())
+    def fillEnvVariables(self, dslow, env_var):
         self.outTree.fillBranch('Lime_pressure', dslow[env_var['lime_pressure']])        
         self.outTree.fillBranch('Atm_pressure', dslow[env_var['atm_pressure']])
         self.outTree.fillBranch('Lime_temperature', dslow[env_var['lime_temperature']])
@@ -196,10 +204,8 @@ class AutoFillTreeProducer:
             self.outTree.branch('{name}_energy'.format(name=name),  'F', lenVar=sizeStr, title="calibrated energy of the cluster in keV (LEMON-specific calibration)")
             self.outTree.branch('{name}_pathlength'.format(name=name),    'F', lenVar=sizeStr, title="curved length of the cluster (made with skeletonization)")
             if self.eventContent["scfullinfo"] == True:
-                self.outTree.branch('{name}_redpixIdx'.format(name=name),   'F',  lenVar=sizeStr, title="index of the first pixel in the reduced pixel (redpix) collection belonging to the cluster")
-                self.outTree.branch('redpix_ix',        'I', lenVar='nRedpix', title="x coordinate of the pixel") 
-                self.outTree.branch('redpix_iy',        'I', lenVar='nRedpix', title="y coordinate of the pixel") 
-                self.outTree.branch('redpix_iz',        'F', lenVar='nRedpix', title="number of counts of the pixel (after pedestal subtraction)") 
+                self.redpix = SparsePixelWriter(self.outTree,self.eventContent)
+                self.redpix.createBranches(name,sizeStr)
         self.outTree.branch('{name}_theta'.format(name=name),        'F', lenVar=sizeStr, title="polar angle inclination of the major-axis of the cluster")
         self.outTree.branch('{name}_length'.format(name=name),       'F', lenVar=sizeStr, title="length of the major axis of the cluster")
         self.outTree.branch('{name}_width'.format(name=name),        'F', lenVar=sizeStr, title="length of the minor axis of the cluster")
@@ -230,10 +236,21 @@ class AutoFillTreeProducer:
         self.outTree.branch('{name}_lchi2'.format(name=name),        'F', lenVar=sizeStr, title="chi-squared of the Gaussian fit to the longitudinal profile")
         self.outTree.branch('{name}_lstatus'.format(name=name),      'F', lenVar=sizeStr, title="status of the Gaussian fit to the longitudinal profile")
 
+    def withTree(self,tree):
+        # the same producer filling another tree (e.g. an output.BufferedOutputTree in the threaded event loop)
+        other = copy.copy(self)
+        other.outTree = tree
+        if hasattr(self,'redpix'):
+            other.redpix = copy.copy(self.redpix)
+            other.redpix.outTree = tree
+        return other
+
     def fillCameraVariables(self,pic):
-        self.outTree.fillBranch('cmos_integral',np.sum(pic))
-        self.outTree.fillBranch('cmos_mean',np.mean(pic))
-        self.outTree.fillBranch('cmos_rms',np.std(pic))
+        # pic: the dense zero-suppressed frame, or a sparseFrame.SparseFrame
+        integral,mean,rms = pic.stats() if hasattr(pic,'stats') else (np.sum(pic),np.mean(pic),np.std(pic))
+        self.outTree.fillBranch('cmos_integral',integral)
+        self.outTree.fillBranch('cmos_mean',mean)
+        self.outTree.fillBranch('cmos_rms',rms)
 
     def fillTimeCameraVariables(self, t_variables, t_DBSCAN, lp, t_pedsub, t_saturation, t_zerosup, t_xycut, t_rebin, t_medianfilter, t_noisered):
         self.outTree.fillBranch('t_DBSCAN', t_DBSCAN)
@@ -253,62 +270,17 @@ class AutoFillTreeProducer:
         self.outTree.fillBranch('t_waveforms', t_waveforms)
 
     def fillClusterVariables(self,clusters,name='track'):
-        chars = list(name)
-        start = chars[0]; rest = chars[1:]
-        sizeStr = 'n'+start.upper()+''.join(rest)
-        self.outTree.fillBranch('{name}_size'.format(name=name),     [cl.size() for cl in clusters])
-        self.outTree.fillBranch('{name}_nhits'.format(name=name),    [cl.sizeActive() for cl in clusters])
-        self.outTree.fillBranch('{name}_integral'.format(name=name), [cl.integral() for cl in clusters])
-        self.outTree.fillBranch('{name}_corrintegral'.format(name=name), [cl.corr_integral() for cl in clusters])
-        self.outTree.fillBranch('{name}_rms'.format(name=name),      [cl.rms() for cl in clusters])
+        # the stats and shape records of all the clusters as structured arrays: one array per branch
+        stats = clusterRecords(clusters,'stats')
+        shapes = clusterRecords(clusters,'shapes')
+        for var in ('size','nhits','integral','corrintegral','rms'):
+            self.outTree.fillBranch('{name}_{var}'.format(name=name,var=var), stats[var])
         # filled only for the supercluster
         if name=='sc':
-            self.outTree.fillBranch('{name}_energy'.format(name=name), [cl.calibratedEnergy for cl in clusters])
-            self.outTree.fillBranch('{name}_pathlength'.format(name=name),    [cl.pathlength for cl in clusters])
+            self.outTree.fillBranch('{name}_energy'.format(name=name), np.array([cl.calibratedEnergy for cl in clusters],dtype=float))
+            self.outTree.fillBranch('{name}_pathlength'.format(name=name), np.array([cl.pathlength for cl in clusters],dtype=float))
             if self.eventContent["scfullinfo"] == True:
-                selection = self.eventContent["scpixels_sel"]
-                redPixIdxs = []
-                ix = []; iy = []; iz = []
-                for cl in clusters:
-                    if cl.shapes['long_width'] < float(selection["max_len"]) and cl.integral() > float(selection["min_integral"]):
-                        redPixIdxs.append(len(ix))
-                        ix = ix + [round(cl.xallpixelcoord[i]) for i in range(cl.nallintpixels)]
-                        iy = iy + [round(cl.yallpixelcoord[i]) for i in range(cl.nallintpixels)]
-                        iz = iz + [round(cl.zallpixel[i]*10)/10. for i in range(cl.nallintpixels)]
-                    else:
-                        redPixIdxs.append(-1)
-                self.outTree.fillBranch('redpix_ix', ix)
-                self.outTree.fillBranch('redpix_iy', iy)
-                self.outTree.fillBranch('redpix_iz', iz)
-                self.outTree.fillBranch('{name}_redpixIdx'.format(name=name),   redPixIdxs)
-        self.outTree.fillBranch('{name}_theta'.format(name=name),    [cl.shapes['theta'] for cl in clusters])
-        self.outTree.fillBranch('{name}_length'.format(name=name),   [cl.shapes['long_width'] for cl in clusters])
-        self.outTree.fillBranch('{name}_width'.format(name=name),    [cl.shapes['lat_width'] for cl in clusters])
-        self.outTree.fillBranch('{name}_longrms'.format(name=name),  [cl.shapes['longrms'] for cl in clusters])
-        self.outTree.fillBranch('{name}_latrms'.format(name=name),   [cl.shapes['latrms'] for cl in clusters])
-        self.outTree.fillBranch('{name}_lfullrms'.format(name=name), [cl.shapes['long_fullrms'] for cl in clusters])
-        self.outTree.fillBranch('{name}_tfullrms'.format(name=name), [cl.shapes['lat_fullrms'] for cl in clusters])
-
-        self.outTree.fillBranch('{name}_lp0amplitude'.format(name=name), [cl.shapes['long_p0amplitude'] for cl in clusters])
-        self.outTree.fillBranch('{name}_lp0prominence'.format(name=name), [cl.shapes['long_p0prominence'] for cl in clusters])
-        self.outTree.fillBranch('{name}_lp0fwhm'.format(name=name),   [cl.shapes['long_p0fwhm'] for cl in clusters])
-        self.outTree.fillBranch('{name}_lp0mean'.format(name=name),   [cl.shapes['long_p0mean'] for cl in clusters])
-        self.outTree.fillBranch('{name}_tp0fwhm'.format(name=name),   [cl.shapes['lat_p0fwhm'] for cl in clusters])
-
-        self.outTree.fillBranch('{name}_xmean'.format(name=name),     [cl.shapes['xmean'] for cl in clusters])
-        self.outTree.fillBranch('{name}_ymean'.format(name=name),     [cl.shapes['ymean'] for cl in clusters])
-        self.outTree.fillBranch('{name}_xmax'.format(name=name),      [cl.shapes['xmax'] for cl in clusters])
-        self.outTree.fillBranch('{name}_xmin'.format(name=name),      [cl.shapes['xmin'] for cl in clusters])
-        self.outTree.fillBranch('{name}_ymax'.format(name=name),      [cl.shapes['ymax'] for cl in clusters])
-        self.outTree.fillBranch('{name}_ymin'.format(name=name),      [cl.shapes['ymin'] for cl in clusters])
-        self.outTree.fillBranch('{name}_pearson'.format(name=name),   [cl.getPearson() for cl in clusters])
-        self.outTree.fillBranch('{name}_tgaussamp'.format(name=name),   [cl.shapes['tgaussamp'] for cl in clusters])
-        self.outTree.fillBranch('{name}_tgaussmean'.format(name=name),  [cl.shapes['tgaussmean'] for cl in clusters])
-        self.outTree.fillBranch('{name}_tgausssigma'.format(name=name), [cl.shapes['tgausssigma'] for cl in clusters])
-        self.outTree.fillBranch('{name}_tchi2'.format(name=name),       [cl.shapes['tchi2'] for cl in clusters]) 
-        self.outTree.fillBranch('{name}_tstatus'.format(name=name),     [cl.shapes['tstatus'] for cl in clusters])
-        self.outTree.fillBranch('{name}_lgaussamp'.format(name=name),   [cl.shapes['lgaussamp'] for cl in clusters])
-        self.outTree.fillBranch('{name}_lgaussmean'.format(name=name),  [cl.shapes['lgaussmean'] for cl in clusters])
-        self.outTree.fillBranch('{name}_lgausssigma'.format(name=name), [cl.shapes['lgausssigma'] for cl in clusters])
-        self.outTree.fillBranch('{name}_lchi2'.format(name=name),       [cl.shapes['lchi2'] for cl in clusters]) 
-        self.outTree.fillBranch('{name}_lstatus'.format(name=name),     [cl.shapes['lstatus'] for cl in clusters])
+                self.redpix.fill(clusters,name)
+        for var,field in CLUSTER_SHAPE_BRANCHES:
+            self.outTree.fillBranch('{name}_{var}'.format(name=name,var=var), shapes[field])
+        self.outTree.fillBranch('{name}_pearson'.format(name=name), np.array([cl.getPearson() for cl in clusters],dtype=float))
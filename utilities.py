@@ -5,7 +5,6 @@ import os,sys,optparse,csv,resource
 import numpy as np
 import ROOT,math,uproot
 import swiftlib as sw
-import matplotlib.pyplot as plt            
 from cameraChannel import cameraTools, cameraGeometry
 
 font = {'family': 'arial',
@@ -16,7 +15,20 @@ font = {'family': 'arial',
 
 class utils:
     def __init__(self):
-        pass
+        self._logbooks = {}
+
+    def read_logbook(self,tag,start_run,end_run):
+        # the online logbook is read once per tag and kept, so that consecutive runs reconstructed
+        # by the same process do not query it again (it is re-read only if a run outside the range is asked)
+        import cygno as cy
+        cached = self._logbooks.get(tag)
+        if cached is None or start_run < cached[0] or end_run > cached[1]:
+            first = min(start_run,cached[0]) if cached else start_run
+            last = max(end_run,cached[1]) if cached else end_run
+            cached = (first,last,cy.read_cygno_logbook(tag=tag,start_run=first,end_run=last))
+            self._logbooks[tag] = cached
+        df = cached[2]
+        return df[(df.run_number >= start_run) & (df.run_number <= end_run)]
 
     def dynamicProfileBins(self,hits,coord='x',relError=0.1):
         minPixels = max(1,1/relError/relError)
@@ -275,6 +287,7 @@ class utils:
     def plotVignetteMap(self,filein,name='summap_lime'):
         tf = uproot.open(filein)
         vignette = np.rot90(tf[name].values())
+        import matplotlib.pyplot as plt
         fig = plt.figure(figsize=(12,12))
         plt.imshow(vignette,cmap='binary',origin='upper',vmin=350,vmax=800 )
         plt.xlabel('x (pixels)', font, labelpad=20)
@@ -313,7 +326,7 @@ class utils:
         if not hasattr(options,"pedrun"):
             run = int(options.run)
             if options.offline==False:
-               df = cy.read_cygno_logbook(tag=options.tag,start_run=run-2000,end_run=run+1)
+               df = self.read_logbook(options.tag,run-2000,run+1)
             else:
                runlog='runlog_%s_auto.csv' % (options.tag)
                df = pd.read_csv('pedestals/%s'%runlog)
@@ -352,9 +365,42 @@ class utils:
            setattr(options,'pedfile_fullres_name', 'pedestals/pedmap_run%s_rebin1.root' % (options.pedrun))
         return 
     
+    def parseRunList(self,runlist):
+        # '100,102-105' or a text file with one run (or range) per line -> [100,102,103,104,105]
+        if os.path.isfile(runlist):
+            with open(runlist) as f:
+                items = [l.split('#')[0].strip() for l in f]
+        else:
+            items = runlist.split(',')
+        runs = []
+        for item in items:
+            if not item: continue
+            if '-' in item:
+                first,last = item.split('-')
+                runs += list(range(int(first),int(last)+1))
+            else:
+                runs.append(int(item))
+        return runs
+
+    def parseRunQueue(self,runlist,configFile):
+        # as parseRunList, but each item can carry its own configuration file, e.g.
+        # '100-105,110:configFile_LNF_test.txt' -> [(100,configFile),...,(105,configFile),(110,'configFile_LNF_test.txt')]
+        if os.path.isfile(runlist):
+            with open(runlist) as f:
+                items = [l.split('#')[0].strip() for l in f]
+        else:
+            items = runlist.split(',')
+        queue = []
+        for item in items:
+            if not item: continue
+            runs,_,config = item.partition(':')
+            queue += [(r,config.strip() if config.strip() else configFile) for r in self.parseRunList(runs.strip())]
+        return queue
+
     def rootflip(self,rootfile,key):
         #Necessary conversion from root format to numpy matrix oriented exactly as the output of midas files
-        img_fr = rootfile[key].values().T            #necessary because uproot inverts column and rows with x and y
+        hist = rootfile[key]
+        img_fr = (hist.values() if hasattr(hist,'values') else hist[()]).T            #necessary because uproot inverts column and rows with x and y (h5 datasets are stored as the TH2 values)
         img_fr = img_fr[::-1]                  #necessary to uniform root raw data to midas. This is a vertical flip (raw data differ between ROOT and MIDAS formats)
         return img_fr
 
@@ -366,79 +412,6 @@ class utils:
             factor_mb = 1 / (1024 * 1024)
         return mem * factor_mb
     
-    def conversion_env_variables(self, dslow, odb, i = 0, j_env = 0):
-        env_var = open('modules_config/env_variables.txt','r')
-        env_var = eval(env_var.read())
-        
-        if i == env_var['humidity']:
-            try:
-                conversion = odb.data['History']['Display']['GasSystem']['humidity']['Formula'][1]
-                dslow.loc[j_env,i] = eval(conversion.replace('x',str(dslow[i][j_env])))
-            except:
-                dslow.loc[j_env,i] = -99
-                #print('Warning: no humidity')
-                
-        if i == env_var['atm_temperature']:
-            try:
-                conversion = odb.data['History']['Display']['Environment']['Temperature']['Formula'][0]
-                dslow.loc[j_env,i] = eval(conversion.replace('x',str(dslow[i][j_env])))
-            except:
-                dslow.loc[j_env,i] = -99
-                #print('Warning: no atm temperature')
-                
-        if i == env_var['lime_temperature']:
-            try:
-                conversion = odb.data['History']['Display']['Environment']['Temperature']['Formula'][1]
-                dslow.loc[j_env,i] = eval(conversion.replace('x',str(dslow[i][j_env])))
-            except:
-                dslow.loc[j_env,i] = -99
-                #print('Warning: no lime temperature')
-                    
-        if i == env_var['lime_pressure']:
-            try:
-                conversion = odb.data['History']['Display']['Environment']['Pressure']['Formula'][0]
-                dslow.loc[j_env,i] = eval(conversion.replace('x',str(dslow[i][j_env])))
-            except:
-                dslow.loc[j_env,i] = -99
-                #print('Warning: no lime pressure')
-                
-        if i == env_var['atm_pressure']:
-            try:
-                conversion = odb.data['History']['Display']['Environment']['Pressure']['Formula'][0]
-                dslow.loc[j_env,i] = eval(conversion.replace('x',str(dslow[i][j_env])))
-            except:
-                dslow.loc[j_env,i] = -99
-                #print('Warning: no atm pressure')
-        
-        if i == env_var['mixture_density']:
-            try:
-                conversion = odb.data['History']['Display']['GasSystem']['Mixture Density']['Formula'][1]
-                dslow.loc[j_env,i] = eval(conversion.replace('x',str(dslow[i][j_env])))
-            except:
-                dslow.loc[j_env,i] = -99
-                #print('Warning: no mixture density')
-        
-        return dslow
-    
-    def read_env_variables(self, bank, dslow, odb, j_env=0):
-        import midas.file_reader
-        from datetime import datetime
-        import numpy as np
-        from matplotlib import pyplot as plt
-        import cygno as cy
-        import time
-        import pandas as pd
-        
-        slow = cy.daq_slow2array(bank)
-        #print(slow)
-        dslow.loc[len(dslow)] = slow
-        #print(dslow)
-        for i in dslow.keys():
-            dslow = self.conversion_env_variables(dslow, odb, i, j_env)           
-        j_env = j_env+1
-            
-        return dslow
-        
     def get_odb_pmt_info(self,mf,options,run):
         import cygno as cy
         if (options.tag == 'LNGS' and run>7790) or options.tag == 'LNF' or options.tag == 'MAN':
@@ -492,79 +465,127 @@ class utils:
         fcont.close()
         fout.close()
         
-        #New tree addition for numerical parameters
-        treeparam = ROOT.TTree('Reco_params','Tree with parameters of the reconstruction')
-        ##Camera variables
-        camera_mode = np.array(options.camera_mode,dtype='intc')
-        treeparam.Branch('camera_mode',camera_mode,'camera_mode/I')
-        rebin = np.array(options.rebin,dtype='intc')
-        treeparam.Branch('rebin',rebin,'rebin/I')
-        nsigma = np.array(options.nsigma,dtype='float32')
-        treeparam.Branch('nsigma',nsigma,'nsigma/F')
-        min_neighbors_average = np.array(options.min_neighbors_average,dtype='float32')
-        treeparam.Branch('min_neighbors_average',min_neighbors_average,'min_neighbors_average/F')
-        cimax = np.array(options.cimax,dtype='intc')
-        treeparam.Branch('cimax',cimax,'cimax/I')
-        ##PMT variables
-        pmt_mode = np.array(options.pmt_mode, dtype='intc')
-        treeparam.Branch('pmt_mode', pmt_mode, 'pmt_mode/I')
-        pmt_threshold = np.array(options.threshold, dtype='intc')
-        treeparam.Branch('threshold', pmt_threshold, 'threshold/I')
-        array_channels = np.array(options.board_pmt_channels, dtype='intc')
-        lenchan = len(array_channels)
-        treeparam.Branch('Board_PMT', array_channels, 'Board_PMT['+ str(lenchan) +']/I')
-        height_RMS = np.array(options.height_RMS, dtype='intc')
-        treeparam.Branch('height_RMS', height_RMS, 'height_RMS/I')
-        minPeakDistance = np.array(options.minPeakDistance, dtype='intc')
-        treeparam.Branch('minPeakDistance', minPeakDistance, 'minPeakDistance/I')
-        prominence = np.array(options.prominence, dtype='float32')
-        treeparam.Branch('prominence', prominence, 'prominence/F')
-        fixed_prom = np.array(options.fixed_prom, dtype=bool)
-        treeparam.Branch('fixed_prom', fixed_prom, 'fixed_prom/O')
-        width = np.array(options.width, dtype='float32')
-        treeparam.Branch('width', width, 'width/F')
-        resample = np.array(options.resample, dtype='intc')
-        treeparam.Branch('resample', resample, 'resample/I')
-        
+        # numerical parameters: a tree in the ROOT output, returned for the json of the columnar output
         if params['cameratype'] == 'Flash':
             npixx= 2048
         if params['cameratype'] == 'Fusion':
             npixx= 2304
         if params['cameratype'] == 'Quest':
             npixx= 4096
-        npixx = np.array(npixx, dtype='intc')
-        treeparam.Branch('npixx',npixx,'npixx/I')
-        xmin = np.array(params['xmin'], dtype='intc')
-        treeparam.Branch('xmin',xmin,'xmin/I')
-        xmax = np.array(params['xmax'], dtype='intc')
-        treeparam.Branch('xmax',xmax,'xmax/I')
-        ymin = np.array(params['ymin'], dtype='intc')
-        treeparam.Branch('ymin',ymin,'ymin/I')
-        ymax = np.array(params['ymax'], dtype='intc')
-        treeparam.Branch('ymax',ymax,'ymax/I')
-        
-        dbscan_eps = np.array(params_cl['dbscan_eps'],dtype='float32')
-        treeparam.Branch('dbscan_eps',dbscan_eps,'dbscan_eps/F')
-        dbscan_minsamples = np.array(params_cl['dbscan_minsamples'],dtype='float32')
-        treeparam.Branch('dbscan_minsamples',dbscan_minsamples,'dbscan_minsamples/F')
-        dir_radius = np.array(params_cl['dir_radius'],dtype='float32')
-        treeparam.Branch('dir_radius',dir_radius,'dir_radius/F')
-        dir_min_accuracy = np.array(params_cl['dir_min_accuracy'],dtype='float32')
-        treeparam.Branch('dir_min_accuracy',dir_min_accuracy,'dir_min_accuracy/F')
-        dir_minsamples = np.array(params_cl['dir_minsamples'],dtype='float32')
-        treeparam.Branch('dir_minsamples',dir_minsamples,'dir_minsamples/F')
-        dir_thickness = np.array(params_cl['dir_thickness'],dtype='float32')
-        treeparam.Branch('dir_thickness',dir_thickness,'dir_thickness/F')
-        time_threshold = np.array(params_cl['time_threshold'],dtype='float32')
-        treeparam.Branch('time_threshold',time_threshold,'time_threshold/F')
-        max_attempts = np.array(params_cl['max_attempts'],dtype='float32')
-        treeparam.Branch('max_attempts',max_attempts,'max_attempts/F')
-        isolation_radius = np.array(params_cl['isolation_radius'],dtype='float32')
-        treeparam.Branch('isolation_radius',isolation_radius,'isolation_radius/F')
-        
-        treeparam.Fill()
-        treeparam.Write()
-
+        recoparams = [
+            ##Camera variables
+            ('camera_mode',           np.array(options.camera_mode,dtype='intc')),
+            ('rebin',                 np.array(options.rebin,dtype='intc')),
+            ('nsigma',                np.array(options.nsigma,dtype='float32')),
+            ('min_neighbors_average', np.array(options.min_neighbors_average,dtype='float32')),
+            ('cimax',                 np.array(options.cimax,dtype='intc')),
+            ##PMT variables
+            ('pmt_mode',              np.array(options.pmt_mode, dtype='intc')),
+            ('threshold',             np.array(options.threshold, dtype='intc')),
+            ('Board_PMT',             np.array(options.board_pmt_channels, dtype='intc')),
+            ('height_RMS',            np.array(options.height_RMS, dtype='intc')),
+            ('minPeakDistance',       np.array(options.minPeakDistance, dtype='intc')),
+            ('prominence',            np.array(options.prominence, dtype='float32')),
+            ('fixed_prom',            np.array(options.fixed_prom, dtype=bool)),
+            ('width',                 np.array(options.width, dtype='float32')),
+            ('resample',              np.array(options.resample, dtype='intc')),
+            ##Geometry
+            ('npixx',                 np.array(npixx, dtype='intc')),
+            ('xmin',                  np.array(params['xmin'], dtype='intc')),
+            ('xmax',                  np.array(params['xmax'], dtype='intc')),
+            ('ymin',                  np.array(params['ymin'], dtype='intc')),
+            ('ymax',                  np.array(params['ymax'], dtype='intc')),
+            ##Clustering
+            ('dbscan_eps',            np.array(params_cl['dbscan_eps'],dtype='float32')),
+            ('dbscan_minsamples',     np.array(params_cl['dbscan_minsamples'],dtype='float32')),
+            ('dir_radius',            np.array(params_cl['dir_radius'],dtype='float32')),
+            ('dir_min_accuracy',      np.array(params_cl['dir_min_accuracy'],dtype='float32')),
+            ('dir_minsamples',        np.array(params_cl['dir_minsamples'],dtype='float32')),
+            ('dir_thickness',         np.array(params_cl['dir_thickness'],dtype='float32')),
+            ('time_threshold',        np.array(params_cl['time_threshold'],dtype='float32')),
+            ('max_attempts',          np.array(params_cl['max_attempts'],dtype='float32')),
+            ('isolation_radius',      np.array(params_cl['isolation_radius'],dtype='float32')),
+            ]
+
+        if root_file is not None:
+            #New tree addition for numerical parameters
+            treeparam = ROOT.TTree('Reco_params','Tree with parameters of the reconstruction')
+            leaftypes = {np.dtype('intc'): 'I', np.dtype('float32'): 'F', np.dtype(bool): 'O'}
+            for name,value in recoparams:
+                size = '[{n}]'.format(n=len(value)) if value.ndim else ''
+                treeparam.Branch(name,value,'{n}{s}/{t}'.format(n=name,s=size,t=leaftypes[value.dtype]))
+            treeparam.Fill()
+            treeparam.Write()
+        return dict([(name,value.tolist()) for name,value in recoparams])
+
+    def Param_storage_columnar(self, outdataset, options, total_time, recoparams={}):
+        # equivalent of the gitHash and total_time TNamed objects and of the Reco_params tree (recoparams, as returned
+        # by Param_storage) stored in the ROOT output file
+        import json
+        info = {'gitHash': options.githash, 'total_time': str(total_time), 'run': int(options.run)}
+        info.update(recoparams)
+        with open('{d}/Reco_params.json'.format(d=outdataset),'w') as fout:
+            json.dump(info, fout, indent=1)
+
+
+class EnvVariablesConverter:
+    # slow-control (INPT bank) conversion: the ODB formulas of the environment variables are compiled
+    # once per run into vectorized functions of x, and the converted readings of the run are kept in a
+    # preallocated 2D numpy buffer (one row per bank, one column per channel, grown by doubling it when full)
+
+    # env_variables key -> (ODB display group, ODB display, index of the formula)
+    _formulas = {
+        'humidity'         : ('GasSystem',   'humidity',        1),
+        'atm_temperature'  : ('Environment', 'Temperature',     0),
+        'lime_temperature' : ('Environment', 'Temperature',     1),
+        'lime_pressure'    : ('Environment', 'Pressure',        0),
+        'atm_pressure'     : ('Environment', 'Pressure',        0),
+        'mixture_density'  : ('GasSystem',   'Mixture Density', 1),
+    }
+
+    def __init__(self, odb, header, env_var, size=64):
+        self.header = list(header)
+        # channel name -> column. The ODB names are not guaranteed to be unique (or non-empty): the first one is used
+        self.columns = {}
+        for i,name in enumerate(self.header):
+            if name in self.columns:
+                print("WARNING: slow control channel '{n}' appears more than once in the ODB 'Names Input', using the first one".format(n=name))
+                continue
+            self.columns[name] = i
+        self.buffer = np.zeros((size,len(self.header)))
+        self.nrows = 0
+        self.conversions = {}
+        for key,(group,display,index) in self._formulas.items():
+            column = env_var[key]
+            if column not in self.columns:
+                continue
+            try:
+                formula = odb.data['History']['Display'][group][display]['Formula'][index]
+                self.conversions[self.columns[column]] = eval('lambda x: '+formula, {'np': np, 'math': math})
+            except Exception:
+                self.conversions[self.columns[column]] = None # value set to -99, as when the formula is missing or broken
+
+    def convert(self, values):
+        # returns the converted values of one bank (or of an array of banks), one column per channel
+        rec = np.array(values, dtype='f8')
+        for i,conversion in self.conversions.items():
+            try:
+                rec[...,i] = conversion(rec[...,i]) if conversion else -99
+            except Exception:
+                rec[...,i] = -99
+        return rec
+
+    def append(self, values):
+        # converts one bank and stores it in the buffer. Returns the converted values by channel name
+        if self.nrows == len(self.buffer):
+            self.buffer = np.resize(self.buffer, (2*len(self.buffer),len(self.header)))
+        self.buffer[self.nrows] = self.convert(values)
+        self.nrows += 1
+        row = self.buffer[self.nrows-1]
+        return {name: row[i] for name,i in self.columns.items()}
+
+    def rows(self):
+        return self.buffer[:self.nrows]
 
 class bcolors:
     HEADER = '\033[95m'
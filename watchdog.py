@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+
+# Per-event time and memory budget, enforced inside the worker. Inside the guarded part of the event (the
+# clustering) the reconstruction calls check() at the boundaries of its steps (median filter, noise reduction,
+# clustering, each cluster built, calibrated and profiled): an event over budget raises there
+# EventBudgetExceeded, which the event loop catches: the event is written with its status and partial timings,
+# and the job goes on with the next one. The exception is never raised asynchronously, so the locks, the pools
+# and the ROOT objects of the interrupted step are left in a consistent state.
+#
+#    watchdog.start()
+#    ... (pedestal subtraction, zero suppression: not interrupted)
+#    try:
+#        with watchdog.guard():
+#            ... (clustering, calling watchdog.check() between the steps)
+#    except EventBudgetExceeded as e:
+#        ...
+#    watchdog.stop()
+#
+# A single long step (one DBSCAN fit, one superclustering) is not interrupted: the event is aborted at the
+# next check. With the threaded event loop each thread has its own watchdog, but the RSS is the one of the
+# whole process, so the memory budget includes the growth of the frames reconstructed at the same time.
+
+import time
+from contextlib import contextmanager
+from instrumentation import procRss as rss
+
+STATUS_OK      = 0
+STATUS_TIMEOUT = 1
+STATUS_MEMORY  = 2
+
+class EventBudgetExceeded(Exception):
+    def __init__(self,reason,status,elapsed,rssDelta):
+        self.reason = reason
+        self.status = status
+        self.elapsed = elapsed
+        self.rssDelta = rssDelta
+        super().__init__("{r} budget exceeded after {t:.1f} s, RSS +{m:.0f} MB".format(r=reason,t=elapsed,m=rssDelta/1e6))
+
+class EventWatchdog:
+    def __init__(self,time_budget=0,memory_budget=0,tick=1.):
+        self.time_budget = time_budget       # seconds, 0 = no limit
+        self.memory_budget = memory_budget   # bytes of RSS growth within the event, 0 = no limit
+        self.tick = tick                     # seconds between two readings of the RSS
+        self.enabled = bool(time_budget or memory_budget)
+        self.guarded = False
+        self.t0 = 0
+        self.rss0 = 0
+        self.tmem = 0
+        self.aborted = {'timeout': 0, 'memory': 0}
+
+    def check(self):
+        # called between the steps of the guarded part: raises if the event is over budget (once per event)
+        if not (self.enabled and self.guarded): return
+        now = time.perf_counter()
+        elapsed = now-self.t0
+        if self.time_budget and elapsed > self.time_budget:
+            self.guarded = False
+            self.aborted['timeout'] += 1
+            raise EventBudgetExceeded('timeout',STATUS_TIMEOUT,elapsed,rss()-self.rss0)
+        if self.memory_budget and now-self.tmem >= self.tick:
+            self.tmem = now
+            delta = rss()-self.rss0
+            if delta > self.memory_budget:
+                self.guarded = False
+                self.aborted['memory'] += 1
+                raise EventBudgetExceeded('memory',STATUS_MEMORY,elapsed,delta)
+
+    def start(self):
+        self.t0 = time.perf_counter()
+        self.tmem = 0
+        self.rss0 = rss() if self.enabled else 0
+
+    def stop(self):
+        self.guarded = False
+
+    def elapsed(self):
+        return time.perf_counter()-self.t0
+
+    @contextmanager
+    def guard(self):
+        self.guarded = True
+        self.check() # the budget may already be over before the guarded part
+        try:
+            yield
+        finally:
+            self.guarded = False